@@ -20,6 +20,9 @@ from application.cms.models import user_measure, DataSource, Topic, Subtopic
 from application.cms.page_service import page_service
 from application.utils import create_and_send_activation_email, user_can
 from application.cms.utils import get_form_errors
+from application.sitebuilder.models import Build
+
+RECENT_BUILDS_SHOWN = 10
 
 
 @admin_blueprint.route("")
@@ -208,7 +211,8 @@ def make_rdu_user(user_id):
 @login_required
 @user_can(MANAGE_SYSTEM)
 def site_build():
-    return render_template("admin/site_build.html")
+    builds = Build.query.order_by(desc(Build.created_at)).limit(RECENT_BUILDS_SHOWN).all()
+    return render_template("admin/site_build.html", builds=builds)
 
 
 @admin_blueprint.route("/data-sources")
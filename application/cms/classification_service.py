@@ -7,7 +7,7 @@ from application.cms.exceptions import ClassificationNotFoundException
 
 from application.cms.models import Classification, Ethnicity, DimensionClassification
 
-from application.utils import setup_module_logging
+from application.utils import SlugIndex, setup_module_logging
 
 logger = logging.Logger(__name__)
 
@@ -25,9 +25,13 @@ which chain together in many-to-many relationships
 class ClassificationService:
     def __init__(self):
         self.logger = logger
+        self.classification_id_cache_enabled = False
+        self.__classification_ids = None
+        self.__ethnicity_slug_index = SlugIndex(Ethnicity, Ethnicity.value)
 
     def init_app(self, app):
         self.logger = setup_module_logging(self.logger, app.config["LOG_LEVEL"])
+        self.classification_id_cache_enabled = app.config["CLASSIFICATION_ID_CACHE"]
         self.logger.info("Initialised classification service")
 
     """
@@ -67,6 +71,7 @@ class ClassificationService:
         self.delete_unused_values_from_database(classification)
         db.session.delete(classification)
         db.session.commit()
+        self.clear_classification_id_cache()
 
     def delete_unused_values_from_database(self, classification):
         if DimensionClassification.query.filter_by(classification_id=classification.id).count() == 0:
@@ -79,6 +84,34 @@ class ClassificationService:
         except NoResultFound:
             raise ClassificationNotFoundException("Classification with id %s not found" % classification_id)
 
+    def classification_exists(self, classification_id):
+        """
+        Whether there's a classification with this id in the database.
+
+        If the classification id cache is enabled, every id is loaded the first time this is called, and only an id
+        which isn't among them is looked up again (as another process may have added it since). The cache is cleared
+        when classifications are synchronised or deleted.
+        """
+        if not self.classification_id_cache_enabled:
+            return db.session.query(Classification.query.filter_by(id=classification_id).exists()).scalar()
+
+        classification_ids = self.__classification_ids
+        if classification_ids is None:
+            classification_ids = {classification_id for (classification_id,) in db.session.query(Classification.id)}
+            self.__classification_ids = classification_ids
+
+        if classification_id in classification_ids:
+            return True
+
+        if db.session.query(Classification.query.filter_by(id=classification_id).exists()).scalar():
+            classification_ids.add(classification_id)
+            return True
+
+        return False
+
+    def clear_classification_id_cache(self):
+        self.__classification_ids = None
+
     @staticmethod
     def get_all_classifications():
         return Classification.query.all()
@@ -103,12 +136,8 @@ class ClassificationService:
         values = Ethnicity.query.all()
         return [v.value for v in values]
 
-    @staticmethod
-    def get_value_by_slug(slug):
-        from slugify import slugify
-
-        value_list = [v for v in Ethnicity.query.all() if slugify(v.value) == slug]
-        return value_list[0] if len(value_list) > 0 else None
+    def get_value_by_slug(self, slug):
+        return self.__ethnicity_slug_index.get(slug)
 
     @staticmethod
     def get_all_classification_values():
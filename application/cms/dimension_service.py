@@ -1,4 +1,7 @@
+from contextlib import contextmanager
+
 from flask import current_app
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
 
 from application import db
@@ -8,9 +11,10 @@ from application.cms.exceptions import (
     PageUnEditable,
     ClassificationFinderClassificationNotFoundException,
 )
+from application.cms.classification_service import classification_service
 from application.cms.models import Dimension, Chart, Table
 from application.cms.service import Service
-from application.data.ethnicity_classification_matcher import EthnicityClassificationMatcher, BuilderClassification
+from application.data.ethnicity_classification_matcher import BuilderClassification, get_classification_matcher
 from application.utils import create_guid
 
 
@@ -33,10 +37,9 @@ class DimensionService(Service):
                 time_period=time_period,
                 summary=summary,
                 measure_version=measure_version,
-                position=measure_version.dimensions.count(),
+                position=len(measure_version.dimensions),
             )
 
-            measure_version.dimensions.append(dimension)
             db.session.commit()
 
             return measure_version.get_dimension(dimension.guid)
@@ -186,18 +189,36 @@ class DimensionService(Service):
     def __set_table_dimension_classification(self, dimension, classification):
         table = dimension.dimension_table or Table()
 
-        table.classification_id = classification.classification_id
-        table.includes_parents = classification.includes_parents
-        table.includes_all = classification.includes_all
-        table.includes_unknown = classification.includes_unknown
+        with DimensionService.__classification_savepoint(classification.classification_id):
+            table.classification_id = classification.classification_id
+            table.includes_parents = classification.includes_parents
+            table.includes_all = classification.includes_all
+            table.includes_unknown = classification.includes_unknown
 
-        db.session.add(table)
-        db.session.flush()  # Flush to DB will generate PK if it's a newly-created instance
+            db.session.add(table)
+            db.session.flush()  # Flush to DB will generate PK if it's a newly-created instance
 
         dimension.dimension_table = table
 
         db.session.commit()
 
+    @staticmethod
+    @contextmanager
+    def __classification_savepoint(classification_id):
+        """
+        Sets a chart or table's classification in a savepoint. Another process may have deleted the classification
+        since this one cached its id, in which case only the classification change is undone and
+        ClassificationFinderClassificationNotFoundException is raised, as if the classification had never been found.
+        """
+        try:
+            with db.session.begin_nested():
+                yield
+        except IntegrityError:
+            classification_service.clear_classification_id_cache()
+            raise ClassificationFinderClassificationNotFoundException(
+                "Classification id %s is no longer in the database" % classification_id
+            )
+
     @staticmethod
     def __get_classification_from_request(code_from_builder, ethnicity_values):
         classification_finder = DimensionService.__get_classification_matcher()
@@ -217,10 +238,7 @@ class DimensionService(Service):
 
     @staticmethod
     def __get_classification_matcher():
-        return EthnicityClassificationMatcher(
-            ethnicity_standardiser=current_app.classification_finder.standardiser,
-            ethnicity_classification_collection=current_app.classification_finder.classification_collection,
-        )
+        return get_classification_matcher(current_app.classification_finder.current())
 
     def __set_chart_dimension_classification_through_builder(self, dimension, data):
         code_from_builder, ethnicity_values = DimensionService.__get_builder_classification_data(data)
@@ -245,13 +263,14 @@ class DimensionService(Service):
     def __set_chart_dimension_classification(self, dimension, classification):
         chart = dimension.dimension_chart or Chart()
 
-        chart.classification_id = classification.classification_id
-        chart.includes_parents = classification.includes_parents
-        chart.includes_all = classification.includes_all
-        chart.includes_unknown = classification.includes_unknown
+        with DimensionService.__classification_savepoint(classification.classification_id):
+            chart.classification_id = classification.classification_id
+            chart.includes_parents = classification.includes_parents
+            chart.includes_all = classification.includes_all
+            chart.includes_unknown = classification.includes_unknown
 
-        db.session.add(chart)
-        db.session.flush()  # Flush to DB will generate PK if it's a newly-created instance
+            db.session.add(chart)
+            db.session.flush()  # Flush to DB will generate PK if it's a newly-created instance
 
         dimension.dimension_chart = chart
 
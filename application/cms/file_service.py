@@ -50,6 +50,10 @@ class PageFileSystem:
         full_path = "%s/%s" % (self.page_identifier, fs_path)
         self.file_system.read(full_path, local_path)
 
+    def open(self, fs_path):
+        full_path = "%s/%s" % (self.page_identifier, fs_path)
+        return self.file_system.open(full_path)
+
     def write(self, local_path, fs_path):
         full_path = "%s/%s" % (self.page_identifier, fs_path)
         self.file_system.write(local_path, full_path)
@@ -107,6 +111,10 @@ class S3FileSystem:
             print("Could not decode %s using %s" % (fs_path, "utf-8 or iso-8859-1"))
             raise e
 
+    def open(self, fs_path):
+        """Returns a readable stream of the object's bytes, which is fetched from S3 as it is read."""
+        return self.s3.Object(self.bucket_name, fs_path).get()["Body"]
+
     def write(self, local_path, fs_path, max_age_seconds=300, strict=True):
 
         with open(file=local_path, mode="rb") as file:
@@ -163,6 +171,10 @@ class LocalFileSystem:
         full_path = "%s/%s" % (self.root, fs_path)
         shutil.copyfile(full_path, local_path)
 
+    def open(self, fs_path):
+        full_path = "%s/%s" % (self.root, fs_path)
+        return open(full_path, "rb")
+
     def write(self, local_path, fs_path):
         full_path = "%s/%s" % (self.root, fs_path)
 
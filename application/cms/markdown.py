@@ -1,3 +1,8 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import bleach
 from markdown import Markdown
 from markdown.extensions import Extension
 from markdown.treeprocessors import Treeprocessor
@@ -34,6 +39,71 @@ class DesignSystemMarkdownExtension(Extension):
         md.treeprocessors.register(item=MarkdownCleanerProcessor(md), name="cleaner-markdown", priority=0)
 
 
+# Enough for every markdown field of every published measure version, at a few KB of HTML each.
+MARKDOWN_CACHE_SIZE = 4096
+
+
+class CachedMarkdownRenderer:
+    """
+    Cleans and renders markdown fields to HTML, remembering the output for the most recently rendered `max_size` texts.
+
+    Pages render the same fields over and over (every version of a measure, its `/latest` copy, and its social
+    description), so rendering is cached by a hash of the input text. Setting up a Markdown converter is costly too, so
+    each thread keeps one to reuse; converters hold state while converting, so can't be shared between threads.
+    """
+
+    def __init__(self, max_size=MARKDOWN_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def __str__(self):
+        return f"{self.hits} hits, {self.misses} misses, {len(self._cache)} cached"
+
+    def render(self, text):
+        if not text:
+            return ""
+
+        key = hashlib.sha256(text.encode("utf-8")).digest()
+        with self._lock:
+            html = self._cache.get(key)
+            if html is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+
+        html = self.convert(bleach.clean(text))
+
+        with self._lock:
+            self._cache[key] = html
+            if len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+        return html
+
+    def convert(self, text):
+        converter = getattr(self._local, "converter", None)
+        if converter is None:
+            converter = self._local.converter = Markdown(extensions=[DesignSystemMarkdownExtension()])
+
+        try:
+            return converter.convert(text)
+        finally:
+            converter.reset()
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+markdown_renderer = CachedMarkdownRenderer()
+
+
 def markdown(text):
-    md = Markdown(extensions=[DesignSystemMarkdownExtension()])
-    return md.convert(text)
+    return markdown_renderer.convert(text)
@@ -395,11 +395,7 @@ class MeasureVersion(db.Model, CopyableModel):
     lowest_level_of_geography = db.relationship("LowestLevelOfGeography", back_populates="measure_versions")
     uploads = db.relationship("Upload", back_populates="measure_version", cascade="all, delete-orphan")
     dimensions = db.relationship(
-        "Dimension",
-        back_populates="measure_version",
-        lazy="dynamic",
-        order_by="Dimension.position",
-        cascade="all, delete-orphan",
+        "Dimension", back_populates="measure_version", order_by="Dimension.position", cascade="all, delete-orphan"
     )
     data_sources = db.relationship(
         "DataSource", secondary="data_source_in_measure_version", back_populates="measure_versions"
@@ -929,6 +925,9 @@ class Upload(db.Model, CopyableModel):
     file_name = db.Column(db.String(255))
     description = db.Column(db.Text())
     size = db.Column(db.String(255))
+    # The classifications found for the file's ethnicity column when it was uploaded, as from the
+    # `get-valid-classifications-for-data` endpoint in compact form (or null if the file has no ethnicity column).
+    ethnicity_classifications = db.Column(JSON)
 
     measure_version_id = db.Column(db.Integer, nullable=False)
 
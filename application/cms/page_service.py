@@ -1,10 +1,10 @@
 from datetime import datetime, date
-from typing import Iterable, Tuple, List
+from typing import Iterable, Tuple, List, Set
 
 from flask import request
 from slugify import slugify
-from sqlalchemy import func, desc
-from sqlalchemy.orm import joinedload
+from sqlalchemy import func, desc, or_
+from sqlalchemy.orm import Load, joinedload, selectinload
 from sqlalchemy.orm.exc import NoResultFound
 
 from application import db
@@ -20,6 +20,8 @@ from application.cms.exceptions import (
     CannotChangeSubtopicOncePublished,
 )
 from application.cms.models import (
+    DataSource,
+    Dimension,
     Measure,
     MeasureVersion,
     Subtopic,
@@ -316,6 +318,7 @@ class PageService(Service):
         message = "EDIT MEASURE: WTForm data to update measure version: %s" % measure_version_form.data
         self.logger.info(message)
 
+        subtopic_changed = False
         subtopic_id_from_form = kwargs.get("subtopic_id")
         if subtopic_id_from_form is not None and measure_version.measure.subtopic.id != int(subtopic_id_from_form):
             if measure_version.version != "1.0":
@@ -329,6 +332,7 @@ class PageService(Service):
             else:
                 measure_version.measure.subtopics = [new_subtopic]
                 measure_version.measure.position = len(new_subtopic.measures)
+                subtopic_changed = True
 
         status = kwargs.get("status")
         if status is not None:
@@ -358,6 +362,10 @@ class PageService(Service):
 
         db.session.commit()
 
+        if subtopic_changed:
+            # An incremental build wouldn't remove the pages at the measure's old URL.
+            request_build(full_rebuild=True)
+
         return measure_version
 
     @staticmethod
@@ -388,6 +396,7 @@ class PageService(Service):
         return message
 
     def delete_measure_version(self, measure_version: MeasureVersion):
+        was_published = measure_version.published_at is not None
         previous_version = measure_version.get_previous_version()
         if previous_version:
             previous_version.latest = True
@@ -397,6 +406,10 @@ class PageService(Service):
         db.session.delete(measure_version)
         db.session.commit()
 
+        if was_published:
+            # An incremental build wouldn't remove the deleted version's pages.
+            request_build(full_rebuild=True)
+
     def mark_measure_version_published(self, measure_version: MeasureVersion):
         if measure_version.published_at is None:
             measure_version.published_at = date.today()
@@ -449,6 +462,47 @@ class PageService(Service):
                 measures_to_publish.append(measure)
         return measures_to_publish
 
+    @staticmethod
+    def get_publishable_site_graph() -> List[Topic]:
+        """Returns the topics to build, as `get_topics(include_testing_space=False)` does, but with everything the
+        static site build renders below them - subtopics, measures, all of their versions, and each version's dimensions
+        (with charts and tables), uploads and data sources (with publishers) - already loaded. This takes a fixed
+        handful of queries however big the site is, and the build then works from the in-memory graph rather than going
+        back to the database for every page."""
+        measures = selectinload(Topic.subtopics).selectinload(Subtopic.measures)
+        topics = Topic.query.filter(Topic.slug != TESTING_SPACE_SLUG).options(*_publishable_measure_options(measures))
+
+        return sorted(topics.all(), key=lambda topic: topic.title)
+
+    @staticmethod
+    def get_publishable_measures(measure_ids: Iterable[int]) -> List[Measure]:
+        """Returns the measures with these ids, with everything the static site build renders below them already
+        loaded, as `get_publishable_site_graph` does."""
+        return (
+            Measure.query.filter(Measure.id.in_(list(measure_ids)))
+            .options(*_publishable_measure_options(Load(Measure)))
+            .order_by(Measure.id)
+            .all()
+        )
+
+    @staticmethod
+    def get_measure_ids_changed_since(since: datetime) -> Set[int]:
+        """Returns the ids of measures with a publishable version that has been updated or published, or has had one of
+        its dimensions updated, since the given time. Incremental builds only re-render the pages of these measures."""
+        publishable_measure_versions = db.session.query(MeasureVersion.measure_id).filter(
+            MeasureVersion.status == "APPROVED", MeasureVersion.published_at.isnot(None)
+        )
+
+        # `published_at` is only a date, so this errs on the side of re-rendering anything published on the same day.
+        updated_or_published = publishable_measure_versions.filter(
+            or_(MeasureVersion.updated_at > since, MeasureVersion.published_at >= since.date())
+        )
+        dimension_updated = publishable_measure_versions.join(
+            Dimension, Dimension.measure_version_id == MeasureVersion.id
+        ).filter(Dimension.updated_at > since)
+
+        return {measure_id for (measure_id,) in updated_or_published.union(dimension_updated)}
+
     @staticmethod
     def first_published_date(measure_version):
         versions = measure_version.previous_minor_versions()
@@ -526,4 +580,22 @@ class PageService(Service):
         return True
 
 
+def _publishable_measure_options(measures):
+    """The loader options for everything the static site build renders below the measures loaded by `measures`."""
+    versions = measures.selectinload(Measure.versions)
+    dimensions = versions.selectinload(MeasureVersion.dimensions)
+    data_sources = versions.selectinload(MeasureVersion.data_sources)
+
+    return [
+        measures.selectinload(Measure.subtopics).joinedload(Subtopic.topic),
+        versions.joinedload(MeasureVersion.lowest_level_of_geography),
+        versions.selectinload(MeasureVersion.uploads),
+        dimensions.joinedload(Dimension.dimension_chart),
+        dimensions.joinedload(Dimension.dimension_table),
+        data_sources.joinedload(DataSource.publisher),
+        data_sources.joinedload(DataSource.type_of_statistic),
+        data_sources.joinedload(DataSource.frequency_of_release),
+    ]
+
+
 page_service = PageService()
@@ -1,3 +1,5 @@
+import csv
+import json
 import os
 import tempfile
 
@@ -18,8 +20,12 @@ from application.cms.exceptions import (
 from application.cms.models import Upload
 from application.cms.scanner_service import scanner_service
 from application.cms.service import Service
+from application.data.ethnicity_data_set import read_unique_ethnicities
 from application.utils import create_guid
 
+# A column with more distinct values than this is unlikely to really be ethnicities, so isn't worth classifying.
+MAX_UPLOAD_ETHNICITIES = 1000
+
 
 class UploadService(Service):
     def __init__(self):
@@ -78,6 +84,26 @@ class UploadService(Service):
         with open(filename, "w") as to_sanitise:
             to_sanitise.write(contents)
 
+    def classify_file(self, filename, encoding="utf-8-sig"):
+        """
+        Finds the ethnicity classifications for a CSV file's ethnicity column (found by the same header rules as
+        EthnicityDataset), reading the file once and classifying each distinct value once.
+
+        :return: The compact output of the `get-valid-classifications-for-data` endpoint for the column's distinct
+        values, with the column's header under "ethnicity_column" and the values under "ethnicities", or None if the
+        file has no ethnicity column (or one which can't be ethnicities)
+        """
+        with open(filename, newline="", encoding=encoding) as csv_file:
+            ethnicity_column, ethnicities = read_unique_ethnicities(csv.reader(csv_file))
+
+        if ethnicity_column is None or not ethnicities or len(ethnicities) > MAX_UPLOAD_ETHNICITIES:
+            return None
+
+        classifications = json.loads(
+            self.app.classification_finder.find_classifications_as_json(ethnicities, compact=True)
+        )
+        return {"ethnicity_column": ethnicity_column, "ethnicities": ethnicities, **classifications}
+
     def delete_upload_files(self, measure_version, file_name):
         try:
             page_file_system = self.app.file_service.page_system(measure_version)
@@ -89,14 +115,17 @@ class UploadService(Service):
         page_file_system = self.app.file_service.page_system(measure_version)
         return page_file_system.list_files("data")
 
-    def get_measure_download(self, upload, file_name, directory):
+    def open_measure_download(self, upload, file_name, directory):
+        """Returns a readable stream of the bytes of an uploaded file. The caller is responsible for closing it."""
         page_file_system = self.app.file_service.page_system(upload.measure_version)
-        output_file = tempfile.NamedTemporaryFile(delete=False)
         key = "%s/%s" % (directory, file_name)
-        page_file_system.read(key, output_file.name)
-        return output_file.name
+        return page_file_system.open(key)
 
-    def upload_data(self, measure_version, file, filename=None):
+    def upload_data(self, measure_version, file, filename=None, upload=None):
+        """
+        Checks and saves an uploaded file. If `upload` is given, the classifications found for the file are stored on
+        it, so that the chart and table builders don't have to find them again.
+        """
         page_file_system = self.app.file_service.page_system(measure_version)
         if not filename:
             filename = file.name
@@ -107,8 +136,10 @@ class UploadService(Service):
             self.validate_file(tmp_file)
             self.sanitise_file(tmp_file)
 
+            scan_passed = False
             try:
                 scanner_service.scan_file(filename=tmp_file, fileobj=open(tmp_file, "rb"))
+                scan_passed = True
 
             except UploadCheckPending:
                 pass
@@ -116,6 +147,16 @@ class UploadService(Service):
             except UploadError:
                 raise
 
+            if upload is not None:
+                # Only parse files which have been scanned and found clean; the builders find the classifications
+                # themselves for the rest.
+                upload.ethnicity_classifications = None
+                if scan_passed:
+                    try:
+                        upload.ethnicity_classifications = self.classify_file(tmp_file)
+                    except (csv.Error, UnicodeDecodeError):
+                        self.logger.exception("Could not classify %s" % filename)
+
             self.logger.info("Uploading file to AWS")
             page_file_system.write(tmp_file, "source/%s" % secure_filename(filename))
 
@@ -167,15 +208,8 @@ class UploadService(Service):
             upload.seek(0, os.SEEK_END)
             size = upload.tell()
             upload.seek(0)
-            self.upload_data(measure_version, upload, filename=file_name)
-            db_upload = Upload(
-                guid=guid,
-                title=title,
-                file_name=file_name,
-                description=description,
-                measure_version=measure_version,
-                size=size,
-            )
+            db_upload = Upload(guid=guid, title=title, file_name=file_name, description=description, size=size,)
+            self.upload_data(measure_version, upload, filename=file_name, upload=db_upload)
 
             measure_version.uploads.append(db_upload)
             db.session.commit()
@@ -203,7 +237,7 @@ class UploadService(Service):
                 size = file.tell()
                 file.seek(0)
                 file.size = size
-                upload_service.upload_data(measure_version, file, filename=file_name)
+                upload_service.upload_data(measure_version, file, filename=file_name, upload=upload)
                 if upload.file_name != file_name:
                     upload_service.delete_upload_files(measure_version=measure_version, file_name=upload.file_name)
                 upload.file_name = file_name
@@ -212,7 +246,7 @@ class UploadService(Service):
                 size = file.tell()
                 file.seek(0)
                 file.size = size
-                upload_service.upload_data(measure_version, file, filename=file.filename)
+                upload_service.upload_data(measure_version, file, filename=file.filename, upload=upload)
                 if upload.file_name != file.filename:
                     upload_service.delete_upload_files(measure_version=measure_version, file_name=upload.file_name)
                 upload.file_name = file.filename
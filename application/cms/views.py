@@ -911,6 +911,26 @@ def get_measure_version_uploads(topic_slug, subtopic_slug, measure_slug, version
     return json.dumps({"uploads": uploads}), 200
 
 
+@cms_blueprint.route(
+    "/<topic_slug>/<subtopic_slug>/<measure_slug>/<version>/uploads/<upload_guid>/classifications", methods=["GET"]
+)
+@login_required
+def get_upload_classifications(topic_slug, subtopic_slug, measure_slug, version, upload_guid):
+    """
+    The ethnicity classifications found for an uploaded file when it was uploaded, in the same form as the compact
+    output of `get_valid_classifications` for the distinct values of its ethnicity column
+
+    :return: 404 if the file has no ethnicity column, or was uploaded before classifications were stored
+    """
+    *_, upload_object = page_service.get_measure_version_hierarchy(
+        topic_slug, subtopic_slug, measure_slug, version, upload_guid=upload_guid
+    )
+    if upload_object.ethnicity_classifications is None:
+        abort(404)
+
+    return json.dumps(upload_object.ethnicity_classifications), 200
+
+
 def _build_is_required(page, req, beta_publication_states):
     if get_bool(req.args.get("build")) and page.eligible_for_build(beta_publication_states):
         return True
@@ -925,12 +945,32 @@ def get_valid_classifications():
 
     It cleans up data and identifies possible ethnicity classifications in use for chartbuilder and tablebuilder
 
+    If "compact" is set, each classification's definition is listed once under "definitions", and referred to by
+    "classification_id" in the list of classifications.
+
     :return: A list of processed versions of input data using different "classifications"
     """
     request_data = request.json["data"]
-    valid_classifications_data = current_app.classification_finder.find_classifications(request_data)
+    compact = get_bool(request.json.get("compact", False))
+
+    return current_app.classification_finder.find_classifications_as_json(request_data, compact=compact), 200
+
+
+@cms_blueprint.route("/get-valid-classifications-for-datasets", methods=["POST"])
+@login_required
+def get_valid_classifications_for_datasets():
+    """
+    A batch version of `get_valid_classifications`, for classifying many lists of ethnicities in one request
+
+    :return: A list with the same output as `get_valid_classifications` for each list in `datasets`, in the same order
+    """
+    datasets = request.json.get("datasets")
+    if not isinstance(datasets, list) or not all(isinstance(dataset, list) for dataset in datasets):
+        return json.dumps({"status": "BAD REQUEST", "status_code": 400}), 400
+
+    results = current_app.classification_finder.find_classifications_for_datasets(datasets)
 
-    return json.dumps({"classifications": valid_classifications_data}), 200
+    return json.dumps({"results": [{"classifications": classifications} for classifications in results]}), 200
 
 
 @cms_blueprint.route("/set-dimension-order", methods=["POST"])
@@ -1347,7 +1387,8 @@ def update_data_source(topic_slug, subtopic_slug, measure_slug, version, data_so
         flash(message, "info")
 
         if data_source.associated_with_published_measure_versions:
-            build_service.request_build()
+            # Data source edits don't touch measure version timestamps, so an incremental build wouldn't pick them up.
+            build_service.request_build(full_rebuild=True)
 
         return redirect(
             url_for(
@@ -64,6 +64,18 @@ class Config:
         "ETHNICITY_CLASSIFICATION_FINDER_CLASSIFICATIONS",
         "./application/data/static/standardisers/classification_definitions.csv",
     )
+    # Snapshots of the loaded classification finder are saved here, so later processes can skip parsing the CSVs. Off by
+    # default: the directory must be private to the user the app runs as, as snapshots are unpickled.
+    ETHNICITY_CLASSIFICATION_FINDER_SNAPSHOT_DIR = os.environ.get("ETHNICITY_CLASSIFICATION_FINDER_SNAPSHOT_DIR")
+    # How often each worker checks whether the classification files have changed, and reloads them if so (0 for never)
+    ETHNICITY_CLASSIFICATION_FINDER_RELOAD_SECONDS = int(
+        os.environ.get("ETHNICITY_CLASSIFICATION_FINDER_RELOAD_SECONDS", 60)
+    )
+    ETHNICITY_CLASSIFICATION_FINDER_SYNCHRONISE_ON_RELOAD = get_bool(
+        os.environ.get("ETHNICITY_CLASSIFICATION_FINDER_SYNCHRONISE_ON_RELOAD", False)
+    )
+    # Remember which classification ids are in the database, rather than looking one up on every chart or table save
+    CLASSIFICATION_ID_CACHE = get_bool(os.environ.get("CLASSIFICATION_ID_CACHE", True))
 
     SIMPLE_CHART_BUILDER = get_bool(os.environ.get("SIMPLE_CHART_BUILDER", False))
     RDU_SITE = os.environ.get("RDU_SITE", "https://www.ethnicity-facts-figures.service.gov.uk")
@@ -74,6 +86,15 @@ class Config:
     BUILD_SITE = get_bool(os.environ.get("BUILD_SITE", False))
     PUSH_SITE = get_bool(os.environ.get("PUSH_SITE", False))
     DEPLOY_SITE = get_bool(os.environ.get("DEPLOY_SITE", False))
+    INCREMENTAL_BUILD = get_bool(os.environ.get("INCREMENTAL_BUILD", False))
+    BUILD_PROCESSES = int(os.environ.get("BUILD_PROCESSES", 1))
+    DEPLOY_THREADS = int(os.environ.get("DEPLOY_THREADS", 16))
+    BUILD_LEASE_SECONDS = int(os.environ.get("BUILD_LEASE_SECONDS", 5 * 60))
+    BUILD_COALESCE_SECONDS = int(os.environ.get("BUILD_COALESCE_SECONDS", 15))
+    BUILD_POLL_SECONDS = int(os.environ.get("BUILD_POLL_SECONDS", 60))
+    # Off by default: the directory must be private to the user the app runs as, as cached CSVs are published as is
+    DIMENSION_CSV_CACHE_DIR = os.environ.get("DIMENSION_CSV_CACHE_DIR")
+    DIMENSION_CSV_CACHE_MAX_BYTES = int(os.environ.get("DIMENSION_CSV_CACHE_MAX_BYTES", 256 * 1024 * 1024))
 
     ATTACHMENT_SCANNER_ENABLED = get_bool(os.environ.get("ATTACHMENT_SCANNER_ENABLED", False))
     ATTACHMENT_SCANNER_URL = os.environ.get("ATTACHMENT_SCANNER_URL", "")
@@ -122,6 +143,10 @@ class TestConfig(DevConfig):
     LOGIN_DISABLED = False
     WORK_WITH_REMOTE = False
     FILE_SERVICE = "Local"
+    DIMENSION_CSV_CACHE_DIR = None
+    ETHNICITY_CLASSIFICATION_FINDER_SNAPSHOT_DIR = None
+    ETHNICITY_CLASSIFICATION_FINDER_RELOAD_SECONDS = 0
+    CLASSIFICATION_ID_CACHE = False
 
     WTF_CSRF_ENABLED = False
     SESSION_COOKIE_SECURE = False
@@ -1,20 +1,32 @@
-import calendar
 from collections import defaultdict
 from datetime import date, timedelta
+from functools import lru_cache
 
 from flask import url_for
 from slugify import slugify
-from sqlalchemy import func
+from sqlalchemy import Date, cast, func
 from trello.exceptions import TokenError
 
+from application import db
 from application.cms.classification_service import classification_service
-from application.cms.models import MeasureVersion, LowestLevelOfGeography
+from application.cms.models import (
+    DataSource,
+    LowestLevelOfGeography,
+    Measure,
+    MeasureVersion,
+    Organisation,
+    Subtopic,
+    Topic,
+)
+from application.dashboard.models import (
+    ClassificationByDimension,
+    EthnicGroupByDimension,
+    LatestPublishedMeasureVersionByGeography,
+)
 from application.dashboard.trello_service import trello_service
+from application.utils import SlugIndex
 
-# We import everything from application.dashboard.models locally where needed.
-# This prevents Alembic from discovering the models and trying to create the
-# materialized views as tables, eg when creating a migration or using create_all()
-# in test setup.
+_geography_slug_index = SlugIndex(LowestLevelOfGeography, LowestLevelOfGeography.name)
 
 
 def get_published_measures_by_years_and_months():
@@ -37,35 +49,35 @@ def get_published_measures_by_years_and_months():
 
 
 def get_published_dashboard_data():
-
-    # GET DATA
-    # get measures at their 1.0 publish date
-    original_publications = (
-        MeasureVersion.published_first_versions()
-        .order_by(MeasureVersion.published_at.desc(), MeasureVersion.title)
-        .all()
-    )
-
-    # get measures at their 2.0, 3.0 major update dates
-    major_updates = (
-        MeasureVersion.published_updates_first_versions()
-        .order_by(MeasureVersion.published_at.desc(), MeasureVersion.title)
-        .all()
-    )
-
-    # get first date to start point for data table
-    first_publication = (
-        MeasureVersion.query.filter(MeasureVersion.published_at.isnot(None))
-        .order_by(MeasureVersion.published_at.asc())
-        .first()
-    )
+    # get the first date as the start point for the data table
+    first_publication_date = db.session.query(func.min(MeasureVersion.published_at)).scalar()
+
+    # get measures at their 1.0 publish date and their 2.0, 3.0 major update dates, bucketed into the weeks (starting
+    # on Monday) they were published in
+    publications_by_week = defaultdict(lambda: {"publications": [], "major_updates": []})
+    number_of_publications = number_of_major_updates = 0
+    previous_measure_version_id = None
+
+    for publication in _get_published_major_versions_with_week():
+        # A measure version is listed once for each of its subtopics and data sources, first with the ones the ORM
+        # would use for `measure.subtopic` and `primary_data_source`
+        if publication.id == previous_measure_version_id:
+            continue
+        previous_measure_version_id = publication.id
+
+        if publication.version == "1.0":
+            publications_by_week[publication.week]["publications"].append(publication)
+            number_of_publications += 1
+        else:
+            publications_by_week[publication.week]["major_updates"].append(publication)
+            number_of_major_updates += 1
 
     # BUILD CONTEXT
     # top level data
     data = {
-        "number_of_publications": len(original_publications),
-        "number_of_major_updates": len(major_updates),
-        "first_publication": first_publication.published_at,
+        "number_of_publications": number_of_publications,
+        "number_of_major_updates": number_of_major_updates,
+        "first_publication": first_publication_date,
     }
 
     weeks = []
@@ -73,26 +85,20 @@ def get_published_dashboard_data():
     cumulative_number_of_major_updates = []
 
     # week by week rows
-    for d in _from_month_to_month(first_publication.published_at, date.today()):
-        c = calendar.Calendar(calendar.MONDAY).monthdatescalendar(d.year, d.month)
-        for week in c:
-            if _in_range(week, first_publication.published_at, d.month):
-
-                publications = [page for page in original_publications if _page_in_week(page, week)]
-                updates = [updated_page for updated_page in major_updates if _page_in_week(updated_page, week)]
-                weeks.append({"week": week[0], "publications": publications, "major_updates": updates})
-
-                if not cumulative_number_of_major_updates:
-                    cumulative_number_of_major_updates.append(len(updates))
-                else:
-                    last_total = cumulative_number_of_major_updates[-1]
-                    cumulative_number_of_major_updates.append(last_total + len(updates))
-
-                if not cumulative_number_of_pages:
-                    cumulative_number_of_pages.append(len(publications))
-                else:
-                    last_total = cumulative_number_of_pages[-1]
-                    cumulative_number_of_pages.append(last_total + len(publications))
+    if first_publication_date:
+        total_pages = total_major_updates = 0
+        week = _start_of_week(first_publication_date)
+        while week <= date.today():
+            publications = publications_by_week[week]["publications"]
+            updates = publications_by_week[week]["major_updates"]
+            weeks.append({"week": week, "publications": publications, "major_updates": updates})
+
+            total_pages += len(publications)
+            total_major_updates += len(updates)
+            cumulative_number_of_pages.append(total_pages)
+            cumulative_number_of_major_updates.append(total_major_updates)
+
+            week += timedelta(weeks=1)
 
     weeks.reverse()
     data["weeks"] = weeks
@@ -102,10 +108,39 @@ def get_published_dashboard_data():
     return data
 
 
-def get_ethnic_groups_dashboard_data():
-    from application.dashboard.models import EthnicGroupByDimension
+def _get_published_major_versions_with_week():
+    """
+    The title, version, publish date and week, URL slugs and publisher of every published major version, as
+    lightweight rows rather than MeasureVersion objects, newest first.
+    """
+    return (
+        MeasureVersion.published_major_versions()
+        .join(MeasureVersion.measure)
+        .join(Measure.subtopics)
+        .join(Subtopic.topic)
+        .outerjoin(MeasureVersion.data_sources)
+        .outerjoin(DataSource.publisher)
+        .with_entities(
+            MeasureVersion.id,
+            MeasureVersion.title,
+            MeasureVersion.version,
+            MeasureVersion.published_at,
+            cast(func.date_trunc("week", MeasureVersion.published_at), Date).label("week"),
+            Topic.slug.label("topic_slug"),
+            Subtopic.slug.label("subtopic_slug"),
+            Measure.slug.label("measure_slug"),
+            Organisation.name.label("publisher_name"),
+        )
+        .order_by(
+            MeasureVersion.published_at.desc(), MeasureVersion.title, MeasureVersion.id, Subtopic.id, DataSource.id,
+        )
+        .all()
+    )
+
 
-    links = EthnicGroupByDimension.query.all()
+def get_ethnic_groups_dashboard_data(links=None):
+    if links is None:
+        links = EthnicGroupByDimension.query.all()
 
     # build a data structure with the links to count unique
     ethnicities = {}
@@ -136,52 +171,33 @@ def get_ethnic_group_by_slug_dashboard_data(ethnic_group_slug):
     ethnicity = classification_service.get_value_by_slug(ethnic_group_slug)
 
     ethnic_group_title = ""
-    page_count = 0
-    nested_measures_and_dimensions = defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: defaultdict(list))))
+    dimension_links = []
 
     if ethnicity:
         ethnic_group_title = ethnicity.value
-        from application.dashboard.models import EthnicGroupByDimension
-
         dimension_links = EthnicGroupByDimension.query.filter_by(ethnicity_value=ethnicity.value).all()
 
-        for link in sorted(
-            dimension_links,
-            key=lambda rec: (rec.topic_title, rec.subtopic_position, rec.measure_position, rec.dimension_position),
-        ):
-            measure_dict = nested_measures_and_dimensions[link.topic_title][link.subtopic_title][
-                link.measure_version_title
-            ]
+    page_count, nested_measures_and_dimensions = _nest_measures_and_dimensions(
+        sorted(dimension_links, key=_measure_and_dimension_order)
+    )
 
-            measure_dict["title"] = link.measure_version_title
-            measure_dict["url"] = url_for(
-                "static_site.measure_version",
-                topic_slug=link.topic_slug,
-                subtopic_slug=link.subtopic_slug,
-                measure_slug=link.measure_slug,
-                version="latest",
-            )
-            measure_dict["dimensions"].append(
-                {
-                    "guid": link.dimension_guid,
-                    "title": link.dimension_title,
-                    "short_title": _calculate_short_title(link.measure_version_title, link.dimension_title),
-                    "position": link.dimension_position,
-                }
-            )
+    return ethnic_group_title, page_count, nested_measures_and_dimensions
 
-    for (topic, measures_with_dimensions_by_subtopic) in nested_measures_and_dimensions.items():
-        for subtopic, measures_with_dimensions in measures_with_dimensions_by_subtopic.items():
-            page_count += len(measures_with_dimensions)
 
-    return ethnic_group_title, page_count, nested_measures_and_dimensions
+def get_all_ethnic_group_dashboard_data(links=None):
+    """
+    The page count and nested measures and dimensions for every ethnic group, as returned by
+    `get_ethnic_group_by_slug_dashboard_data`, keyed by ethnicity value.
+    """
+    if links is None:
+        links = EthnicGroupByDimension.query.all()
 
+    return _nest_measures_and_dimensions_by(links, lambda link: link.ethnicity_value)
 
-def get_ethnicity_classifications_dashboard_data():
-    from application.dashboard.models import ClassificationByDimension
 
+def get_ethnicity_classifications_dashboard_data(links=None):
     all_classifications = classification_service.get_all_classifications()
-    all_dimension_classifications = ClassificationByDimension.query.all()
+    all_dimension_classifications = ClassificationByDimension.query.all() if links is None else links
 
     classifications = {
         classification.id: {
@@ -223,50 +239,31 @@ def get_ethnicity_classification_by_id_dashboard_data(classification_id):
     classification = classification_service.get_classification_by_id(classification_id)
 
     classification_title = ""
-    page_count = 0
-    nested_measures_and_dimensions = defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: defaultdict(list))))
+    dimension_links = []
 
     if classification:
         classification_title = classification.long_title
-        from application.dashboard.models import ClassificationByDimension
-
         dimension_links = ClassificationByDimension.query.filter_by(classification_id=classification_id).all()
 
-        for link in sorted(
-            dimension_links,
-            key=lambda rec: (rec.topic_title, rec.subtopic_position, rec.measure_position, rec.dimension_position),
-        ):
-            measure_dict = nested_measures_and_dimensions[link.topic_title][link.subtopic_title][
-                link.measure_version_title
-            ]
+    page_count, nested_measures_and_dimensions = _nest_measures_and_dimensions(
+        sorted(dimension_links, key=_measure_and_dimension_order)
+    )
 
-            measure_dict["title"] = link.measure_version_title
-            measure_dict["url"] = url_for(
-                "static_site.measure_version",
-                topic_slug=link.topic_slug,
-                subtopic_slug=link.subtopic_slug,
-                measure_slug=link.measure_slug,
-                version="latest",
-            )
-            measure_dict["dimensions"].append(
-                {
-                    "guid": link.dimension_guid,
-                    "title": link.dimension_title,
-                    "short_title": _calculate_short_title(link.measure_version_title, link.dimension_title),
-                    "position": link.dimension_position,
-                }
-            )
+    return classification_title, page_count, nested_measures_and_dimensions
 
-    for (topic, measures_with_dimensions_by_subtopic) in nested_measures_and_dimensions.items():
-        for subtopic, measures_with_dimensions in measures_with_dimensions_by_subtopic.items():
-            page_count += len(measures_with_dimensions)
 
-    return classification_title, page_count, nested_measures_and_dimensions
+def get_all_ethnicity_classification_dashboard_data(links=None):
+    """
+    The page count and nested measures and dimensions for every classification, as returned by
+    `get_ethnicity_classification_by_id_dashboard_data`, keyed by classification id.
+    """
+    if links is None:
+        links = ClassificationByDimension.query.all()
 
+    return _nest_measures_and_dimensions_by(links, lambda link: link.classification_id)
 
-def get_geographic_breakdown_dashboard_data():
-    from application.dashboard.models import LatestPublishedMeasureVersionByGeography
 
+def get_geographic_breakdown_dashboard_data():
     page_counts_by_geography = (
         LatestPublishedMeasureVersionByGeography.query.with_entities(
             LatestPublishedMeasureVersionByGeography.geography_name, func.count("*")
@@ -297,8 +294,6 @@ def get_geographic_breakdown_by_slug_dashboard_data(slug):
     geography = _deslugifiedLocation(slug)
 
     # get the measures that implement this as LatestPublishedMeasureVersionByGeography objects
-    from application.dashboard.models import LatestPublishedMeasureVersionByGeography
-
     # Get measure version hierarchy for the given geographic area.
     measure_versions_with_geography = (
         LatestPublishedMeasureVersionByGeography.query.filter(
@@ -306,32 +301,27 @@ def get_geographic_breakdown_by_slug_dashboard_data(slug):
         )
     ).all()
 
-    # Structure: {topic_title: {subtopic_title: [{title: mv_title, url: mv_url}, ...]}}
-    measure_titles_and_urls_by_topic_and_subtopic = defaultdict(lambda: defaultdict(list))
+    page_count, measure_titles_and_urls_by_topic_and_subtopic = _nest_measures(
+        sorted(measure_versions_with_geography, key=_measure_order)
+    )
 
-    # Sort records by topic title, subtopic position, measure position. Relies on preserved dict insertion order.
-    for record in sorted(
-        measure_versions_with_geography, key=lambda rec: (rec.topic_title, rec.subtopic_position, rec.measure_position)
-    ):
-        measure_titles_and_urls_by_topic_and_subtopic[record.topic_title][record.subtopic_title].append(
-            {
-                "title": record.measure_version_title,
-                "url": url_for(
-                    "static_site.measure_version",
-                    topic_slug=record.topic_slug,
-                    subtopic_slug=record.subtopic_slug,
-                    measure_slug=record.measure_slug,
-                    version="latest",
-                ),
-            }
-        )
+    return geography, page_count, measure_titles_and_urls_by_topic_and_subtopic
 
-    page_count = 0
-    for topic, measures_by_subtopic in measure_titles_and_urls_by_topic_and_subtopic.items():
-        for subtopic, measures in measures_by_subtopic.items():
-            page_count += len(measures)
 
-    return geography, page_count, measure_titles_and_urls_by_topic_and_subtopic
+def get_all_geographic_breakdown_dashboard_data():
+    """
+    The page count and measures by topic and subtopic for every geography, as returned by
+    `get_geographic_breakdown_by_slug_dashboard_data`, keyed by geography name.
+    """
+    records_by_geography = defaultdict(list)
+    for record in sorted(LatestPublishedMeasureVersionByGeography.query.all(), key=_measure_order):
+        records_by_geography[record.geography_name].append(record)
+
+    measure_urls = _MeasureUrls()
+    return {
+        geography_name: _nest_measures(records, measure_urls)
+        for geography_name, records in records_by_geography.items()
+    }
 
 
 def get_planned_pages_dashboard_data():
@@ -352,6 +342,98 @@ def get_planned_pages_dashboard_data():
     return measures, planned_count, progress_count, review_count
 
 
+class _MeasureUrls(dict):
+    """
+    The URL of the latest version of each measure, keyed by its (topic slug, subtopic slug, measure slug), built with
+    `url_for` the first time it's needed. Only use one within a single request or app context.
+    """
+
+    def __missing__(self, slugs):
+        topic_slug, subtopic_slug, measure_slug = slugs
+        url = self[slugs] = url_for(
+            "static_site.measure_version",
+            topic_slug=topic_slug,
+            subtopic_slug=subtopic_slug,
+            measure_slug=measure_slug,
+            version="latest",
+        )
+        return url
+
+
+def _measure_order(record):
+    return record.topic_title, record.subtopic_position, record.measure_position
+
+
+def _measure_and_dimension_order(link):
+    return link.topic_title, link.subtopic_position, link.measure_position, link.dimension_position
+
+
+def _nest_measures_and_dimensions(sorted_links, measure_urls=None):
+    """
+    Arranges dimension links, already sorted by `_measure_and_dimension_order`, as
+    {topic_title: {subtopic_title: {measure_title: {title, url, dimensions: [...]}}}}, and counts the measures.
+    Relies on preserved dict insertion order.
+    """
+    if measure_urls is None:
+        measure_urls = _MeasureUrls()
+    nested_measures_and_dimensions = defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: defaultdict(list))))
+
+    for link in sorted_links:
+        measure_dict = nested_measures_and_dimensions[link.topic_title][link.subtopic_title][link.measure_version_title]
+
+        if "url" not in measure_dict:
+            measure_dict["title"] = link.measure_version_title
+            measure_dict["url"] = measure_urls[link.topic_slug, link.subtopic_slug, link.measure_slug]
+        measure_dict["dimensions"].append(
+            {
+                "guid": link.dimension_guid,
+                "title": link.dimension_title,
+                "short_title": _calculate_short_title(link.measure_version_title, link.dimension_title),
+                "position": link.dimension_position,
+            }
+        )
+
+    page_count = 0
+    for (topic, measures_with_dimensions_by_subtopic) in nested_measures_and_dimensions.items():
+        for subtopic, measures_with_dimensions in measures_with_dimensions_by_subtopic.items():
+            page_count += len(measures_with_dimensions)
+
+    return page_count, nested_measures_and_dimensions
+
+
+def _nest_measures_and_dimensions_by(links, get_key):
+    # Sorting once before grouping leaves every group in order
+    links_by_key = defaultdict(list)
+    for link in sorted(links, key=_measure_and_dimension_order):
+        links_by_key[get_key(link)].append(link)
+
+    # The same measures appear under many keys, so their URLs are shared between them
+    measure_urls = _MeasureUrls()
+    return {key: _nest_measures_and_dimensions(key_links, measure_urls) for key, key_links in links_by_key.items()}
+
+
+def _nest_measures(sorted_records, measure_urls=None):
+    """
+    Arranges measure version records, already sorted by `_measure_order`, as
+    {topic_title: {subtopic_title: [{title: mv_title, url: mv_url}, ...]}}, and counts them. Relies on preserved dict
+    insertion order.
+    """
+    if measure_urls is None:
+        measure_urls = _MeasureUrls()
+    measure_titles_and_urls_by_topic_and_subtopic = defaultdict(lambda: defaultdict(list))
+
+    for record in sorted_records:
+        measure_titles_and_urls_by_topic_and_subtopic[record.topic_title][record.subtopic_title].append(
+            {
+                "title": record.measure_version_title,
+                "url": measure_urls[record.topic_slug, record.subtopic_slug, record.measure_slug],
+            }
+        )
+
+    return len(sorted_records), measure_titles_and_urls_by_topic_and_subtopic
+
+
+@lru_cache(maxsize=4096)
 def _calculate_short_title(page_title, dimension_title):
     # Case 1 - try stripping the dimension title
     low_title = dimension_title.lower()
@@ -368,25 +450,8 @@ def _calculate_short_title(page_title, dimension_title):
 
 
 def _deslugifiedLocation(slug):
-    for location in LowestLevelOfGeography.query.all():
-        if slugify(location.name) == slug:
-            return location
-    return None
-
-
-def _from_month_to_month(start, end):
-    current = start
-    while current < end:
-        yield current
-        current += timedelta(days=current.max.day)
-    yield current
-
-
-def _in_range(week, begin, month, end=date.today()):
-    if any([d for d in week if d.month > month]):
-        return False
-    return any([d for d in week if d >= begin]) and any([d for d in week if d <= end])
+    return _geography_slug_index.get(slug)
 
 
-def _page_in_week(page, week):
-    return page.published_at >= week[0] and page.published_at <= week[6]
+def _start_of_week(day):
+    return day - timedelta(days=day.weekday())
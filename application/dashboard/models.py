@@ -1,9 +1,7 @@
 """
 
-These are Materialised Views
-
-They should NEVER be imported into the manage.py otherwise alembic will try to generate
-migrations to create tables for the objects
+These are the dashboard summary tables, which are created by migrations from the queries in view_sql.py and kept up to
+date by summary_tables.py. Don't write to them directly.
 
 """
 from sqlalchemy import PrimaryKeyConstraint
@@ -25,6 +23,7 @@ class LatestPublishedMeasureVersionByGeography(db.Model):
     measure_version_title = db.Column("measure_version_title", db.String())
     geography_name = db.Column("geography_name", db.String())
     geography_position = db.Column("geography_position", db.Integer())
+    measure_id = db.Column("measure_id", db.Integer())
 
     __table_args__ = (PrimaryKeyConstraint("measure_version_id"),)
 
@@ -0,0 +1,266 @@
+"""
+Keeps the dashboard summary tables up to date as the CMS is edited, a measure at a time.
+
+Whenever a session is flushed, the changes to anything which appears in the summary tables (measure versions, measures,
+dimensions and their classifications, subtopics, topics and so on) are noted. When the session commits, the ids of the
+measures affected are worked out from those, and only those measures' rows are replaced, in the same transaction. A
+change to a geography or an ethnicity can affect any measure, so every row is replaced after the transaction commits,
+on a background thread, rather than holding up the edit.
+
+Replacing a measure's rows locks only that measure, so edits to different measures never wait for each other. A full
+refresh locks every measure, and waits for any measure refreshes in progress.
+
+Changes made without the ORM (such as the classification synchroniser's bulk statements) aren't seen, and need to call
+`refresh_dashboard_summaries` themselves.
+"""
+import threading
+import traceback
+
+from sqlalchemy import event, func, select as sql_select, text
+from sqlalchemy.orm import Session
+
+from application.cms.models import (
+    Classification,
+    Dimension,
+    DimensionClassification,
+    Ethnicity,
+    LowestLevelOfGeography,
+    Measure,
+    MeasureVersion,
+    Subtopic,
+    Topic,
+)
+from application.dashboard import models  # noqa: F401 - so that the summary tables are part of the metadata
+from application.dashboard.view_sql import (
+    count_dashboard_summary_table_differences,
+    refresh_all_dashboard_summary_tables,
+    refresh_dashboard_summary_tables_for_measures,
+)
+
+# Measure refreshes hold this advisory lock shared, and full refreshes hold it exclusively
+DASHBOARD_SUMMARY_LOCK_ID = 0x64617368
+# Each measure refresh also locks the measures it replaces, keyed by (this, measure id)
+DASHBOARD_SUMMARY_MEASURE_LOCK_CLASS = 0x6D656173
+DASHBOARD_SUMMARY_CHANGES = "dashboard_summary_changes"
+DASHBOARD_SUMMARY_FULL_REFRESH_REQUESTED = "dashboard_summary_full_refresh_requested"
+
+# Measures are locked in order of id, so that two transactions refreshing overlapping measures can't deadlock
+_lock_measures = text(
+    """
+    SELECT pg_advisory_xact_lock(:lock_class, measure_id)
+    FROM (SELECT unnest(CAST(:measure_ids AS integer[])) AS measure_id ORDER BY measure_id) AS measure_ids
+    """
+)
+
+_find_changed_measure_ids = text(
+    """
+    SELECT measure_id FROM measure_version WHERE id = ANY(:measure_version_ids)
+    UNION
+    SELECT measure_version.measure_id FROM dimension
+    JOIN measure_version ON measure_version.id = dimension.measure_version_id
+    WHERE dimension.guid = ANY(:dimension_guids)
+    UNION
+    SELECT measure_version.measure_id FROM dimension_categorisation
+    JOIN dimension ON dimension.guid = dimension_categorisation.dimension_guid
+    JOIN measure_version ON measure_version.id = dimension.measure_version_id
+    WHERE dimension_categorisation.classification_id = ANY(:classification_ids)
+    UNION
+    SELECT subtopic_measure.measure_id FROM subtopic_measure
+    JOIN subtopic ON subtopic.id = subtopic_measure.subtopic_id
+    WHERE subtopic.id = ANY(:subtopic_ids) OR subtopic.topic_id = ANY(:topic_ids)
+    """
+)
+
+
+class DashboardSummaryChanges:
+    """
+    The changes made in a transaction which may affect the dashboard summary tables
+    """
+
+    def __init__(self):
+        self.refresh_all = False
+        self.measure_ids = set()
+        self.measure_version_ids = set()
+        self.dimension_guids = set()
+        self.classification_ids = set()
+        self.subtopic_ids = set()
+        self.topic_ids = set()
+
+    def __bool__(self):
+        return self.refresh_all or any(
+            [
+                self.measure_ids,
+                self.measure_version_ids,
+                self.dimension_guids,
+                self.classification_ids,
+                self.subtopic_ids,
+                self.topic_ids,
+            ]
+        )
+
+    def add(self, instance, is_new=False):
+        if isinstance(instance, MeasureVersion):
+            self.measure_ids.add(instance.measure_id)
+        elif isinstance(instance, Measure):
+            self.measure_ids.add(instance.id)
+        elif isinstance(instance, Dimension):
+            self.measure_version_ids.add(instance.measure_version_id)
+        elif isinstance(instance, DimensionClassification):
+            self.dimension_guids.add(instance.dimension_guid)
+        elif isinstance(instance, Subtopic):
+            self.subtopic_ids.add(instance.id)
+        elif isinstance(instance, Topic):
+            self.topic_ids.add(instance.id)
+        elif isinstance(instance, Classification) and not is_new:
+            self.classification_ids.add(instance.id)
+        elif isinstance(instance, (Ethnicity, LowestLevelOfGeography)) and not is_new:
+            self.refresh_all = True
+
+    def get_measure_ids(self, session):
+        measure_ids = set(self.measure_ids)
+        parameters = {
+            "measure_version_ids": list(self.measure_version_ids),
+            "dimension_guids": list(self.dimension_guids),
+            "classification_ids": list(self.classification_ids),
+            "subtopic_ids": list(self.subtopic_ids),
+            "topic_ids": list(self.topic_ids),
+        }
+        if any(parameters.values()):
+            measure_ids.update(measure_id for (measure_id,) in session.execute(_find_changed_measure_ids, parameters))
+        measure_ids.discard(None)
+        return measure_ids
+
+
+def refresh_dashboard_summaries(session, measure_ids=None):
+    """
+    Replaces the rows of the dashboard summary tables for `measure_ids`, or every row if it's None, in the session's
+    transaction. The measures are locked until the transaction ends, so that two transactions never insert rows for the
+    same measure at once.
+    """
+    if measure_ids is not None and not measure_ids:
+        return
+
+    if measure_ids is None:
+        session.execute(sql_select([func.pg_advisory_xact_lock(DASHBOARD_SUMMARY_LOCK_ID)]))
+        session.execute(text(refresh_all_dashboard_summary_tables))
+    else:
+        measure_ids = sorted(measure_ids)
+        session.execute(sql_select([func.pg_advisory_xact_lock_shared(DASHBOARD_SUMMARY_LOCK_ID)]))
+        session.execute(
+            _lock_measures, {"lock_class": DASHBOARD_SUMMARY_MEASURE_LOCK_CLASS, "measure_ids": measure_ids}
+        )
+        session.execute(text(refresh_dashboard_summary_tables_for_measures), {"measure_ids": measure_ids})
+
+
+class BackgroundFullRefresh:
+    """
+    Runs full refreshes of the dashboard summary tables on a background thread, one at a time, each in its own
+    session. Any number of requests made while a refresh is waiting to start are covered by that one refresh.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__requested = False
+        self.__thread = None
+
+    def request(self, engine):
+        """
+        Asks for a full refresh once the current one, if there is one, has finished.
+
+        :return: The thread which will run the refresh
+        """
+        with self.__lock:
+            self.__requested = True
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, args=(engine,), daemon=True)
+                self.__thread.start()
+            return self.__thread
+
+    def __run(self, engine):
+        while True:
+            with self.__lock:
+                if not self.__requested:
+                    self.__thread = None
+                    return
+                self.__requested = False
+
+            session = Session(bind=engine)
+            try:
+                refresh_dashboard_summaries(session)
+                session.commit()
+            except Exception:
+                session.rollback()
+                # The summaries stay out of date until the next full refresh, or `manage.py refresh_materialized_views`
+                traceback.print_exc()
+            finally:
+                session.close()
+
+
+background_full_refresh = BackgroundFullRefresh()
+
+
+def count_dashboard_summary_differences(session):
+    """
+    :return: The number of rows in each dashboard summary table which are missing or out of date, by table name
+    """
+    return {
+        table_name: differences
+        for table_name, differences in session.execute(text(count_dashboard_summary_table_differences))
+    }
+
+
+def _note_changed_and_deleted_instances(session, flush_context, instances):
+    # These are noted before the flush, while the rows of deleted instances can still be loaded
+    changes = session.info.setdefault(DASHBOARD_SUMMARY_CHANGES, DashboardSummaryChanges())
+    for instance in session.dirty:
+        changes.add(instance)
+    for instance in session.deleted:
+        changes.add(instance)
+
+
+def _note_new_instances(session, flush_context):
+    # These are noted after the flush, once they've been given ids
+    changes = session.info.setdefault(DASHBOARD_SUMMARY_CHANGES, DashboardSummaryChanges())
+    for instance in session.new:
+        changes.add(instance, is_new=True)
+
+
+def _refresh_changed_measures(session):
+    if not session.info.get(DASHBOARD_SUMMARY_CHANGES) and not (session.new or session.dirty or session.deleted):
+        return
+
+    session.flush()
+    changes = session.info.pop(DASHBOARD_SUMMARY_CHANGES, None)
+    if not changes:
+        return
+
+    refresh_dashboard_summaries(session, changes.get_measure_ids(session))
+    if changes.refresh_all:
+        session.info[DASHBOARD_SUMMARY_FULL_REFRESH_REQUESTED] = True
+
+
+def _refresh_all_after_commit(session):
+    if session.info.pop(DASHBOARD_SUMMARY_FULL_REFRESH_REQUESTED, False):
+        background_full_refresh.request(session.get_bind())
+
+
+def _forget_changes(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(DASHBOARD_SUMMARY_CHANGES, None)
+        session.info.pop(DASHBOARD_SUMMARY_FULL_REFRESH_REQUESTED, None)
+
+
+def keep_dashboard_summaries_up_to_date(session):
+    """
+    Registers the event listeners which keep the dashboard summary tables up to date with changes made through
+    `session` (a session, sessionmaker or scoped_session).
+    """
+    for event_name, listener in [
+        ("before_flush", _note_changed_and_deleted_instances),
+        ("after_flush", _note_new_instances),
+        ("before_commit", _refresh_changed_measures),
+        ("after_commit", _refresh_all_after_commit),
+        ("after_soft_rollback", _forget_changes),
+    ]:
+        if not event.contains(session, event_name, listener):
+            event.listen(session, event_name, listener)
@@ -1,3 +1,221 @@
+"""
+The dashboards read from summary tables, each of which holds the rows of a query below for every measure. Instead of
+being refreshed as a whole, the rows for a measure are replaced whenever it changes (see `summary_tables.py`), and
+`manage.py refresh_materialized_views` rebuilds them all, to repair them if they ever drift.
+
+The statements for the materialized views which these tables replaced are kept further down, as older migrations
+still use them.
+"""
+
+latest_published_measure_versions_plain_view = """
+CREATE VIEW latest_published_measure_versions AS
+(
+   SELECT
+      mv.*
+   FROM
+      measure_version AS mv
+      JOIN
+         (
+            SELECT
+               measure_version.measure_id,
+               array_to_string(MAX(string_to_array(measure_version.version, '.')), '.') AS max_approved_version
+            FROM
+               measure_version
+            WHERE
+               measure_version.status = 'APPROVED'
+            GROUP BY
+               measure_version.measure_id
+         )
+         AS max_approved_measure_versions
+         ON mv.measure_id = max_approved_measure_versions.measure_id
+         AND mv.version = max_approved_measure_versions.max_approved_version
+);
+"""
+
+latest_published_measure_versions_by_geography_query = """
+   SELECT
+      topic.title AS topic_title,
+      topic.slug AS topic_slug,
+      subtopic.title AS subtopic_title,
+      subtopic.slug AS subtopic_slug,
+      subtopic.position AS subtopic_position,
+      measure.slug AS measure_slug,
+      measure.position AS measure_position,
+      measure_version.id AS measure_version_id,
+      measure_version.title AS measure_version_title,
+      geography.name AS geography_name,
+      geography.position AS geography_position,
+      measure.id AS measure_id
+   FROM
+      latest_published_measure_versions AS mv
+      JOIN lowest_level_of_geography AS geography ON mv.lowest_level_of_geography_id = geography.name
+      JOIN measure_version ON measure_version.id = mv.id
+      JOIN measure ON measure.id = measure_version.measure_id
+      JOIN subtopic_measure ON subtopic_measure.measure_id = measure.id
+      JOIN subtopic ON subtopic.id = subtopic_measure.subtopic_id
+      JOIN topic ON topic.id = subtopic.topic_id
+"""
+
+ethnic_groups_by_dimension_query = """
+     SELECT
+        topic.title AS topic_title,
+        topic.slug AS topic_slug,
+        subtopic.title AS subtopic_title,
+        subtopic.slug AS subtopic_slug,
+        subtopic.position AS subtopic_position,
+        measure.id AS measure_id,
+        measure.slug AS measure_slug,
+        measure.position AS measure_position,
+        latest_published_measure_versions.id AS measure_version_id,
+        latest_published_measure_versions.title AS measure_version_title,
+        dimension.guid AS dimension_guid,
+        dimension.title AS dimension_title,
+        dimension.position AS dimension_position,
+        classification.title AS classification_title,
+        ethnicity.value AS ethnicity_value,
+        ethnicity.position AS ethnicity_position
+     FROM latest_published_measure_versions
+          JOIN measure ON latest_published_measure_versions.measure_id = measure.id
+          JOIN subtopic_measure ON measure.id = subtopic_measure.measure_id
+          JOIN subtopic ON subtopic_measure.subtopic_id = subtopic.id
+          JOIN topic ON subtopic.topic_id = topic.id
+          JOIN dimension ON dimension.measure_version_id = latest_published_measure_versions.id
+          JOIN dimension_categorisation ON dimension.guid = dimension_categorisation.dimension_guid
+          JOIN classification ON dimension_categorisation.classification_id = classification.id
+          JOIN ethnicity_in_classification ON classification.id = ethnicity_in_classification.classification_id
+          JOIN ethnicity ON ethnicity_in_classification.ethnicity_id = ethnicity.id
+     UNION
+     SELECT
+        topic.title AS topic_title,
+        topic.slug AS topic_slug,
+        subtopic.title AS subtopic_title,
+        subtopic.slug AS subtopic_slug,
+        subtopic.position AS subtopic_position,
+        measure.id AS measure_id,
+        measure.slug AS measure_slug,
+        measure.position AS measure_position,
+        latest_published_measure_versions.id AS measure_version_id,
+        latest_published_measure_versions.title AS measure_version_title,
+        dimension.guid AS dimension_guid,
+        dimension.title AS dimension_title,
+        dimension.position AS dimension_position,
+        classification.title AS classification_title,
+        ethnicity.value AS ethnicity_value,
+        ethnicity.position AS ethnicity_position
+     FROM latest_published_measure_versions
+          JOIN measure ON latest_published_measure_versions.measure_id = measure.id
+          JOIN subtopic_measure ON measure.id = subtopic_measure.measure_id
+          JOIN subtopic ON subtopic_measure.subtopic_id = subtopic.id
+          JOIN topic ON subtopic.topic_id = topic.id
+          JOIN dimension ON dimension.measure_version_id = latest_published_measure_versions.id
+          JOIN dimension_categorisation ON dimension.guid = dimension_categorisation.dimension_guid
+          JOIN classification ON dimension_categorisation.classification_id = classification.id
+          JOIN parent_ethnicity_in_classification ON classification.id = parent_ethnicity_in_classification.classification_id
+          JOIN ethnicity ON parent_ethnicity_in_classification.ethnicity_id = ethnicity.id
+     WHERE dimension_categorisation.includes_parents
+"""  # noqa
+
+classifications_by_dimension_query = """
+   SELECT
+      topic.title AS topic_title,
+      topic.slug AS topic_slug,
+      subtopic.title AS subtopic_title,
+      subtopic.slug AS subtopic_slug,
+      subtopic.position AS subtopic_position,
+      measure.id AS measure_id,
+      measure.slug AS measure_slug,
+      measure.position AS measure_position,
+      latest_published_measure_versions.id AS measure_version_id,
+      latest_published_measure_versions.title AS measure_version_title,
+      dimension.guid AS dimension_guid,
+      dimension.title AS dimension_title,
+      dimension.position AS dimension_position,
+      classification.id AS classification_id,
+      classification.title AS classification_title,
+      classification.position AS classification_position,
+      dimension_categorisation.includes_parents AS includes_parents,
+      dimension_categorisation.includes_all AS includes_all,
+      dimension_categorisation.includes_unknown AS includes_unknown
+   FROM
+      latest_published_measure_versions
+      JOIN measure ON latest_published_measure_versions.measure_id = measure.id
+      JOIN subtopic_measure ON measure.id = subtopic_measure.measure_id
+      JOIN subtopic ON subtopic_measure.subtopic_id = subtopic.id
+      JOIN topic ON subtopic.topic_id = topic.id
+      JOIN dimension ON dimension.measure_version_id = latest_published_measure_versions.id
+      JOIN dimension_categorisation ON dimension.guid = dimension_categorisation.dimension_guid
+      JOIN classification ON dimension_categorisation.classification_id = classification.id
+"""
+
+# (table name, query, name of its unique index, columns of its unique index)
+dashboard_summary_tables = [
+    (
+        "latest_published_measure_versions_by_geography",
+        latest_published_measure_versions_by_geography_query,
+        "uix_latest_published_measure_versions_by_geography",
+        "measure_version_id",
+    ),
+    (
+        "ethnic_groups_by_dimension",
+        ethnic_groups_by_dimension_query,
+        "uix_ethnic_groups_by_dimension",
+        "dimension_guid, ethnicity_value",
+    ),
+    (
+        "classifications_by_dimension",
+        classifications_by_dimension_query,
+        "uix_categorisations_by_dimension",
+        "dimension_guid, classification_id",
+    ),
+]
+
+create_dashboard_summary_tables = latest_published_measure_versions_plain_view + "".join(
+    f"""
+CREATE TABLE {table} AS SELECT * FROM ({query}) AS summary WITH NO DATA;
+CREATE UNIQUE INDEX {index} ON {table} ({index_columns});
+CREATE INDEX ix_{table}_measure_id ON {table} (measure_id);
+INSERT INTO {table} SELECT * FROM ({query}) AS summary;
+"""
+    for table, query, index, index_columns in dashboard_summary_tables
+)
+
+drop_dashboard_summary_tables = (
+    "".join(f"DROP TABLE IF EXISTS {table};\n" for table, query, index, index_columns in dashboard_summary_tables)
+    + "DROP VIEW IF EXISTS latest_published_measure_versions;\n"
+)
+
+refresh_all_dashboard_summary_tables = "".join(
+    f"""
+DELETE FROM {table};
+INSERT INTO {table} SELECT * FROM ({query}) AS summary;
+"""
+    for table, query, index, index_columns in dashboard_summary_tables
+)
+
+# Takes an array of measure ids as `:measure_ids`
+refresh_dashboard_summary_tables_for_measures = "".join(
+    f"""
+DELETE FROM {table} WHERE measure_id = ANY(:measure_ids);
+INSERT INTO {table} SELECT * FROM ({query}) AS summary WHERE measure_id = ANY(:measure_ids);
+"""
+    for table, query, index, index_columns in dashboard_summary_tables
+)
+
+# The number of rows in each table which differ from what its query returns now, in the order of the tables above
+count_dashboard_summary_table_differences = " UNION ALL ".join(
+    f"""
+SELECT '{table}' AS table_name, COUNT(*) AS differences FROM (
+    (TABLE {table} EXCEPT SELECT * FROM ({query}) AS summary)
+    UNION ALL
+    (SELECT * FROM ({query}) AS summary EXCEPT TABLE {table})
+) AS table_differences
+"""
+    for table, query, index, index_columns in dashboard_summary_tables
+)
+
+
+# The materialized views, as created by older migrations
+
 drop_all_dashboard_helper_views = """
 DROP INDEX IF EXISTS uix_latest_published_measure_versions_by_geography;
 DROP INDEX IF EXISTS uix_latest_published_measure_versions;
@@ -9,13 +227,6 @@ DROP MATERIALIZED VIEW IF EXISTS classifications_by_dimension;
 DROP MATERIALIZED VIEW IF EXISTS latest_published_measure_versions;
 """
 
-refresh_all_dashboard_helper_views = """
-REFRESH MATERIALIZED VIEW CONCURRENTLY latest_published_measure_versions;
-REFRESH MATERIALIZED VIEW CONCURRENTLY latest_published_measure_versions_by_geography;
-REFRESH MATERIALIZED VIEW CONCURRENTLY ethnic_groups_by_dimension;
-REFRESH MATERIALIZED VIEW CONCURRENTLY classifications_by_dimension;
-"""
-
 latest_published_measure_versions_view = """
 CREATE MATERIALIZED VIEW latest_published_measure_versions AS
 (
@@ -1,5 +1,18 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from flask import current_app
+
 from application.data.charts import ChartObjectDataBuilder
 from application.data.tables import TableObjectDataBuilder, TableObjectTableBuilder
+from application.utils import is_private_to_current_user, write_dimension_csv, write_dimension_tabular_csv
+
+# Bump this whenever the CSVs generated from a chart or table object change, so that old cache entries are ignored.
+DIMENSION_CSV_CACHE_FORMAT = 1
+
+DEFAULT_DIMENSION_CSV_CACHE_MAX_BYTES = 256 * 1024 * 1024
 
 
 class DimensionObjectBuilder:
@@ -54,3 +67,123 @@ class DimensionObjectBuilder:
             "publisher": publisher,
             "publication_date": publication_date,
         }
+
+
+class DimensionCsvCache:
+    """
+    A content-addressed cache of the CSV downloads generated for dimensions, stored as one file per CSV in `cache_dir`.
+
+    The CSVs are generated only from a dimension's chart and table objects, so entries are keyed by a hash of those.
+    This lets unchanged dimensions - and the copies of a dimension published at both its versioned and its `/latest`
+    URL - reuse the CSV generated by an earlier build or request. If `cache_dir` is None nothing is cached.
+
+    Cached CSVs are published as they are, so the cache is only used if `cache_dir` and its entries belong to the
+    current user and nobody else can write to them. `cache_dir` is created with mode 0700 if it doesn't exist.
+
+    Entries are never invalidated, only superseded, so the least recently used are removed once the cache holds more
+    than `max_bytes`. To avoid listing the cache after every write, it's checked on the first write and then after every
+    tenth of `max_bytes` written.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_DIMENSION_CSV_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.__bytes_written_since_pruned = None
+        self.__cache_dir_checked = False
+
+    def get_csv(self, dimension):
+        return self._get_or_generate("data", dimension, write_dimension_csv)
+
+    def get_tabular_csv(self, dimension):
+        return self._get_or_generate("tabular", dimension, write_dimension_tabular_csv)
+
+    def _get_or_generate(self, csv_type, dimension, write_csv):
+        if not self._cache_dir_is_private():
+            return write_csv(dimension=DimensionObjectBuilder.build(dimension))
+
+        cache_path = os.path.join(self.cache_dir, f"{self.cache_key(csv_type, dimension)}.csv")
+        try:
+            if not is_private_to_current_user(cache_path):
+                raise FileNotFoundError(cache_path)
+            with open(cache_path, encoding="utf-8", newline="") as cached_file:
+                output = cached_file.read()
+            # Mark the entry as recently used, so it's the last to be pruned
+            os.utime(cache_path)
+            return output
+        except FileNotFoundError:
+            pass
+
+        output = write_csv(dimension=DimensionObjectBuilder.build(dimension))
+
+        # Write to a temporary file and then move it into place, so that concurrent builds and requests never read a
+        # partly-written entry. This also replaces an entry which failed the ownership check.
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", newline="", dir=self.cache_dir, suffix=".tmp", delete=False
+        ) as temp_file:
+            temp_file.write(output)
+        os.replace(temp_file.name, cache_path)
+        self._prune_if_due(os.path.getsize(cache_path))
+
+        return output
+
+    def _cache_dir_is_private(self):
+        if self.cache_dir is None:
+            return False
+
+        if not self.__cache_dir_checked:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            if not is_private_to_current_user(self.cache_dir):
+                print(f"Not caching dimension CSVs in a directory other users can write: {self.cache_dir}")
+                self.cache_dir = None
+                return False
+            self.__cache_dir_checked = True
+
+        return True
+
+    def _prune_if_due(self, bytes_written):
+        if self.__bytes_written_since_pruned is not None:
+            self.__bytes_written_since_pruned += bytes_written
+            if self.__bytes_written_since_pruned < self.max_bytes // 10:
+                return
+
+        self.__bytes_written_since_pruned = 0
+        self.prune()
+
+    def prune(self):
+        """Removes the least recently used entries until the cache holds no more than `max_bytes`."""
+        entries = []
+        with os.scandir(self.cache_dir) as dir_entries:
+            for dir_entry in dir_entries:
+                if dir_entry.name.endswith(".csv"):
+                    try:
+                        entry_stat = dir_entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((entry_stat.st_mtime, entry_stat.st_size, dir_entry.path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another process has pruned it already
+                pass
+            total_bytes -= size
+
+    @staticmethod
+    def cache_key(csv_type, dimension):
+        chart_object = dimension.dimension_chart.chart_object if dimension.dimension_chart else None
+        table_object = dimension.dimension_table.table_object if dimension.dimension_table else None
+        content = json.dumps(
+            [DIMENSION_CSV_CACHE_FORMAT, csv_type, chart_object, table_object], sort_keys=True, default=str
+        )
+
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def dimension_csv_cache():
+    return DimensionCsvCache(
+        current_app.config["DIMENSION_CSV_CACHE_DIR"], max_bytes=current_app.config["DIMENSION_CSV_CACHE_MAX_BYTES"]
+    )
@@ -1,8 +1,5 @@
-from application.cms.classification_service import ClassificationWithIncludesParentsAllUnknown, ClassificationService
-from application.cms.exceptions import (
-    ClassificationNotFoundException,
-    ClassificationFinderClassificationNotFoundException,
-)
+from application.cms.classification_service import ClassificationWithIncludesParentsAllUnknown, classification_service
+from application.cms.exceptions import ClassificationFinderClassificationNotFoundException
 
 ALL_STANDARD_VALUE = "All"
 UNKNOWN_STANDARD_VALUE = "Unknown"
@@ -22,28 +19,30 @@ class EthnicityClassificationMatcher:
         # class: EthnicityClassificationCollection
         self.ethnicity_classification_collection = ethnicity_classification_collection
 
+        # The parents each classification requires, or None if it doesn't use parent/child, by classification id
+        self.__required_parents_by_classification_id = {}
+
     def get_classification_from_builder_values(self, id_from_builder, values_from_builder):
         builder_classification = self.__find_builder_classification(id_from_builder, values_from_builder)
         return self.convert_builder_classification_to_classification(builder_classification)
 
     def convert_builder_classification_to_classification(self, builder_classification):
-        try:
-            # IDs from Chart and Table builders can have a "+" on the end, indicating that the data includes parents.
-            # We don't have these "+" codes in our database and instead use the "includes_parents" flag, so strip any
-            # "+" from the end before looking up in the DB.
-            search_id = builder_classification.get_id().rstrip("+")
-            classification = ClassificationService.get_classification_by_id(search_id)
-            return ClassificationWithIncludesParentsAllUnknown(
-                classification.id,
-                builder_classification.get_includes_parents(),
-                builder_classification.get_includes_all(),
-                builder_classification.get_includes_unknown(),
-            )
-        except ClassificationNotFoundException:
+        # IDs from Chart and Table builders can have a "+" on the end, indicating that the data includes parents.
+        # We don't have these "+" codes in our database and instead use the "includes_parents" flag, so strip any
+        # "+" from the end before looking up in the DB.
+        search_id = builder_classification.get_id().rstrip("+")
+        if not classification_service.classification_exists(search_id):
             raise ClassificationFinderClassificationNotFoundException(
                 "Classification finder id %s could not be matched to database" % builder_classification.get_id()
             )
 
+        return ClassificationWithIncludesParentsAllUnknown(
+            search_id,
+            builder_classification.get_includes_parents(),
+            builder_classification.get_includes_all(),
+            builder_classification.get_includes_unknown(),
+        )
+
     def __find_builder_classification(self, builder_id, builder_values):
         standard_values = self.ethnicity_standardiser.standardise_all(builder_values)
         classification = self.ethnicity_classification_collection.get_classification_by_id(builder_id)
@@ -63,10 +62,25 @@ class EthnicityClassificationMatcher:
         return ALL_STANDARD_VALUE in standard_values
 
     def __has_parents(self, standard_values, classification):
-        if self.__builder_classification_does_use_parent_child(classification):
-            return self.__builder_classification_values_include_required_parents(classification, standard_values)
+        required_parents = self.__get_required_parents(classification)
+        if required_parents is not None:
+            return self.__builder_classification_values_include_required_parents(
+                classification, standard_values, required_parents
+            )
         return False
 
+    def __get_required_parents(self, classification):
+        try:
+            return self.__required_parents_by_classification_id[classification.get_id()]
+        except KeyError:
+            required_parents = None
+            if self.__builder_classification_does_use_parent_child(classification):
+                required_parents = frozenset(
+                    item.get_parent() for item in classification.get_data_items() if item.is_required()
+                )
+            self.__required_parents_by_classification_id[classification.get_id()] = required_parents
+            return required_parents
+
     def __builder_classification_does_use_parent_child(self, classification):
         classification_items = classification.get_data_items()
         for item in classification_items:
@@ -74,20 +88,40 @@ class EthnicityClassificationMatcher:
                 return True
         return False
 
-    def __builder_classification_values_include_required_parents(self, classification, standard_values):
-        classification_items = classification.get_data_items()
-        required_parents = set([item.get_parent() for item in classification_items if item.is_required()])
-
+    def __builder_classification_values_include_required_parents(
+        self, classification, standard_values, required_parents
+    ):
         displayed_items = set(
             [
                 classification.get_data_item_for_standard_ethnicity(value).get_display_ethnicity()
-                for value in standard_values
+                for value in set(standard_values)
             ]
         )
 
         return required_parents.issubset(displayed_items)
 
 
+_matcher_for_finder = (None, None)
+
+
+def get_classification_matcher(classification_finder):
+    """
+    The matcher for a classification finder, kept for as long as that finder is the current one, so that what it's
+    worked out about each classification is reused across saves.
+    """
+    global _matcher_for_finder
+
+    finder, matcher = _matcher_for_finder
+    if finder is not classification_finder:
+        matcher = EthnicityClassificationMatcher(
+            ethnicity_standardiser=classification_finder.standardiser,
+            ethnicity_classification_collection=classification_finder.classification_collection,
+        )
+        _matcher_for_finder = (classification_finder, matcher)
+
+    return matcher
+
+
 # This differs from ClassificationWithIncludesParentsAllUnknown only in the naming of the variables.
 # Here we have has_... but there we have includes_...
 # This is because chart and table builders use has_... and database model uses includes_...
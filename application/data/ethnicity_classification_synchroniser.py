@@ -1,4 +1,11 @@
-from application.cms.exceptions import ClassificationNotFoundException
+from dataclasses import dataclass, field
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from application import db
+from application.cms.models import Classification, Ethnicity, association_table, parent_association_table
+from application.dashboard.summary_tables import refresh_dashboard_summaries
 
 """
 A synchroniser uses the standardiser settings csv as our single source of truth
@@ -6,20 +13,88 @@ A synchroniser uses the standardiser settings csv as our single source of truth
 Matching is done on classification id
 """
 
+NEW_ETHNICITY_POSITION = 999
+
+# Synchronisations are serialised on this advisory lock, so that two running at once can't both insert the ethnicities
+# and links which are missing.
+CLASSIFICATION_SYNCHRONISATION_LOCK_ID = 0x73796E63
+
+
+@dataclass
+class SynchronisationReport:
+    classifications_created: list = field(default_factory=list)
+    classifications_updated: list = field(default_factory=list)
+    ethnicities_created: list = field(default_factory=list)
+    ethnicity_links_created: int = 0
+    parent_links_created: int = 0
+
+    def __str__(self):
+        return (
+            f"{len(self.classifications_created)} classifications created, "
+            f"{len(self.classifications_updated)} updated, "
+            f"{len(self.ethnicities_created)} ethnicities created, "
+            f"{self.ethnicity_links_created} ethnicity links and {self.parent_links_created} parent links created"
+        )
+
 
 class EthnicityClassificationSynchroniser:
+    """
+    Brings the classifications in the database into line with a classification collection, in a single transaction.
+
+    The whole collection is compared with the database in a handful of queries, and only the differences are written:
+    classifications are upserted by id, missing ethnicities are inserted together, and any missing links between them
+    are added. Nothing is ever deleted, as dimensions may still refer to a classification which has been removed from
+    the collection.
+    """
+
     def __init__(self, classification_service):
         self.classification_service = classification_service
 
-    def synchronise_classifications(self, ethnicity_classification_collection):
-        classifications = ethnicity_classification_collection.get_classifications()
-        classifications.sort(key=lambda classification: self.__split_classification_id(classification.id))
+    def synchronise_classifications(self, ethnicity_classification_collection, wait_for_lock=True):
+        """
+        Returns a report of what was changed. If `wait_for_lock` is False and another synchronisation is already
+        running, returns None without doing anything.
+        """
+        # Sort a copy, as the collection may be in use by a running app's classification finder.
+        classifications = sorted(
+            ethnicity_classification_collection.get_classifications(),
+            key=lambda classification: self.__split_classification_id(classification.id),
+        )
+
+        # Classifications ending with "+" are the same as those without, but with parent values included in the data.
+        # The database only has the one without, and its position leaves a gap for the other.
+        positioned_classifications = [
+            (position, classification)
+            for position, classification in enumerate(classifications)
+            if classification.id.endswith("+") is not True
+        ]
+
+        report = SynchronisationReport()
+        try:
+            if wait_for_lock:
+                db.session.execute(select([func.pg_advisory_xact_lock(CLASSIFICATION_SYNCHRONISATION_LOCK_ID)]))
+            elif not db.session.execute(
+                select([func.pg_try_advisory_xact_lock(CLASSIFICATION_SYNCHRONISATION_LOCK_ID)])
+            ).scalar():
+                db.session.rollback()
+                return None
 
-        for index, classification in enumerate(ethnicity_classification_collection.get_classifications()):
-            if classification.id.endswith("+") is not True:
-                self.__synchronise_classification(classification, position=index)
+            self.__synchronise_classification_rows(positioned_classifications, report)
+            self.__synchronise_ethnicities_and_links(
+                [classification for position, classification in positioned_classifications], report
+            )
+            self.__update_not_applicable()
+            if report.classifications_updated or report.ethnicity_links_created or report.parent_links_created:
+                # These changes aren't made through the ORM, so the dashboards don't see them by themselves
+                refresh_dashboard_summaries(db.session)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            self.classification_service.clear_classification_id_cache()
 
-        self.__update_not_applicable()
+        return report
 
     def __split_classification_id(self, classification_id):
         digits = [character for character in classification_id if character.isdigit()]
@@ -29,50 +104,120 @@ class EthnicityClassificationSynchroniser:
         else:
             return 1000, classification_id
 
-    def __synchronise_classification(self, classification, position=999):
-        try:
-            self.__update_database_classification(classification, position=position)
-        except ClassificationNotFoundException:
-            self.__create_database_classification(classification, position=position)
-
-    def __update_database_classification(self, classification, position):
-        database_classification = self.classification_service.get_classification_by_id(classification.id)
-
-        if database_classification:
-            database_classification.title = classification.name
-            database_classification.long_title = classification.long_name
-            database_classification.subfamily = ""
-            database_classification.position = position
-            self.classification_service.update_classification(database_classification)
-
-    def __create_database_classification(self, classification, position):
-        values = classification.get_display_values()
-        if classification.has_parent_child_relationship():
-            parents = classification.get_parent_values()
-        else:
-            parents = []
-
-        self.classification_service.create_classification_with_values(
-            classification.id,
-            "",
-            classification.name,
-            long_title=classification.long_name,
-            position=position,
-            values=values,
-            values_as_parent=parents,
+    @staticmethod
+    def __synchronise_classification_rows(positioned_classifications, report):
+        classification_ids = [classification.id for position, classification in positioned_classifications]
+        existing_rows = {
+            row.id: row
+            for row in db.session.query(
+                Classification.id,
+                Classification.title,
+                Classification.long_title,
+                Classification.subfamily,
+                Classification.position,
+            ).filter(Classification.id.in_(classification_ids))
+        }
+
+        rows_to_write = []
+        for position, classification in positioned_classifications:
+            row = {
+                "id": classification.id,
+                "title": classification.name,
+                "long_title": classification.long_name,
+                "subfamily": "",
+                "position": position,
+            }
+            existing_row = existing_rows.get(classification.id)
+            if existing_row is None:
+                report.classifications_created.append(classification.id)
+            elif existing_row._asdict() != row:
+                report.classifications_updated.append(classification.id)
+            else:
+                continue
+            rows_to_write.append(row)
+
+        if rows_to_write:
+            upsert = insert(Classification.__table__).values(rows_to_write)
+            upsert = upsert.on_conflict_do_update(
+                index_elements=[Classification.__table__.c.id],
+                set_={column: upsert.excluded[column] for column in ["title", "long_title", "subfamily", "position"]},
+            )
+            db.session.execute(upsert)
+
+    @staticmethod
+    def __synchronise_ethnicities_and_links(classifications, report):
+        values_by_classification_id = {
+            classification.id: set(classification.get_display_values()) for classification in classifications
+        }
+        parent_values_by_classification_id = {
+            classification.id: set(classification.get_parent_values())
+            for classification in classifications
+            if classification.has_parent_child_relationship()
+        }
+
+        ethnicity_ids_by_value = EthnicityClassificationSynchroniser.__get_or_create_ethnicity_ids(
+            set().union(*values_by_classification_id.values(), *parent_values_by_classification_id.values()), report,
+        )
+
+        report.ethnicity_links_created = EthnicityClassificationSynchroniser.__add_missing_links(
+            association_table, values_by_classification_id, ethnicity_ids_by_value
+        )
+        report.parent_links_created = EthnicityClassificationSynchroniser.__add_missing_links(
+            parent_association_table, parent_values_by_classification_id, ethnicity_ids_by_value
+        )
+
+    @staticmethod
+    def __get_or_create_ethnicity_ids(values, report):
+        if not values:
+            return {}
+
+        # There can be more than one ethnicity with the same value, in which case the first one created is used.
+        ethnicity_ids_by_value = {}
+        for ethnicity_id, value in (
+            db.session.query(Ethnicity.id, Ethnicity.value).filter(Ethnicity.value.in_(values)).order_by(Ethnicity.id)
+        ):
+            ethnicity_ids_by_value.setdefault(value, ethnicity_id)
+
+        missing_values = sorted(values - set(ethnicity_ids_by_value))
+        if missing_values:
+            created_ethnicities = db.session.execute(
+                insert(Ethnicity.__table__)
+                .values([{"value": value, "position": NEW_ETHNICITY_POSITION} for value in missing_values])
+                .returning(Ethnicity.__table__.c.id, Ethnicity.__table__.c.value)
+            )
+            for ethnicity_id, value in created_ethnicities:
+                ethnicity_ids_by_value[value] = ethnicity_id
+            report.ethnicities_created.extend(missing_values)
+
+        return ethnicity_ids_by_value
+
+    @staticmethod
+    def __add_missing_links(link_table, values_by_classification_id, ethnicity_ids_by_value):
+        if not values_by_classification_id:
+            return 0
+
+        existing_links = set(
+            db.session.query(link_table.c.classification_id, link_table.c.ethnicity_id).filter(
+                link_table.c.classification_id.in_(values_by_classification_id)
+            )
         )
+        missing_links = [
+            {"classification_id": classification_id, "ethnicity_id": ethnicity_ids_by_value[value]}
+            for classification_id, values in values_by_classification_id.items()
+            for value in sorted(values)
+            if (classification_id, ethnicity_ids_by_value[value]) not in existing_links
+        ]
+        if missing_links:
+            db.session.execute(link_table.insert(), missing_links)
+
+        return len(missing_links)
 
+    @staticmethod
     def __update_not_applicable(
-        self, na_code="NA", na_title="Not applicable", na_long_title="Not applicable", na_position=9999
+        na_code="NA", na_title="Not applicable", na_long_title="Not applicable", na_position=9999
     ):
-        try:
-            na_classification = self.classification_service.get_classification_by_id(na_code)
-
-            if na_classification:
-                na_classification.title = na_title
-                na_classification.long_title = na_long_title
-                na_classification.subfamily = ""
-                na_classification.position = na_position
-                self.classification_service.update_classification(na_classification)
-        except ClassificationNotFoundException:
-            pass
+        db.session.execute(
+            Classification.__table__.update()
+            .where(Classification.__table__.c.id == na_code)
+            .values(title=na_title, long_title=na_long_title, subfamily="", position=na_position)
+        )
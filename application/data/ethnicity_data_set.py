@@ -1,5 +1,44 @@
+from array import array
+
+DEFAULT_ETHNICITY_TYPE_COLUMNS = ["ethnicity type", "ethnicity_type", "ethnicity-type"]
+
+
+def find_ethnicity_column_index(headers):
+    """
+    The index of the first header starting with "ethnic", or None if there isn't one.
+    """
+    for index, header in enumerate(headers):
+        if header.strip().lower().startswith("ethnic"):
+            return index
+    return None
+
+
+def find_ethnicity_type_column_index(headers):
+    for index, header in enumerate(headers):
+        if header.strip().lower() in DEFAULT_ETHNICITY_TYPE_COLUMNS:
+            return index
+    return None
+
+
+def read_unique_ethnicities(rows):
+    """
+    Reads the distinct values of the ethnicity column from rows (e.g. from a csv.reader) in a single pass, in the
+    order they first appear, without keeping the rest of the data.
+
+    :return: The ethnicity column's header and its distinct values, or (None, []) if there's no ethnicity column
+    """
+    rows = iter(rows)
+    headers = next(rows, [])
+    ethnicity_index = find_ethnicity_column_index(headers)
+    if ethnicity_index is None:
+        return None, []
+
+    unique_ethnicities = dict.fromkeys(row[ethnicity_index] for row in rows if len(row) > ethnicity_index)
+    return headers[ethnicity_index], list(unique_ethnicities)
+
+
 class EthnicityDataset:
-    DEFAULT_ETHNICITY_TYPE_COLUMNS = ["ethnicity type", "ethnicity_type", "ethnicity-type"]
+    DEFAULT_ETHNICITY_TYPE_COLUMNS = DEFAULT_ETHNICITY_TYPE_COLUMNS
 
     def __init__(self, data):
         self.data = data
@@ -10,18 +49,12 @@ class EthnicityDataset:
         return len(self.data) - 1
 
     def __get_ethnicity_index(self):
-        simple_headers = [header.strip().lower() for header in self.get_headers()]
-        for index, cell in enumerate(simple_headers):
-            if cell.startswith("ethnic"):
-                return index
-        return 0
+        ethnicity_index = find_ethnicity_column_index(self.get_headers())
+        return ethnicity_index if ethnicity_index is not None else 0
 
     def __get_ethnicity_type_index(self):
-        simple_headers = [header.strip().lower() for header in self.get_headers()]
-        for index, cell in enumerate(simple_headers):
-            if cell in self.DEFAULT_ETHNICITY_TYPE_COLUMNS:
-                return index
-        return self.ethnicity_index
+        ethnicity_type_index = find_ethnicity_type_column_index(self.get_headers())
+        return ethnicity_type_index if ethnicity_type_index is not None else self.ethnicity_index
 
     def get_headers(self):
         return self.data[0]
@@ -43,3 +76,118 @@ class EthnicityDataset:
 
     def append_to_row(self, row, values):
         self.data[row + 1] += values
+
+
+class ColumnarEthnicityDataset:
+    """
+    An EthnicityDataset which stores its data a column at a time, for large uploaded files.
+
+    The ethnicity column is dictionary-encoded: each distinct value is stored once in `ethnicity_categories`, in the
+    order they first appear, and `ethnicity_codes` holds the position of each row's value in that list. Finding the
+    unique ethnicities and standardising them then only does work per distinct value, and derived columns are added
+    whole rather than by appending to every row.
+    """
+
+    def __init__(self, headers, columns):
+        """
+        :param columns: A list of values for each header, all the same length, which the dataset takes over
+        """
+        self.headers = list(headers)
+        self.columns = list(columns)
+        self.ethnicity_index = self.__get_ethnicity_index()
+        self.ethnicity_type_index = self.__get_ethnicity_type_index()
+        self.ethnicity_codes, self.ethnicity_categories = self.__encode(
+            self.columns[self.ethnicity_index] if self.columns else []
+        )
+
+    @classmethod
+    def from_rows(cls, data):
+        """
+        Builds a dataset from rows, e.g. from a csv.reader, the first of which is the headers. The rows are read one
+        at a time, so only the columns are held in memory. Short rows are padded with empty values, and values beyond
+        the last header are dropped.
+        """
+        rows = iter(data)
+        headers = next(rows, [])
+        columns = [[] for _ in headers]
+        appends = [column.append for column in columns]
+        width = len(headers)
+
+        for row in rows:
+            if len(row) < width:
+                row = list(row) + [""] * (width - len(row))
+            for append, value in zip(appends, row):
+                append(value)
+
+        return cls(headers, columns)
+
+    @classmethod
+    def from_ethnicities(cls, raw_ethnicities, header="Ethnicity"):
+        """
+        Builds a dataset with just an ethnicity column.
+        """
+        return cls([header], [list(raw_ethnicities)])
+
+    def __len__(self):
+        return len(self.ethnicity_codes)
+
+    def __get_ethnicity_index(self):
+        ethnicity_index = find_ethnicity_column_index(self.headers)
+        return ethnicity_index if ethnicity_index is not None else 0
+
+    def __get_ethnicity_type_index(self):
+        ethnicity_type_index = find_ethnicity_type_column_index(self.headers)
+        return ethnicity_type_index if ethnicity_type_index is not None else self.ethnicity_index
+
+    @staticmethod
+    def __encode(column):
+        code_by_value = {}
+        codes = array("L", [code_by_value.setdefault(value, len(code_by_value)) for value in column])
+        return codes, list(code_by_value)
+
+    def get_headers(self):
+        return self.headers
+
+    def get_column(self, index):
+        return self.columns[index]
+
+    def get_ethnicity(self, row):
+        return self.ethnicity_categories[self.ethnicity_codes[row]]
+
+    def get_ethnicity_type(self, row):
+        return self.columns[self.ethnicity_type_index][row]
+
+    def get_data(self):
+        return [self.headers] + [list(row) for row in zip(*self.columns)]
+
+    def get_unique_ethnicities(self):
+        return set(self.ethnicity_categories)
+
+    def get_ethnicity_categories_by_last_appearance(self):
+        """
+        The distinct ethnicities, in the order in which each appears for the last time.
+        """
+        last_row_by_code = dict(zip(self.ethnicity_codes, range(len(self))))
+        return [self.ethnicity_categories[code] for code in sorted(last_row_by_code, key=last_row_by_code.get)]
+
+    def decode(self, values_by_code):
+        """
+        A column with the value for each row's ethnicity, given the values for `ethnicity_categories` in the same order.
+        """
+        return list(map(values_by_code.__getitem__, self.ethnicity_codes))
+
+    def get_standardised_ethnicities(self, standardiser):
+        """
+        The standard ethnicity of every row, looking each distinct raw ethnicity up only once.
+        """
+        return self.decode(standardiser.standardise_all(self.ethnicity_categories))
+
+    def append_column(self, header, values):
+        values = list(values)
+        if len(values) != len(self):
+            raise ValueError(f"Column '{header}' has {len(values)} values but the dataset has {len(self)} rows")
+        self.headers.append(header)
+        self.columns.append(values)
+
+    def append_standardised_ethnicity_column(self, standardiser, header="Standardised ethnicity"):
+        self.append_column(header, self.get_standardised_ethnicities(standardiser))
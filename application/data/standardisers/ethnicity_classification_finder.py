@@ -1,3 +1,18 @@
+import json
+import threading
+from collections import Counter, OrderedDict
+
+from application.data.ethnicity_data_set import ColumnarEthnicityDataset
+from application.data.standardisers.ethnicity_lookup_index import (
+    EthnicityLookupIndex,
+    StandardisationMatch,
+    StandardisationRule,
+)
+
+# Raw values are mostly the same few hundred variants, so this easily covers every distinct one seen by a worker.
+STANDARDISER_CACHE_SIZE = 10000
+
+
 class EthnicityClassificationFinder:
     """
     EthnicityClassificationFinder is the standardiser used by ChartBuilder and TableBuilder
@@ -14,10 +29,33 @@ class EthnicityClassificationFinder:
         self.classification_collection = ethnicity_classification_collection
 
     def find_classifications(self, raw_ethnicities):
-        valid_classifications = self.__get_valid_classifications(raw_ethnicities)
+        return self.__find_classifications(raw_ethnicities, self.standardiser)
+
+    def find_classifications_for_datasets(self, raw_ethnicity_lists):
+        """
+        Finds classifications for many lists of raw ethnicities at once (e.g. every dimension of a measure version),
+        returning the same output as `find_classifications` for each list, in the same order.
+
+        Identical lists are only classified once, and each distinct raw value is only standardised once however many
+        lists it appears in.
+        """
+        unique_datasets = list(dict.fromkeys(tuple(raw_ethnicities) for raw_ethnicities in raw_ethnicity_lists))
+        standardiser = self.standardiser.standardiser_for(
+            raw_ethnicity for raw_ethnicities in unique_datasets for raw_ethnicity in raw_ethnicities
+        )
+
+        outputs_by_dataset = {
+            raw_ethnicities: self.__find_classifications(list(raw_ethnicities), standardiser)
+            for raw_ethnicities in unique_datasets
+        }
+
+        return [outputs_by_dataset[tuple(raw_ethnicities)] for raw_ethnicities in raw_ethnicity_lists]
+
+    def __find_classifications(self, raw_ethnicities, standardiser):
+        valid_classifications = self.classification_collection.get_valid_classifications(raw_ethnicities, standardiser)
 
         classification_data = [
-            classification.get_outputs(raw_ethnicities, self.standardiser) for classification in valid_classifications
+            classification.get_outputs(raw_ethnicities, standardiser) for classification in valid_classifications
         ]
         custom_data = EthnicityClassification.get_custom_data_outputs(raw_ethnicities)
 
@@ -25,24 +63,87 @@ class EthnicityClassificationFinder:
 
         return all_output_data
 
+    def find_classifications_as_json(self, raw_ethnicities, compact=False):
+        """
+        Returns the output of `find_classifications`, as a JSON object under "classifications", with each
+        classification's definition spliced in from JSON encoded when the classification was loaded.
+
+        If `compact` is set, each output only holds its classification's id under "classification_id", and the
+        definitions are listed once each under "definitions" instead.
+        """
+        classification_outputs = [
+            (classification, classification.get_mapped_raw_data(raw_ethnicities, self.standardiser))
+            for classification in self.classification_collection.get_valid_classifications(
+                raw_ethnicities, self.standardiser
+            )
+        ]
+        custom_output = json.dumps(EthnicityClassification.get_custom_data_outputs(raw_ethnicities))
+
+        if compact:
+            outputs = [
+                '{"classification_id": %s, "data": %s}' % (json.dumps(classification.get_id()), json.dumps(data))
+                for classification, data in classification_outputs
+            ]
+            definitions = [
+                "%s: %s" % (json.dumps(classification.get_id()), classification.get_classification_as_json())
+                for classification, data in classification_outputs
+            ]
+            return '{"classifications": [%s], "definitions": {%s}}' % (
+                ", ".join(outputs + [custom_output]),
+                ", ".join(definitions),
+            )
+
+        outputs = [
+            '{"classification": %s, "data": %s}' % (classification.get_classification_as_json(), json.dumps(data))
+            for classification, data in classification_outputs
+        ]
+        return '{"classifications": [%s]}' % ", ".join(outputs + [custom_output])
+
     @staticmethod
     def find_classifications_for_default_finder(raw_ethnicities):
         custom_data = EthnicityClassification.get_custom_data_outputs(raw_ethnicities)
         return [custom_data]
 
-    def __get_valid_classifications(self, raw_ethnicities):
-        return self.classification_collection.get_valid_classifications(raw_ethnicities, self.standardiser)
-
     def get_classification_collection(self):
         return self.classification_collection
 
+    def build_indexes(self):
+        """
+        Builds the indexes which are otherwise built the first time they're needed, so that they're included when the
+        finder is shared with forked processes or saved as a snapshot.
+        """
+        self.classification_collection.get_index()
+        self.standardiser.get_lookup_index()
+
 
 class EthnicityStandardiser:
-    def __init__(self, ethnicity_map=None):
+    """
+    Converts raw ethnicities to standard ethnicities, using a lookup of raw ethnicities (after trimming and ignoring
+    case). Values which aren't in the lookup are matched against an `EthnicityLookupIndex`, to pick up variants in
+    punctuation, white space, word order and spelling; anything still unmatched is left as it is.
+    """
+
+    def __init__(self, ethnicity_map=None, cache_size=STANDARDISER_CACHE_SIZE):
         if ethnicity_map:
             self.ethnicity_map = ethnicity_map
         else:
             self.ethnicity_map = {}
+        self.cache_size = cache_size
+        self.__lookup_index = None
+        self.__matches_by_raw_ethnicity = OrderedDict()
+        self.__matches_lock = threading.Lock()
+
+    def __getstate__(self):
+        # Resolved values are left out of pickled standardisers (e.g. finder snapshots), as is the lock guarding them.
+        state = self.__dict__.copy()
+        del state["_EthnicityStandardiser__matches_by_raw_ethnicity"]
+        del state["_EthnicityStandardiser__matches_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__matches_by_raw_ethnicity = OrderedDict()
+        self.__matches_lock = threading.Lock()
 
     def __len__(self):
         return len(self.ethnicity_map)
@@ -50,28 +151,84 @@ class EthnicityStandardiser:
     def add_conversion(self, raw_ethnicity, standard_ethnicity):
         lookup_value = self.simplify_key(raw_ethnicity)
         self.ethnicity_map[lookup_value] = standard_ethnicity
+        self.__lookup_index = None
+        with self.__matches_lock:
+            self.__matches_by_raw_ethnicity.clear()
 
     @classmethod
     def simplify_key(cls, key_value):
         return key_value.strip().lower()
 
     def standardise(self, raw_ethnicity):
+        return self.resolve(raw_ethnicity).standard_ethnicity
+
+    def resolve(self, raw_ethnicity):
+        """
+        Returns a StandardisationMatch with the standard ethnicity for `raw_ethnicity` and the rule which matched it,
+        which is None if nothing did.
+        """
+        matches = self.__matches_by_raw_ethnicity
+        with self.__matches_lock:
+            match = matches.get(raw_ethnicity)
+            if match is not None:
+                matches.move_to_end(raw_ethnicity)
+                return match
+
+        match = self.__resolve_uncached(raw_ethnicity)
+        with self.__matches_lock:
+            matches[raw_ethnicity] = match
+            if len(matches) > self.cache_size:
+                matches.popitem(last=False)
+
+        return match
+
+    def get_lookup_index(self):
+        if self.__lookup_index is None:
+            self.__lookup_index = EthnicityLookupIndex(self.ethnicity_map)
+        return self.__lookup_index
+
+    def __resolve_uncached(self, raw_ethnicity):
         lookup_value = self.simplify_key(raw_ethnicity)
         if lookup_value in self.ethnicity_map:
-            return self.ethnicity_map[lookup_value]
-        else:
-            return raw_ethnicity
+            return StandardisationMatch(self.ethnicity_map[lookup_value], StandardisationRule.EXACT)
+
+        return self.get_lookup_index().find(raw_ethnicity) or StandardisationMatch(raw_ethnicity, None)
 
     def standardise_all(self, raw_ethnicities):
         return [self.standardise(raw_ethnicity) for raw_ethnicity in raw_ethnicities]
 
+    def standardiser_for(self, raw_ethnicities):
+        return PrecomputedEthnicityStandardiser(
+            {raw_ethnicity: self.standardise(raw_ethnicity) for raw_ethnicity in set(raw_ethnicities)}
+        )
+
+
+class PrecomputedEthnicityStandardiser:
+    """
+    Standardises a known set of raw ethnicities, looked up up front by `EthnicityStandardiser.standardiser_for`.
+    """
+
+    def __init__(self, standard_ethnicity_by_raw_ethnicity):
+        self.standard_ethnicity_by_raw_ethnicity = standard_ethnicity_by_raw_ethnicity
+
+    def __len__(self):
+        return len(self.standard_ethnicity_by_raw_ethnicity)
+
+    def standardise(self, raw_ethnicity):
+        return self.standard_ethnicity_by_raw_ethnicity[raw_ethnicity]
+
+    def standardise_all(self, raw_ethnicities):
+        return [self.standard_ethnicity_by_raw_ethnicity[raw_ethnicity] for raw_ethnicity in raw_ethnicities]
+
 
 class EthnicityClassificationCollection:
     def __init__(self):
         self.classifications = []
+        self.__index = None
 
     def add_classification(self, classification):
         self.classifications.append(classification)
+        self.__index = None
 
     def add_classifications(self, classifications):
         [self.add_classification(classification) for classification in classifications]
@@ -79,17 +236,22 @@ class EthnicityClassificationCollection:
     def get_classifications(self):
         return self.classifications
 
+    def get_index(self):
+        if self.__index is None:
+            self.__index = EthnicityClassificationIndex(self.classifications)
+        return self.__index
+
     def get_valid_classifications(self, raw_ethnicity_list, ethnicity_standardiser):
-        standardised_ethnicities = ethnicity_standardiser.standardise_all(raw_ethnicity_list)
-        valid_classifications = [
+        return [
             classification
-            for classification in self.classifications
-            if classification.is_valid_for_standard_ethnicities(standardised_ethnicities)
+            for classification, fit_level in self.get_valid_classifications_with_fit_levels(
+                raw_ethnicity_list, ethnicity_standardiser
+            )
         ]
-        valid_classifications.sort(
-            key=lambda classification: -classification.get_data_fit_level(raw_ethnicity_list, ethnicity_standardiser)
-        )
-        return valid_classifications
+
+    def get_valid_classifications_with_fit_levels(self, raw_ethnicity_list, ethnicity_standardiser):
+        standardised_ethnicities = ethnicity_standardiser.standardise_all(raw_ethnicity_list)
+        return self.get_index().get_valid_classifications_for_standard_ethnicities(standardised_ethnicities)
 
     def get_classification_by_id(self, id):
         for classification in self.classifications:
@@ -117,6 +279,91 @@ class EthnicityClassificationCollection:
         return int(digits), ""
 
 
+class EthnicityClassificationIndex:
+    """
+    A precompiled index for finding the classifications which are valid for some standardised ethnicities.
+
+    Each classification is given a bit, and each standard value maps to the bits of the classifications which include
+    it, so the classifications with no unknown values are the intersection of the input's masks. Within a
+    classification each display value is given a bit too, so that checking every required display value is covered is
+    a single comparison.
+
+    The results are the same as checking `is_valid_for_standard_ethnicities` for every classification and sorting by
+    `get_data_fit_level`, but the index has to be rebuilt if a classification is changed after it's been built.
+    """
+
+    def __init__(self, classifications):
+        self.classifications = list(classifications)
+        self.all_classifications_mask = (1 << len(self.classifications)) - 1
+        self.classifications_mask_by_standard = {}
+        self.display_bit_by_standard = []
+        self.required_display_bits = []
+
+        for position, classification in enumerate(self.classifications):
+            display_bit_positions = {}
+            display_bit_by_standard = {}
+            for standard, display in classification.standard_value_to_display_value_map.items():
+                display_bit_by_standard[standard] = 1 << display_bit_positions.setdefault(
+                    display, len(display_bit_positions)
+                )
+                self.classifications_mask_by_standard[standard] = self.classifications_mask_by_standard.get(
+                    standard, 0
+                ) | (1 << position)
+
+            required_display_bits = 0
+            for item in classification.get_data_items():
+                if item.is_required() is True:
+                    required_display_bits |= 1 << display_bit_positions.setdefault(
+                        item.get_display_ethnicity(), len(display_bit_positions)
+                    )
+
+            self.display_bit_by_standard.append(display_bit_by_standard)
+            self.required_display_bits.append(required_display_bits)
+
+    def get_valid_classifications_for_standard_ethnicities(self, standard_ethnicities):
+        """
+        Returns (classification, fit level) pairs for each valid classification, best fitting first.
+        """
+        standard_ethnicity_counts = Counter(standard_ethnicities)
+
+        candidates = self.all_classifications_mask
+        for standard in standard_ethnicity_counts:
+            candidates &= self.classifications_mask_by_standard.get(standard, 0)
+            if not candidates:
+                return []
+
+        valid_classifications = []
+        while candidates:
+            lowest_candidate = candidates & -candidates
+            candidates ^= lowest_candidate
+            position = lowest_candidate.bit_length() - 1
+
+            display_bit_by_standard = self.display_bit_by_standard[position]
+            covered_display_bits = 0
+            for standard in standard_ethnicity_counts:
+                covered_display_bits |= display_bit_by_standard[standard]
+
+            required_display_bits = self.required_display_bits[position]
+            if covered_display_bits & required_display_bits == required_display_bits:
+                classification = self.classifications[position]
+                valid_classifications.append(
+                    (classification, self.__fit_level(classification, standard_ethnicity_counts))
+                )
+
+        valid_classifications.sort(key=lambda classification_and_fit_level: -classification_and_fit_level[1])
+        return valid_classifications
+
+    @staticmethod
+    def __fit_level(classification, standard_ethnicity_counts):
+        # Matches `EthnicityClassification.get_data_fit_level`, which counts the values whose standard value is also
+        # one of the classification's display values.
+        return sum(
+            count
+            for standard, count in standard_ethnicity_counts.items()
+            if standard in classification.classification_data_items
+        )
+
+
 class EthnicityClassificationDataItem:
     """
     An ethnicity classification data item contains the return data for that
@@ -156,6 +403,9 @@ class EthnicityClassification:
             self.long_name = name
         self.standard_value_to_display_value_map = {}
         self.classification_data_items = {}
+        self.__classification_as_dictionary = None
+        self.__classification_as_json = None
+        self.__output_rows_by_standard = None
 
     def get_id(self):
         return self.id
@@ -194,6 +444,9 @@ class EthnicityClassification:
     def add_data_item_to_classification(self, standard, classification_data_item):
         self.standard_value_to_display_value_map[standard] = classification_data_item.display_ethnicity
         self.classification_data_items[classification_data_item.display_ethnicity] = classification_data_item
+        self.__classification_as_dictionary = None
+        self.__classification_as_json = None
+        self.__output_rows_by_standard = None
 
     def __has_data_for_all_required_display_ethnicities(self, standard_ethnicity_list):
         required = self.__get_required_display_ethnicities()
@@ -235,34 +488,53 @@ class EthnicityClassification:
 
     def get_outputs(self, raw_ethnicities, ethnicity_standardiser):
         return {
-            "classification": self.__get_classification_as_dictionary(),
-            "data": self.__get_mapped_raw_data(raw_ethnicities, ethnicity_standardiser),
+            "classification": self.get_classification_as_dictionary(),
+            "data": self.get_mapped_raw_data(raw_ethnicities, ethnicity_standardiser),
         }
 
-    def __get_classification_as_dictionary(self):
-        standards = list(self.standard_value_to_display_value_map.keys())
+    def get_classification_as_dictionary(self):
+        """
+        The definition of this classification, as included in every output for it. It's only worked out once, so
+        mustn't be modified.
+        """
+        if self.__classification_as_dictionary is None:
+            standards = list(self.standard_value_to_display_value_map.keys())
+            self.__classification_as_dictionary = {
+                "id": self.id,
+                "name": self.name,
+                "map": {
+                    standard: self.get_data_item_for_standard_ethnicity(standard).to_dict() for standard in standards
+                },
+            }
+        return self.__classification_as_dictionary
+
+    def get_classification_as_json(self):
+        if self.__classification_as_json is None:
+            self.__classification_as_json = json.dumps(self.get_classification_as_dictionary())
+        return self.__classification_as_json
+
+    def get_mapped_raw_data(self, raw_ethnicities, ethnicity_standardiser):
+        if self.__output_rows_by_standard is None:
+            self.__output_rows_by_standard = {
+                standard: self.__output_row(standard, self.get_data_item_for_standard_ethnicity(standard))
+                for standard in self.standard_value_to_display_value_map
+            }
+
+        output_rows_by_standard = self.__output_rows_by_standard
+        return [
+            {"raw_value": raw_ethnicity, **output_rows_by_standard[ethnicity_standardiser.standardise(raw_ethnicity)]}
+            for raw_ethnicity in raw_ethnicities
+        ]
+
+    @staticmethod
+    def __output_row(standard_ethnicity, classification_data_item):
         return {
-            "id": self.id,
-            "name": self.name,
-            "map": {standard: self.get_data_item_for_standard_ethnicity(standard).to_dict() for standard in standards},
+            "standard_value": standard_ethnicity,
+            "display_value": classification_data_item.display_ethnicity,
+            "parent": classification_data_item.parent,
+            "order": classification_data_item.order,
         }
 
-    def __get_mapped_raw_data(self, raw_ethnicities, ethnicity_standardiser):
-        output_data = []
-        for raw_ethnicity in raw_ethnicities:
-            standard_ethnicity = ethnicity_standardiser.standardise(raw_ethnicity)
-            classification_data_item = self.get_data_item_for_standard_ethnicity(standard_ethnicity)
-            output_data.append(
-                {
-                    "raw_value": raw_ethnicity,
-                    "standard_value": standard_ethnicity,
-                    "display_value": classification_data_item.display_ethnicity,
-                    "parent": classification_data_item.parent,
-                    "order": classification_data_item.order,
-                }
-            )
-        return output_data
-
     def get_data_item_for_raw_ethnicity(self, raw_ethnicity, ethnicity_standardiser):
         standard_ethnicity = ethnicity_standardiser.standardise(raw_ethnicity)
         return self.get_data_item_for_standard_ethnicity(standard_ethnicity)
@@ -273,32 +545,47 @@ class EthnicityClassification:
 
     @staticmethod
     def get_custom_data_outputs(raw_ethnicities):
-        custom_classification = EthnicityClassification.__get_custom_classification(raw_ethnicities)
-        custom_standardiser = EthnicityClassification.__get_custom_standardiser(raw_ethnicities)
-        return custom_classification.get_outputs(raw_ethnicities, custom_standardiser)
+        """
+        The output for a classification made up on the spot, with a required item for each distinct raw value.
+
+        The raw values are dictionary-encoded, so that each distinct one is only looked at once however many rows it's
+        in.
+        """
+        dataset = ColumnarEthnicityDataset.from_ethnicities(raw_ethnicities)
+        unique_raw_values = dataset.ethnicity_categories
+        data_items = {
+            value: EthnicityClassificationDataItem(display_ethnicity=value, parent=value, order=ind, required=True)
+            for ind, value in enumerate(unique_raw_values)
+        }
 
-    @staticmethod
-    def __get_custom_classification(raw_ethnicities):
-        classification = EthnicityClassification("custom", "[Custom]", "[Custom]")
+        # As with a standardiser, raw values which only differ by case or surrounding white space all standardise to
+        # the last of them.
+        standard_by_key = {
+            EthnicityStandardiser.simplify_key(value): value
+            for value in dataset.get_ethnicity_categories_by_last_appearance()
+        }
 
-        unique_raw_values = EthnicityClassification.__order_preserving_remove_duplicates(raw_ethnicities)
-        for ind, value in enumerate(unique_raw_values):
-            classification_data_item = EthnicityClassificationDataItem(
-                display_ethnicity=value, parent=value, order=ind, required=True
+        output_rows_by_code = []
+        for raw_ethnicity in unique_raw_values:
+            standard_ethnicity = standard_by_key[EthnicityStandardiser.simplify_key(raw_ethnicity)]
+            output_rows_by_code.append(
+                {
+                    "raw_value": raw_ethnicity,
+                    **EthnicityClassification.__output_row(standard_ethnicity, data_items[standard_ethnicity]),
+                }
             )
-            classification.add_data_item_to_classification(value, classification_data_item)
-        return classification
 
-    @staticmethod
-    def __get_custom_standardiser(raw_ethnicities):
-        standardiser = EthnicityStandardiser()
-        for ethnicity in raw_ethnicities:
-            standardiser.add_conversion(ethnicity, ethnicity)
-        return standardiser
+        # Each row gets its own copy of the output for its raw value
+        data = list(map(dict, dataset.decode(output_rows_by_code)))
 
-    @staticmethod
-    def __order_preserving_remove_duplicates(values):
-        return list(dict.fromkeys(values))
+        return {
+            "classification": {
+                "id": "custom",
+                "name": "[Custom]",
+                "map": {value: data_item.to_dict() for value, data_item in data_items.items()},
+            },
+            "data": data,
+        }
 
     @staticmethod
     def __remove_duplicates(values):
@@ -1,3 +1,8 @@
+import hashlib
+import os
+import pickle
+import tempfile
+
 from application.data.standardisers.ethnicity_classification_finder import (
     EthnicityStandardiser,
     EthnicityClassificationCollection,
@@ -5,7 +10,15 @@ from application.data.standardisers.ethnicity_classification_finder import (
     EthnicityClassificationDataItem,
     EthnicityClassificationFinder,
 )
-from application.utils import get_bool
+from application.utils import get_bool, is_private_to_current_user
+
+# Bump this whenever the classes saved in a finder snapshot change, so that old snapshots are ignored.
+ETHNICITY_CLASSIFICATION_FINDER_SNAPSHOT_FORMAT = 1
+
+# The finder this process loaded last, by a hash of its source files. Every app created in a process shares it, and if
+# the app is created before workers are forked (e.g. gunicorn --preload) so do all of the workers. Only the latest is
+# kept, so that reloading changed files doesn't hold on to every earlier finder.
+_loaded_finders = {}
 
 
 class EthnicityClassificationFileColumn:
@@ -35,11 +48,66 @@ class EthnicityClassificationDataColumn:
     REQUIRED = 4
 
 
-def ethnicity_classification_finder_from_file(standardiser_file, classification_collection_file):
-    standardiser = ethnicity_standardiser_from_file(standardiser_file)
-    ethnicity_classification_collection = ethnicity_classification_collection_from_file(classification_collection_file)
+def ethnicity_classification_finder_from_file(standardiser_file, classification_collection_file, snapshot_dir=None):
+    """
+    Loads a finder from the standardiser and classification CSV files, reusing one already loaded by this process or,
+    if `snapshot_dir` is given, a snapshot saved by an earlier process, as long as the files haven't changed since.
+    """
+    source_hash = __source_files_hash(standardiser_file, classification_collection_file)
 
-    return EthnicityClassificationFinder(standardiser, ethnicity_classification_collection)
+    finder = _loaded_finders.get(source_hash)
+    if finder is None and snapshot_dir:
+        finder = __read_snapshot(snapshot_dir, source_hash)
+
+    if finder is None:
+        standardiser = ethnicity_standardiser_from_file(standardiser_file)
+        ethnicity_classification_collection = ethnicity_classification_collection_from_file(
+            classification_collection_file
+        )
+        finder = EthnicityClassificationFinder(standardiser, ethnicity_classification_collection)
+        finder.build_indexes()
+        if snapshot_dir:
+            __write_snapshot(snapshot_dir, source_hash, finder)
+
+    _loaded_finders.clear()
+    _loaded_finders[source_hash] = finder
+    return finder
+
+
+def __source_files_hash(*file_names):
+    source_hash = hashlib.sha256(str(ETHNICITY_CLASSIFICATION_FINDER_SNAPSHOT_FORMAT).encode("utf-8"))
+    for file_name in file_names:
+        with open(file_name, "rb") as f:
+            source_hash.update(hashlib.sha256(f.read()).digest())
+    return source_hash.hexdigest()
+
+
+def __read_snapshot(snapshot_dir, source_hash):
+    snapshot_path = os.path.join(snapshot_dir, f"{source_hash}.pickle")
+    try:
+        if not (is_private_to_current_user(snapshot_dir) and is_private_to_current_user(snapshot_path)):
+            print(f"Ignoring classification finder snapshot which other users could have written: {snapshot_path}")
+            return None
+        with open(snapshot_path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # A snapshot which can't be loaded is just rebuilt, and replaced.
+        print(f"Ignoring unreadable classification finder snapshot: {e}")
+        return None
+
+
+def __write_snapshot(snapshot_dir, source_hash, finder):
+    # Write to a temporary file and then move it into place, so that processes starting at the same time never read a
+    # partly-written snapshot.
+    os.makedirs(snapshot_dir, mode=0o700, exist_ok=True)
+    if not is_private_to_current_user(snapshot_dir):
+        print(f"Not saving a classification finder snapshot to a directory other users can write: {snapshot_dir}")
+        return
+    with tempfile.NamedTemporaryFile("wb", dir=snapshot_dir, suffix=".tmp", delete=False) as temp_file:
+        pickle.dump(finder, temp_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_file.name, os.path.join(snapshot_dir, f"{source_hash}.pickle"))
 
 
 def ethnicity_classification_finder_from_data(standardiser_data, classification_collection_data):
@@ -70,13 +138,13 @@ def ethnicity_classification_collection_from_file(file_name):
 
 
 def ethnicity_classification_collection_from_data(collection_data):
-    classification_ids = set([row[EthnicityClassificationFileColumn.ID] for row in collection_data])
+    rows_by_classification_id = {}
+    for row in collection_data:
+        rows_by_classification_id.setdefault(row[EthnicityClassificationFileColumn.ID], []).append(row)
 
     classification_collection = EthnicityClassificationCollection()
-    for classification_id in classification_ids:
-        classification_collection.add_classification(
-            __classification_from_complete_data(classification_id, collection_data)
-        )
+    for classification_rows in rows_by_classification_id.values():
+        classification_collection.add_classification(__classification_from_file_data_rows(classification_rows))
     return classification_collection
 
 
@@ -106,17 +174,13 @@ def __classification_data_item_from_data(data_row):
     )
 
 
-def __classification_from_complete_data(classification_id, complete_data):
-    this_classification_data = [
-        row for row in complete_data if row[EthnicityClassificationFileColumn.ID] == classification_id
-    ]
-
+def __classification_from_file_data_rows(classification_rows):
     classification = EthnicityClassification(
-        id=this_classification_data[0][EthnicityClassificationFileColumn.ID],
-        name=this_classification_data[0][EthnicityClassificationFileColumn.SHORT_NAME],
-        long_name=this_classification_data[0][EthnicityClassificationFileColumn.LONG_NAME],
+        id=classification_rows[0][EthnicityClassificationFileColumn.ID],
+        name=classification_rows[0][EthnicityClassificationFileColumn.SHORT_NAME],
+        long_name=classification_rows[0][EthnicityClassificationFileColumn.LONG_NAME],
     )
-    for row in this_classification_data:
+    for row in classification_rows:
         data_item = __classification_data_item_from_file_data_row(row)
         classification.add_data_item_to_classification(row[EthnicityClassificationFileColumn.STANDARD_VALUE], data_item)
     return classification
@@ -0,0 +1,176 @@
+import re
+import unicodedata
+from collections import namedtuple
+
+StandardisationMatch = namedtuple("StandardisationMatch", ["standard_ethnicity", "rule"])
+
+
+class StandardisationRule:
+    """
+    An enum of the ways a raw ethnicity can be matched to the lookup, from the strictest to the loosest
+    """
+
+    EXACT = "exact"
+    NORMALISED = "normalised"
+    PUNCTUATION_FOLDED = "punctuation_folded"
+    TOKEN_SORTED = "token_sorted"
+    EDIT_DISTANCE = "edit_distance"
+
+
+# Lookup keys which are shorter than this are only matched with no typos at all, as any edit to a short key is likely
+# to turn it into a different word.
+MIN_KEY_LENGTH_FOR_ONE_EDIT = 6
+MIN_KEY_LENGTH_FOR_TWO_EDITS = 12
+
+_DASHES = re.compile("[‐‑‒–—―−]")
+_QUOTES = re.compile("[‘’‛′]")
+_SPACE_AROUND_SEPARATORS = re.compile(r"\s*([/\-:,;()])\s*")
+_WHITE_SPACE = re.compile(r"\s+")
+_NON_ALPHANUMERIC = re.compile(r"[^0-9a-z]+")
+
+# Marks a key which different lookup rows would resolve to different standard ethnicities, so can't be used.
+_AMBIGUOUS = object()
+
+
+def normalise_ethnicity(value):
+    """
+    Folds the differences in case, white space, unicode forms, dashes, quotes and "&"/"and" which don't change what
+    an ethnicity means.
+    """
+    value = unicodedata.normalize("NFKC", value).casefold()
+    value = _DASHES.sub("-", value)
+    value = _QUOTES.sub("'", value)
+    value = value.replace("&", " and ")
+    value = _WHITE_SPACE.sub(" ", value).strip()
+    return _SPACE_AROUND_SEPARATORS.sub(r"\1", value)
+
+
+def punctuation_folded_key(normalised_value):
+    return _NON_ALPHANUMERIC.sub("", normalised_value)
+
+
+def token_sorted_key(normalised_value):
+    return " ".join(sorted(token for token in _NON_ALPHANUMERIC.split(normalised_value) if token))
+
+
+def _trigrams(key):
+    padded_key = f"  {key} "
+    return {padded_key[i : i + 3] for i in range(len(padded_key) - 2)}
+
+
+def _edit_distance_within(first, second, max_distance):
+    """
+    The Levenshtein distance between `first` and `second`, or None if it's more than `max_distance`.
+    """
+    if abs(len(first) - len(second)) > max_distance:
+        return None
+
+    previous_row = list(range(len(second) + 1))
+    for i, first_character in enumerate(first, start=1):
+        current_row = [i]
+        for j, second_character in enumerate(second, start=1):
+            current_row.append(
+                min(
+                    previous_row[j] + 1,
+                    current_row[j - 1] + 1,
+                    previous_row[j - 1] + (first_character != second_character),
+                )
+            )
+        if min(current_row) > max_distance:
+            return None
+        previous_row = current_row
+
+    return previous_row[-1] if previous_row[-1] <= max_distance else None
+
+
+def _max_edit_distance(key):
+    if len(key) >= MIN_KEY_LENGTH_FOR_TWO_EDITS:
+        return 2
+    if len(key) >= MIN_KEY_LENGTH_FOR_ONE_EDIT:
+        return 1
+    return 0
+
+
+class EthnicityLookupIndex:
+    """
+    Secondary indexes over an ethnicity lookup, for raw ethnicities which don't exactly match any of its rows.
+
+    Each row is indexed under its normalised, punctuation-folded and token-sorted keys, and the punctuation-folded keys
+    are also indexed by trigram, to find the rows within a small edit distance of a misspelt value. A key that rows with
+    different standard ethnicities share (e.g. "mixed / multiple ethnic groups" and "mixed/ multiple ethnic groups") is
+    left out, so that a variant is never resolved by guessing between them.
+    """
+
+    def __init__(self, ethnicity_map):
+        self.standard_by_normalised_key = {}
+        self.standard_by_punctuation_folded_key = {}
+        self.standard_by_token_sorted_key = {}
+
+        for raw_ethnicity, standard_ethnicity in ethnicity_map.items():
+            normalised_value = normalise_ethnicity(raw_ethnicity)
+            self.__add(self.standard_by_normalised_key, normalised_value, standard_ethnicity)
+            self.__add(
+                self.standard_by_punctuation_folded_key, punctuation_folded_key(normalised_value), standard_ethnicity
+            )
+            self.__add(self.standard_by_token_sorted_key, token_sorted_key(normalised_value), standard_ethnicity)
+
+        self.keys_by_trigram = {}
+        for key, standard_ethnicity in self.standard_by_punctuation_folded_key.items():
+            if standard_ethnicity is not _AMBIGUOUS and _max_edit_distance(key):
+                for trigram in _trigrams(key):
+                    self.keys_by_trigram.setdefault(trigram, set()).add(key)
+
+    @staticmethod
+    def __add(index, key, standard_ethnicity):
+        if index.get(key, standard_ethnicity) != standard_ethnicity:
+            index[key] = _AMBIGUOUS
+        else:
+            index[key] = standard_ethnicity
+
+    def find(self, raw_ethnicity):
+        """
+        Returns a StandardisationMatch for `raw_ethnicity`, or None if no rule matches it unambiguously.
+        """
+        normalised_value = normalise_ethnicity(raw_ethnicity)
+        folded_key = punctuation_folded_key(normalised_value)
+        lookups = [
+            (StandardisationRule.NORMALISED, self.standard_by_normalised_key, normalised_value),
+            (StandardisationRule.PUNCTUATION_FOLDED, self.standard_by_punctuation_folded_key, folded_key),
+            (StandardisationRule.TOKEN_SORTED, self.standard_by_token_sorted_key, token_sorted_key(normalised_value)),
+        ]
+        for rule, index, key in lookups:
+            standard_ethnicity = index.get(key)
+            if standard_ethnicity is _AMBIGUOUS:
+                return None
+            if standard_ethnicity is not None:
+                return StandardisationMatch(standard_ethnicity, rule)
+
+        return self.__find_within_edit_distance(folded_key)
+
+    def __find_within_edit_distance(self, folded_key):
+        max_distance = _max_edit_distance(folded_key)
+        if not max_distance:
+            return None
+
+        # Each edit changes at most three trigrams, so a close enough key must share all of the rest.
+        trigrams = _trigrams(folded_key)
+        min_shared_trigrams = len(trigrams) - 3 * max_distance
+        shared_trigram_counts = {}
+        for trigram in trigrams:
+            for key in self.keys_by_trigram.get(trigram, ()):
+                shared_trigram_counts[key] = shared_trigram_counts.get(key, 0) + 1
+
+        best_distance, best_standards = None, set()
+        for key, shared_trigrams in shared_trigram_counts.items():
+            if shared_trigrams < min_shared_trigrams:
+                continue
+            distance = _edit_distance_within(folded_key, key, min(max_distance, _max_edit_distance(key)))
+            if distance is None or (best_distance is not None and distance > best_distance):
+                continue
+            if best_distance is None or distance < best_distance:
+                best_distance, best_standards = distance, set()
+            best_standards.add(self.standard_by_punctuation_folded_key[key])
+
+        if len(best_standards) == 1:
+            return StandardisationMatch(best_standards.pop(), StandardisationRule.EDIT_DISTANCE)
+        return None
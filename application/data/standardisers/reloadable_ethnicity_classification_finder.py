@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+import traceback
+
+from application.data.standardisers.ethnicity_classification_finder_builder import (
+    ethnicity_classification_finder_from_file,
+)
+
+
+class ReloadableEthnicityClassificationFinder:
+    """
+    Holds the EthnicityClassificationFinder loaded from the standardiser and classification files, and swaps in a new
+    one whenever those files change, without restarting the app.
+
+    Changes are looked for at most every `check_interval_seconds` (never, if it's 0). A changed library is loaded in a
+    background thread while requests carry on using the current finder, then swapped in with a single assignment, so no
+    request ever sees a partly-loaded finder. If loading fails the current finder is kept.
+
+    Attributes are passed through to the current finder, so this can be used wherever a finder is. Code which reads
+    more than one attribute (e.g. the standardiser and the classification collection) should call `current()` once and
+    use that, so that both come from the same version of the library.
+    """
+
+    def __init__(
+        self,
+        standardiser_file,
+        classification_collection_file,
+        snapshot_dir=None,
+        check_interval_seconds=0,
+        on_reload=None,
+    ):
+        self.standardiser_file = standardiser_file
+        self.classification_collection_file = classification_collection_file
+        self.snapshot_dir = snapshot_dir
+        self.check_interval_seconds = check_interval_seconds
+        self.on_reload = on_reload
+
+        self.version = 1
+        self.__files_signature = self.__get_files_signature()
+        self.__finder = self.__load()
+        self.__next_check_at = time.monotonic() + check_interval_seconds
+        self.__reload_lock = threading.Lock()
+        self.__reloading = False
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.current(), name)
+
+    def current(self):
+        return self.__finder
+
+    def check_for_update_if_due(self):
+        """
+        Calls `check_for_update` if it's been at least `check_interval_seconds` since the last check. This is cheap
+        enough to call before every request.
+        """
+        if not self.check_interval_seconds or time.monotonic() < self.__next_check_at:
+            return None
+
+        self.__next_check_at = time.monotonic() + self.check_interval_seconds
+        return self.check_for_update()
+
+    def check_for_update(self):
+        """
+        Starts loading the library again in a background thread if its files have changed since it was last loaded,
+        unless that's already happening. Returns the thread, if one was started.
+        """
+        files_signature = self.__get_files_signature()
+        if files_signature == self.__files_signature:
+            return None
+
+        with self.__reload_lock:
+            if self.__reloading:
+                return None
+            self.__reloading = True
+
+        reload_thread = threading.Thread(
+            target=self.__reload, args=(files_signature,), name="classification-finder-reload", daemon=True
+        )
+        reload_thread.start()
+        return reload_thread
+
+    def __reload(self, files_signature):
+        try:
+            finder = self.__load()
+            self.__finder = finder
+            self.__files_signature = files_signature
+            self.version += 1
+            print(f"Reloaded classification finder (version {self.version})")
+
+            if self.on_reload:
+                self.on_reload(finder)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.__reloading = False
+
+    def __load(self):
+        return ethnicity_classification_finder_from_file(
+            self.standardiser_file, self.classification_collection_file, snapshot_dir=self.snapshot_dir
+        )
+
+    def __get_files_signature(self):
+        # The signature is taken before the files are read, so that a change made while they're being loaded is picked
+        # up by the next check.
+        signature = []
+        for file_name in (self.standardiser_file, self.classification_collection_file):
+            file_stat = os.stat(file_name)
+            signature.append((file_stat.st_mtime_ns, file_stat.st_size))
+        return tuple(signature)
+
+
+def synchronise_database_on_reload(app):
+    """
+    Returns an `on_reload` callback which updates the classifications in the database to match a reloaded library, as
+    `manage.py synchronise_classifications` does. Every worker reloads the same files at about the same time, so only
+    the first to get the synchronisation lock updates the database, and the rest leave it to that one.
+    """
+
+    def synchronise(finder):
+        from application import db
+        from application.cms.classification_service import classification_service
+        from application.data.ethnicity_classification_synchroniser import EthnicityClassificationSynchroniser
+
+        with app.app_context():
+            try:
+                synchroniser = EthnicityClassificationSynchroniser(classification_service=classification_service)
+                report = synchroniser.synchronise_classifications(
+                    finder.get_classification_collection(), wait_for_lock=False
+                )
+                if report is None:
+                    print("Classifications are already being synchronised by another process")
+                else:
+                    print(f"Synchronised classifications: {report}")
+            finally:
+                db.session.remove()
+
+    return synchronise
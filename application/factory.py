@@ -14,8 +14,9 @@ from raven.contrib.flask import Sentry
 from application import csrf, db, mail
 from application.auth.models import User
 from application.auth.forms import LoginForm
-from application.data.standardisers.ethnicity_classification_finder_builder import (
-    ethnicity_classification_finder_from_file,
+from application.data.standardisers.reloadable_ethnicity_classification_finder import (
+    ReloadableEthnicityClassificationFinder,
+    synchronise_database_on_reload,
 )
 from application.cms.exceptions import InvalidPageHierarchy, PageNotFoundException
 from application.cms.file_service import FileService
@@ -31,12 +32,14 @@ from application.cms.filters import (
     models_to_dicts,
     url_with_line_breaks,
 )
+from application.cms.classification_service import classification_service
 from application.cms.dimension_service import dimension_service
 from application.cms.models import TESTING_SPACE_SLUG
 from application.cms.page_service import page_service
 from application.cms.scanner_service import scanner_service
 from application.cms.upload_service import upload_service
 from application.cms.utils import get_form_errors
+from application.dashboard.summary_tables import keep_dashboard_summaries_up_to_date
 from application.dashboard.trello_service import trello_service
 
 from application.static_site.filters import (
@@ -87,18 +90,28 @@ def create_app(config_object):
     upload_service.init_app(app)
     scanner_service.init_app(app)
     dimension_service.init_app(app)
+    classification_service.init_app(app)
 
     trello_service.init_app(app)
     trello_service.set_credentials(config_object.TRELLO_API_KEY, config_object.TRELLO_API_TOKEN)
 
     db.init_app(app)
+    keep_dashboard_summaries_up_to_date(db.session)
 
     app.url_map.strict_slashes = False
 
-    app.classification_finder = ethnicity_classification_finder_from_file(
+    app.classification_finder = ReloadableEthnicityClassificationFinder(
         config_object.ETHNICITY_CLASSIFICATION_FINDER_LOOKUP,
         config_object.ETHNICITY_CLASSIFICATION_FINDER_CLASSIFICATIONS,
+        snapshot_dir=config_object.ETHNICITY_CLASSIFICATION_FINDER_SNAPSHOT_DIR,
+        check_interval_seconds=config_object.ETHNICITY_CLASSIFICATION_FINDER_RELOAD_SECONDS,
+        on_reload=(
+            synchronise_database_on_reload(app)
+            if config_object.ETHNICITY_CLASSIFICATION_FINDER_SYNCHRONISE_ON_RELOAD
+            else None
+        ),
     )
+    app.before_request(app.classification_finder.check_for_update_if_due)
 
     # Note not using Flask-Security role model
     user_datastore = SQLAlchemyUserDatastore(db, User, None)
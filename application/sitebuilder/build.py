@@ -1,21 +1,36 @@
 #! /usr/bin/env python
 import glob
+import hashlib
+import math
+import multiprocessing
 
 import os
 import shutil
 import subprocess
+from contextlib import closing
 from datetime import datetime
+from functools import partial
 from uuid import uuid4
 
 from flask import current_app, render_template
 from git import Repo
+from sqlalchemy import desc, event, exc
 
+from application import db
+from application.cms.markdown import markdown_renderer
 from application.cms.upload_service import upload_service
-from application.data.dimensions import DimensionObjectBuilder
-from application.utils import get_csv_data_for_download, write_dimension_csv, write_dimension_tabular_csv
+from application.data.dimensions import dimension_csv_cache
+from application.sitebuilder.instrumentation import BuildReport
+from application.sitebuilder.models import Build, BuildStatus
+from application.utils import iter_csv_data_for_download
 
 BUILD_TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S.%f"
 
+# Everything gulp reads when building the versioned front-end assets, relative to the base directory of the app.
+ASSET_SOURCE_PATHS = ["application/src", "gulpfile.js", "package.json", "package-lock.json"]
+ASSET_REV_MANIFESTS = ["javascripts/rev-manifest.json", "stylesheets/rev-manifest.json"]
+ASSET_SOURCES_FINGERPRINT_FILE = ".asset-sources-fingerprint"
+
 
 def make_new_build_dir(application, build=None):
     base_build_dir = application.config["STATIC_BUILD_DIR"]
@@ -32,7 +47,13 @@ def make_new_build_dir(application, build=None):
     return build_dir
 
 
-def do_it(application, build):
+def do_it(application, build, report=None):
+    """
+    Builds the static site and, depending on config, pushes it to git and deploys it to S3. Each stage of the build is
+    recorded in `report`, if one is given.
+    """
+    report = report or BuildReport()
+
     with application.app_context():
         # Build the pages in static mode
         application.config["STATIC_MODE"] = True
@@ -41,33 +62,52 @@ def do_it(application, build):
         build_dir = make_new_build_dir(application, build=build)
 
         if application.config["PUSH_SITE"]:
-            pull_current_site(build_dir, application.config["STATIC_SITE_REMOTE_REPO"])
+            with report.stage("Pull current site", build_dir):
+                pull_current_site(build_dir, application.config["STATIC_SITE_REMOTE_REPO"])
+
+        changed_since = get_incremental_build_cutoff(application, build)
+        if changed_since:
+            from application.cms.page_service import page_service
+
+            measure_ids = page_service.get_measure_ids_changed_since(changed_since)
+            print(f"DEBUG do_it(): Incremental build of {len(measure_ids)} measure(s) changed since {changed_since}...")
+        else:
+            measure_ids = None
+            print("DEBUG do_it(): Deleting files from repo...")
+            delete_files_from_repo(build_dir)
 
-        print("DEBUG do_it(): Deleting files from repo...")
-        delete_files_from_repo(build_dir)
         print("DEBUG do_it(): Creating versioned assets...")
-        create_versioned_assets(build_dir)
+        with report.stage("Create versioned assets", build_dir):
+            create_versioned_assets(build_dir)
 
         local_build = application.config["LOCAL_BUILD"]
 
         print("DEBUG do_it(): Building from homepage...")
-        build_homepage_and_topic_hierarchy(build_dir, config=application.config)
+        with report.stage("Build homepage, topic and measure pages", build_dir):
+            build_homepage_and_topic_hierarchy(build_dir, config=application.config, measure_ids=measure_ids)
+        # Only counts pages rendered in this process, not those written by parallel build workers.
+        print(f"DEBUG do_it(): Markdown cache: {markdown_renderer}")
 
         print("DEBUG do_it(): Building dashboards...")
-        build_dashboards(build_dir)
+        with report.stage("Build dashboards", build_dir):
+            build_dashboards(build_dir)
 
         print("DEBUG do_it(): Building other static pages...")
-        build_other_static_pages(build_dir)
+        with report.stage("Build other static pages", build_dir):
+            build_other_static_pages(build_dir)
 
         print(f"{'Pushing' if application.config['PUSH_SITE'] else 'NOT pushing'} site to git")
         if application.config["PUSH_SITE"]:
-            push_site(build_dir, _stringify_timestamp(build.created_at))
+            with report.stage("Push site to git"):
+                push_site(build_dir, _stringify_timestamp(build.created_at))
 
         print(f"{'Deploying' if application.config['DEPLOY_SITE'] else 'NOT deploying'} site to S3")
         if application.config["DEPLOY_SITE"]:
             from application.sitebuilder.build_service import s3_deployer
 
-            s3_deployer(application, build_dir)
+            with report.stage("Deploy site to S3"):
+                # An incremental build's directory may only hold the pages it has changed, so nothing can be deleted.
+                s3_deployer(application, build_dir, delete_removed=changed_since is None)
             print("Static site deployed")
 
         if not local_build:
@@ -75,6 +115,26 @@ def do_it(application, build):
             clear_up(build_dir)
 
 
+def get_incremental_build_cutoff(application, build):
+    """
+    Returns the time from which an incremental build needs to pick up changes, or None if a full build is needed.
+
+    This is the creation time, rather than `succeeded_at`, of the last successful build. A build renders the database
+    as it stands some time after the build was requested, so anything changed before then is definitely in its output
+    but changes made while it was running might not be.
+    """
+    if not application.config["INCREMENTAL_BUILD"] or build is None or build.full_rebuild:
+        return None
+
+    last_successful_build = (
+        Build.query.filter(Build.status == BuildStatus.DONE, Build.succeeded_at.isnot(None))
+        .order_by(desc(Build.succeeded_at))
+        .first()
+    )
+
+    return last_successful_build.created_at if last_successful_build else None
+
+
 def build_and_upload_error_pages(application):
     """
     We build and upload these separately from the main site build as they go into a separate bucket and need some
@@ -93,41 +153,53 @@ def build_and_upload_error_pages(application):
 
         print("Deploy site (error pages) to S3: ", application.config["DEPLOY_SITE"])
         if application.config["DEPLOY_SITE"]:
-            from application.sitebuilder.build_service import _upload_dir_to_s3
-            from application.cms.file_service import S3FileSystem
+            from application.sitebuilder.deployer import S3Deployer
 
-            s3 = S3FileSystem(
-                application.config["S3_STATIC_SITE_ERROR_PAGES_BUCKET"], region=application.config["S3_REGION"]
+            deployer = S3Deployer(
+                application.config["S3_STATIC_SITE_ERROR_PAGES_BUCKET"],
+                region=application.config["S3_REGION"],
+                max_workers=application.config["DEPLOY_THREADS"],
+                manifest_bucket_name=application.config["S3_UPLOAD_BUCKET_NAME"],
             )
 
-            _upload_dir_to_s3(build_dir, s3)
+            report = deployer.deploy(build_dir, delete_removed=False)
+            print(f"Deployed error pages to S3: {report}")
 
         if not local_build:
             clear_up(build_dir)
 
 
-def build_homepage_and_topic_hierarchy(build_dir, config):
+def build_homepage_and_topic_hierarchy(build_dir, config, measure_ids=None):
+    """
+    Builds the homepage, topic pages and measure pages. If `measure_ids` is given, only the pages of those measures are
+    (re-)written; the homepage and topic pages are always written as they list every publishable measure.
+    """
 
     os.makedirs(build_dir, exist_ok=True)
     from application.cms.page_service import page_service
 
-    topics = page_service.get_topics(include_testing_space=False)
+    topics = page_service.get_publishable_site_graph()
     content = render_template("static_site/index.html", topics=topics)
 
     file_path = os.path.join(build_dir, "index.html")
     write_html(file_path, content)
 
+    measures = []
     for topic in topics:
-        write_topic_html(topic, build_dir, config)
+        measures.extend(write_topic_html(topic, build_dir, config))
+
+    if measure_ids is not None:
+        measures = [measure for measure in measures if measure.id in measure_ids]
+
+    write_measure_pages(measures, build_dir, config)
 
 
 def write_topic_html(topic, build_dir, config):
+    """Writes the topic page and returns the publishable measures listed on it."""
 
     slug = os.path.join(build_dir, topic.slug)
     os.makedirs(slug, exist_ok=True)
 
-    local_build = config["LOCAL_BUILD"]
-
     measures_by_subtopic = {}
     subtopics = []
 
@@ -146,11 +218,88 @@ def write_topic_html(topic, build_dir, config):
     file_path = os.path.join(slug, "index.html")
     write_html(file_path, content)
 
-    for measures in measures_by_subtopic.values():
+    return [measure for measures in measures_by_subtopic.values() for measure in measures]
+
+
+def write_measure_pages(measures, build_dir, config):
+    local_build = config["LOCAL_BUILD"]
+    processes = config["BUILD_PROCESSES"]
+
+    if processes > 1 and len(measures) > 1:
+        write_measure_pages_in_parallel([measure.id for measure in measures], build_dir, processes, local_build)
+    else:
         for measure in measures:
             write_measure_versions(measure, build_dir, local_build=local_build)
 
 
+def write_measure_pages_in_parallel(measure_ids, build_dir, processes, local_build=False):
+    """
+    Writes the pages for each measure from a pool of forked worker processes, each of which renders inside its own app
+    context with its own database session. Each worker is given a chunk of measures at a time, and loads the whole
+    graph below them in a fixed handful of queries, as the single-process build does. Every measure writes to its own
+    directory, so the output doesn't depend on which worker renders which measure, or in what order.
+
+    This must be called from within an app context.
+    """
+    application = current_app._get_current_object()
+
+    # The session's connection goes back to the pool, which the workers inherit. They never use the pooled connections
+    # (see `_init_build_worker`), so the parent can carry on using them, e.g. to renew the build's lease.
+    db.session.remove()
+
+    measure_ids = sorted(measure_ids)
+    # Several chunks per process, so that a chunk of slow measures doesn't hold up the whole build.
+    chunk_size = max(1, math.ceil(len(measure_ids) / (processes * MEASURE_CHUNKS_PER_BUILD_PROCESS)))
+    measure_id_chunks = [measure_ids[i : i + chunk_size] for i in range(0, len(measure_ids), chunk_size)]
+
+    write_measures = partial(_write_measure_versions_in_worker, build_dir=build_dir, local_build=local_build)
+    with multiprocessing.get_context("fork").Pool(
+        processes, initializer=_init_build_worker, initargs=(application,)
+    ) as pool:
+        pool.map(write_measures, measure_id_chunks)
+
+
+MEASURE_CHUNKS_PER_BUILD_PROCESS = 4
+
+_build_worker_application = None
+
+
+def _init_build_worker(application):
+    global _build_worker_application
+    _build_worker_application = application
+
+    with application.app_context():
+        engine = db.engine
+    event.listen(engine, "connect", _note_connection_pid)
+    event.listen(engine, "checkout", _discard_connection_from_another_process)
+
+
+def _note_connection_pid(dbapi_connection, connection_record):
+    connection_record.info["pid"] = os.getpid()
+
+
+def _discard_connection_from_another_process(dbapi_connection, connection_record, connection_proxy):
+    """
+    Stops a worker using a pooled connection inherited from the parent, which the parent may be using at the same
+    time. The connection is dropped rather than closed, as closing it would end the parent's session as well, and the
+    pool connects again.
+    """
+    if connection_record.info.get("pid") != os.getpid():
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            "Connection record belongs to pid %s, attempting to check out in pid %s"
+            % (connection_record.info.get("pid"), os.getpid())
+        )
+
+
+def _write_measure_versions_in_worker(measure_ids, build_dir, local_build):
+    from application.cms.page_service import page_service
+
+    with _build_worker_application.app_context():
+        for measure in page_service.get_publishable_measures(measure_ids):
+            write_measure_versions(measure, build_dir, local_build=local_build)
+
+
 def write_measure_versions(measure, build_dir, local_build=False):
 
     for measure_version in measure.versions_to_publish:
@@ -202,11 +351,10 @@ def write_measure_version_downloads(measure_version, slug):
 
     for d in measure_version.uploads:
         try:
-            filename = upload_service.get_measure_download(d, d.file_name, "source")
-            content = get_csv_data_for_download(filename)
             file_path = os.path.join(download_dir, d.file_name)
-            with open(file_path, "w", encoding="windows-1252") as download_file:
-                download_file.write(content)
+            with closing(upload_service.open_measure_download(d, d.file_name, "source")) as download:
+                with open(file_path, "w", encoding="windows-1252") as download_file:
+                    download_file.writelines(iter_csv_data_for_download(download))
         except Exception as e:
             message = "Error writing download for file %s" % d.file_name
             print(message)
@@ -218,6 +366,7 @@ def process_dimensions(measure_version, slug):
         download_dir = os.path.join(slug, "downloads")
         os.makedirs(download_dir, exist_ok=True)
 
+    csv_cache = dimension_csv_cache()
     for dimension in measure_version.dimensions:
 
         if (
@@ -228,8 +377,7 @@ def process_dimensions(measure_version, slug):
             chart_dir = "%s/charts" % slug
             os.makedirs(chart_dir, exist_ok=True)
 
-        dimension_obj = DimensionObjectBuilder.build(dimension)
-        output = write_dimension_csv(dimension=dimension_obj)
+        output = csv_cache.get_csv(dimension)
 
         try:
             file_path = os.path.join(download_dir, dimension.static_file_name)
@@ -241,7 +389,7 @@ def process_dimensions(measure_version, slug):
             print(e)
 
         if dimension.dimension_table and dimension.dimension_table.table_object:
-            table_output = write_dimension_tabular_csv(dimension=dimension_obj)
+            table_output = csv_cache.get_tabular_csv(dimension)
 
             table_file_path = os.path.join(download_dir, dimension.static_table_file_name)
             with open(table_file_path, "w") as dimension_file:
@@ -254,13 +402,14 @@ def build_dashboards(build_dir):
         get_published_dashboard_data,
         get_planned_pages_dashboard_data,
         get_ethnic_groups_dashboard_data,
-        get_ethnic_group_by_slug_dashboard_data,
+        get_all_ethnic_group_dashboard_data,
         get_ethnicity_classifications_dashboard_data,
-        get_ethnicity_classification_by_id_dashboard_data,
+        get_all_ethnicity_classification_dashboard_data,
         get_geographic_breakdown_dashboard_data,
-        get_geographic_breakdown_by_slug_dashboard_data,
+        get_all_geographic_breakdown_dashboard_data,
         get_published_measures_by_years_and_months,
     )
+    from application.dashboard.models import ClassificationByDimension, EthnicGroupByDimension
 
     dashboards_dir = os.path.join(build_dir, "dashboards")
     directories = [
@@ -289,8 +438,7 @@ def build_dashboards(build_dir):
     file_path = os.path.join(dashboards_dir, "whats-new/index.html")
     write_html(file_path, content)
 
-    # Published measures dashboard
-    data = get_published_dashboard_data()
+    # Published measures dashboard, from the same data as the new and updated pages
     content = render_template("dashboards/publications.html", data=data)
     file_path = os.path.join(dashboards_dir, "published/index.html")
     write_html(file_path, content)
@@ -308,18 +456,20 @@ def build_dashboards(build_dir):
     write_html(file_path, content)
 
     # Ethnic groups top-level dashboard
-    sorted_ethnicity_list = get_ethnic_groups_dashboard_data()
+    ethnic_group_links = EthnicGroupByDimension.query.all()
+    sorted_ethnicity_list = get_ethnic_groups_dashboard_data(ethnic_group_links)
     content = render_template("dashboards/ethnic_groups.html", ethnic_groups=sorted_ethnicity_list)
     file_path = os.path.join(dashboards_dir, "ethnic-groups/index.html")
     write_html(file_path, content)
 
-    # Individual ethnic group dashboards
+    # Individual ethnic group dashboards, all from the same links
+    ethnic_group_dashboard_data = get_all_ethnic_group_dashboard_data(ethnic_group_links)
     for ethnicity in sorted_ethnicity_list:
         slug = ethnicity["url"][ethnicity["url"].rindex("/") + 1 :]  # The part of the url after the final /
-        value_title, page_count, nested_measures_and_dimensions = get_ethnic_group_by_slug_dashboard_data(slug)
+        page_count, nested_measures_and_dimensions = ethnic_group_dashboard_data[ethnicity["value"]]
         content = render_template(
             "dashboards/ethnic_group.html",
-            ethnic_group=value_title,
+            ethnic_group=ethnicity["value"],
             measure_count=page_count,
             nested_measures_and_dimensions=nested_measures_and_dimensions,
         )
@@ -328,23 +478,19 @@ def build_dashboards(build_dir):
         write_html(os.path.join(dir_path, "index.html"), content)
 
     # Ethnicity classifications top-level dashboard
-    classifications = get_ethnicity_classifications_dashboard_data()
+    classification_links = ClassificationByDimension.query.all()
+    classifications = get_ethnicity_classifications_dashboard_data(classification_links)
     content = render_template("dashboards/ethnicity_classifications.html", ethnicity_classifications=classifications)
     file_path = os.path.join(dashboards_dir, "ethnicity-classifications/index.html")
     write_html(file_path, content)
 
-    # Individual ethnicity classifications dashboards
+    # Individual ethnicity classifications dashboards, all from the same links
+    classification_dashboard_data = get_all_ethnicity_classification_dashboard_data(classification_links)
     for classification in classifications:
-        (
-            classification_title,
-            page_count,
-            nested_measures_and_dimensions,
-        ) = get_ethnicity_classification_by_id_dashboard_data(  # noqa
-            classification["id"]
-        )
+        page_count, nested_measures_and_dimensions = classification_dashboard_data[classification["id"]]
         content = render_template(
             "dashboards/ethnicity_classification.html",
-            classification_title=classification_title,
+            classification_title=classification["title"],
             page_count=page_count,
             nested_measures_and_dimensions=nested_measures_and_dimensions,
         )
@@ -359,18 +505,15 @@ def build_dashboards(build_dir):
     write_html(file_path, content)
 
     # Individual geographic area dashboards
+    geographic_breakdown_dashboard_data = get_all_geographic_breakdown_dashboard_data()
     for loc_level in location_levels:
         slug = loc_level["url"][loc_level["url"].rindex("/") + 1 :]  # The part of the url after the final /
-        (
-            geography,
-            page_count,
-            measure_titles_and_urls_by_topic_and_subtopic,
-        ) = get_geographic_breakdown_by_slug_dashboard_data(  # noqa
-            slug
-        )
+        page_count, measure_titles_and_urls_by_topic_and_subtopic = geographic_breakdown_dashboard_data[
+            loc_level["name"]
+        ]
         content = render_template(
             "dashboards/lowest-level-of-geography.html",
-            level_of_geography=geography.name,
+            level_of_geography=loc_level["name"],
             page_count=page_count,
             measure_titles_and_urls_by_topic_and_subtopic=measure_titles_and_urls_by_topic_and_subtopic,
         )
@@ -474,11 +617,110 @@ def clear_up(build_dir):
 
 
 def create_versioned_assets(build_dir):
-    subprocess.run(["npx", "gulp", "make"])
-    static_dir = os.path.join(build_dir, get_static_dir())
-    if os.path.exists(static_dir):
-        shutil.rmtree(static_dir)
-    shutil.copytree(current_app.static_folder, static_dir)
+    """
+    Compiles the front-end assets with gulp and copies them into the build directory. Gulp is skipped if none of the
+    asset sources have changed since it last ran successfully, and only asset files which differ from those already in
+    the build directory (e.g. from the pulled site) are copied.
+    """
+    static_folder = current_app.static_folder
+    fingerprint = get_asset_sources_fingerprint(current_app.config["BASE_DIRECTORY"])
+
+    if _get_built_assets_fingerprint(static_folder) == fingerprint:
+        print("DEBUG create_versioned_assets(): Asset sources unchanged; reusing previously built assets")
+    else:
+        result = subprocess.run(["npx", "gulp", "make"])
+        if result.returncode == 0:
+            with open(os.path.join(static_folder, ASSET_SOURCES_FINGERPRINT_FILE), "w") as fingerprint_file:
+                fingerprint_file.write(fingerprint)
+
+    sync_directory(static_folder, os.path.join(build_dir, get_static_dir()), exclude={ASSET_SOURCES_FINGERPRINT_FILE})
+
+
+def get_asset_sources_fingerprint(base_directory):
+    """Returns a hash of every file gulp builds the front-end assets from, along with the settings it builds with."""
+    fingerprint = hashlib.sha256()
+    fingerprint.update(f"DISABLE_UGLIFY={os.environ.get('DISABLE_UGLIFY', '')}".encode("utf-8"))
+
+    for source_path in ASSET_SOURCE_PATHS:
+        full_path = os.path.join(base_directory, source_path)
+        if os.path.isdir(full_path):
+            file_paths = sorted(
+                os.path.join(root, file_name)
+                for root, dirs, file_names in os.walk(full_path)
+                for file_name in file_names
+            )
+        else:
+            file_paths = [full_path]
+
+        for file_path in file_paths:
+            fingerprint.update(os.path.relpath(file_path, base_directory).encode("utf-8"))
+            try:
+                with open(file_path, "rb") as source_file:
+                    fingerprint.update(hashlib.sha256(source_file.read()).digest())
+            except FileNotFoundError:
+                fingerprint.update(b"missing")
+
+    return fingerprint.hexdigest()
+
+
+def _get_built_assets_fingerprint(static_folder):
+    # The assets can't be reused if gulp's output has been partly removed, e.g. by a fresh checkout.
+    if not all(os.path.exists(os.path.join(static_folder, manifest)) for manifest in ASSET_REV_MANIFESTS):
+        return None
+
+    try:
+        with open(os.path.join(static_folder, ASSET_SOURCES_FINGERPRINT_FILE)) as fingerprint_file:
+            return fingerprint_file.read()
+    except FileNotFoundError:
+        return None
+
+
+def sync_directory(source_dir, destination_dir, exclude=frozenset()):
+    """
+    Makes `destination_dir` a copy of `source_dir`. Files which are already there with the same size and modification
+    time are left alone; others are hard-linked where possible, and copied otherwise. Files that aren't in `source_dir`
+    are removed.
+    """
+    source_paths = set()
+
+    for root, dirs, file_names in os.walk(source_dir):
+        relative_root = os.path.relpath(root, source_dir)
+        os.makedirs(os.path.join(destination_dir, relative_root), exist_ok=True)
+
+        for file_name in file_names:
+            relative_path = os.path.normpath(os.path.join(relative_root, file_name))
+            if relative_path in exclude:
+                continue
+            source_paths.add(relative_path)
+
+            _sync_file(os.path.join(source_dir, relative_path), os.path.join(destination_dir, relative_path))
+
+    for root, dirs, file_names in os.walk(destination_dir):
+        for file_name in file_names:
+            destination_path = os.path.join(root, file_name)
+            if os.path.relpath(destination_path, destination_dir) not in source_paths:
+                os.remove(destination_path)
+
+
+def _sync_file(source_path, destination_path):
+    if _same_size_and_modification_time(source_path, destination_path):
+        return
+
+    if os.path.lexists(destination_path):
+        os.remove(destination_path)
+    try:
+        os.link(source_path, destination_path)
+    except OSError:
+        shutil.copy2(source_path, destination_path)
+
+
+def _same_size_and_modification_time(source_path, destination_path):
+    try:
+        source_stat, destination_stat = os.stat(source_path), os.stat(destination_path)
+    except FileNotFoundError:
+        return False
+
+    return source_stat.st_size == destination_stat.st_size and source_stat.st_mtime == destination_stat.st_mtime
 
 
 def write_html(file_path, content):
@@ -1,24 +1,41 @@
 import atexit
 
+import select
+import threading
+import time
 import traceback
 import uuid
 from contextlib import contextmanager
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import shutil
 
 import os
-from sqlalchemy import desc
+from sqlalchemy import and_, desc, func, or_, select as sql_select
 from sqlalchemy.orm import sessionmaker
 
 from application import db
-from application.cms.file_service import S3FileSystem
 from application.sitebuilder.models import Build, BuildStatus
 from application.sitebuilder.build import do_it, get_static_dir
+from application.sitebuilder.deployer import S3Deployer
+from application.sitebuilder.instrumentation import BuildReport
 
-YEAR_IN_SECONDS = 60 * 60 * 24 * 365
-HOUR_IN_SECONDS = 60 * 60
-FIFTEEN_MINUTES_IN_SECONDS = 60 * 15
+# `request_build` notifies this channel, so that a build worker can start building within seconds rather than waiting
+# to be polled.
+BUILD_REQUESTED_CHANNEL = "build_requested"
+
+# Claims are serialised on this advisory lock, so that two workers can't both decide that no build is running.
+BUILD_CLAIM_LOCK_ID = 0x6275696C64
+
+DEFAULT_BUILD_LEASE_SECONDS = 5 * 60
+
+# A build whose lease has run out this many times is assumed to be killing its worker, rather than being unlucky.
+MAX_BUILD_ATTEMPTS = 3
+
+# However busy publishing is, a worker won't put off starting a build for longer than this many coalescing periods.
+MAX_COALESCE_PERIODS = 4
+
+_stacktrace_printed_at_exit = False
 
 
 class BuildException(Exception):
@@ -26,104 +43,254 @@ class BuildException(Exception):
         self.original_exception = original_exception
 
 
-def request_build():
+def request_build(full_rebuild=False):
     build = Build()
     build.id = str(uuid.uuid4())
+    build.full_rebuild = full_rebuild
     db.session.add(build)
+    # Postgres only delivers the notification when this transaction commits, so workers never wake before they can see
+    # the new build.
+    db.session.execute(f"NOTIFY {BUILD_REQUESTED_CHANNEL}")
     db.session.commit()
     return build
 
 
-def _any_build_has_been_started(session):
-    started_builds = session.query(Build).filter(Build.status == BuildStatus.STARTED).all()
+def _any_build_holds_a_lease(session, now):
+    leased_builds = session.query(Build).filter(
+        Build.status == BuildStatus.STARTED, or_(Build.lease_expires_at.is_(None), Build.lease_expires_at >= now)
+    )
+
+    return session.query(leased_builds.exists()).scalar()
+
+
+def _fail_builds_out_of_attempts(builds, now):
+    claimable_builds = []
+    for build in builds:
+        if build.status == BuildStatus.STARTED and build.attempts >= MAX_BUILD_ATTEMPTS:
+            build.status = BuildStatus.FAILED
+            build.failed_at = now
+            build.failure_reason = f"Build lease expired {build.attempts} times; giving up on this build"
+        else:
+            claimable_builds.append(build)
+
+    return claimable_builds
+
 
-    return True if started_builds else False
+def _retrieve_and_start_latest_pending_build(session, lease_seconds=DEFAULT_BUILD_LEASE_SECONDS):
+    """
+    Claims the most recently requested build, superseding every other build waiting to run, and takes out a lease on
+    it. Builds whose lease has expired (because the worker running them died) are claimable again, the same as pending
+    builds. Returns None if there's nothing to build, or if another worker holds a lease on a build.
+    """
+    now = datetime.utcnow()
+    if not session.execute(sql_select([func.pg_try_advisory_xact_lock(BUILD_CLAIM_LOCK_ID)])).scalar():
+        session.rollback()
+        return None
 
+    if _any_build_holds_a_lease(session, now):
+        session.rollback()
+        return None
 
-def _retrieve_and_start_latest_pending_build(session):
     builds = (
         session.query(Build)
-        .filter(Build.status == BuildStatus.PENDING)
+        .filter(
+            or_(
+                Build.status == BuildStatus.PENDING,
+                and_(Build.status == BuildStatus.STARTED, Build.lease_expires_at < now),
+            )
+        )
         .order_by(desc(Build.created_at))
-        .with_for_update()
+        .with_for_update(skip_locked=True)
         .all()
     )
+    builds = _fail_builds_out_of_attempts(builds, now)
 
     if not builds:
+        session.commit()
         return None
 
     target_build = builds[0]
     target_build.status = BuildStatus.STARTED
+    target_build.lease_expires_at = now + timedelta(seconds=lease_seconds)
+    target_build.attempts += 1
     session.add(target_build)
 
     superseded_builds = builds[1:]
     for superseded_build in superseded_builds:
         superseded_build.status = BuildStatus.SUPERSEDED
+        superseded_build.lease_expires_at = None
         session.add(superseded_build)
 
+        # The target build has to cover everything the builds it supersedes were asked to do.
+        if superseded_build.full_rebuild:
+            target_build.full_rebuild = True
+
     session.commit()
 
     return target_build
 
 
+class BuildLeaseHeartbeat:
+    """
+    Keeps extending the lease on a running build from a background thread, on its own database connection, until the
+    block it's used in exits.
+    """
+
+    def __init__(self, build, lease_seconds):
+        self.build_id = build.id
+        self.build_created_at = build.created_at
+        self.lease_seconds = lease_seconds
+        self.engine = db.engine
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._renew_until_stopped, name="build-lease-heartbeat", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stopped.set()
+        self._thread.join()
+
+    def renew(self):
+        with self.engine.begin() as connection:
+            connection.execute(
+                Build.__table__.update()
+                .where(
+                    and_(
+                        Build.id == self.build_id,
+                        Build.created_at == self.build_created_at,
+                        Build.status == BuildStatus.STARTED,
+                    )
+                )
+                .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=self.lease_seconds))
+            )
+
+    def _renew_until_stopped(self):
+        while not self._stopped.wait(self.lease_seconds / 3):
+            try:
+                self.renew()
+            except Exception:
+                # Missing one renewal isn't fatal; the lease only lapses if the next two fail as well.
+                traceback.print_exc()
+
+
+def _print_stacktrace():
+    traceback.print_stack()
+
+
+def _print_stacktrace_at_exit():
+    """Registers the exit handler which prints a stacktrace, once per process however many builds it runs."""
+    global _stacktrace_printed_at_exit
+
+    if not _stacktrace_printed_at_exit:
+        atexit.register(_print_stacktrace)
+        _stacktrace_printed_at_exit = True
+
+
 def build_site(app):
-    def print_stacktrace():
-        traceback.print_stack()
+    """
+    Runs the latest requested build, if there is one and no other build is running. Returns True if a build was run.
+    """
+
+    _print_stacktrace_at_exit()
 
-    atexit.register(print_stacktrace)
+    lease_seconds = app.config.get("BUILD_LEASE_SECONDS", DEFAULT_BUILD_LEASE_SECONDS)
 
     Session = sessionmaker(db.engine)
     with make_session_scope(Session) as session:
-        if _any_build_has_been_started(session):
-            print("An existing build is in progress; will not start a concurrent build")
-            return
-
-        build = _retrieve_and_start_latest_pending_build(session)
+        build = _retrieve_and_start_latest_pending_build(session, lease_seconds)
         if not build:
-            print("No pending builds at", datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"))
-            return
+            print(
+                "No pending builds, or a build is already in progress, at",
+                datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+            )
+            return False
 
         print("DEBUG _build_site(): Starting build...")
-        _start_build(app, build, session)
+        _start_build(app, build, session, lease_seconds)
         print("DEBUG _build_site(): Finished build.")
+        return True
 
 
-def s3_deployer(app, build_dir):
-    _delete_files_not_needed_for_deploy(build_dir)
+def run_build_worker(app, max_builds=None):
+    """
+    Builds the site whenever a build is requested, for `max_builds` builds or forever.
 
-    site_bucket_name = app.config["S3_STATIC_SITE_BUCKET"]
-    s3 = S3FileSystem(site_bucket_name, region=app.config["S3_REGION"])
+    The worker LISTENs for the notification sent by `request_build`, then waits for publishing to go quiet for
+    BUILD_COALESCE_SECONDS so that a burst of requests is covered by a single build. It also wakes every
+    BUILD_POLL_SECONDS without being notified, to pick up builds whose lease has expired.
+    """
+    poll_seconds = app.config["BUILD_POLL_SECONDS"]
+    coalesce_seconds = app.config["BUILD_COALESCE_SECONDS"]
 
-    # Ensure static assets (css, JavaScripts, etc) are uploaded before the rest of the site
-    _upload_dir_to_s3(build_dir, s3, specific_subdirectory=get_static_dir())
+    # The listening connection is kept out of the pool: it's in autocommit mode and has to stay open between builds.
+    pooled_connection = db.engine.raw_connection()
+    pooled_connection.detach()
+    connection = pooled_connection.connection
+    connection.autocommit = True
 
-    # Upload the whole site now the updated static assets are in place
-    _upload_dir_to_s3(build_dir, s3)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {BUILD_REQUESTED_CHANNEL}")
+
+        builds_run = 0
+        while True:
+            try:
+                if build_site(app):
+                    builds_run += 1
+            except Exception:
+                # The build has already been marked as failed; keep the worker going for the next one.
+                builds_run += 1
+                traceback.print_exc()
+                if "sentry" in app.extensions:
+                    app.extensions["sentry"].captureException()
+
+            if max_builds is not None and builds_run >= max_builds:
+                return
+
+            _wait_for_build_request(connection, poll_seconds, coalesce_seconds)
+    finally:
+        pooled_connection.close()
 
 
-def _upload_dir_to_s3(source_dir, s3, specific_subdirectory=None):
-    target_dir = os.path.join(source_dir, specific_subdirectory) if specific_subdirectory else source_dir
+def _wait_for_build_request(connection, poll_seconds, coalesce_seconds):
+    if not _wait_for_notifications(connection, poll_seconds):
+        return
 
-    for root, dirs, files in os.walk(target_dir):
-        for file_ in files:
-            file_path = os.path.join(root, file_)
+    give_up_coalescing_at = time.monotonic() + coalesce_seconds * MAX_COALESCE_PERIODS
+    while time.monotonic() < give_up_coalescing_at:
+        if not _wait_for_notifications(connection, min(coalesce_seconds, give_up_coalescing_at - time.monotonic())):
+            return
 
-            # this is temp hack to work around that static site on s3 not
-            # actually enabled for hosting static site and therefore
-            # index files in sub directories do not work.
-            # therefore use directory name as bucket key and index file contents
-            # as bucket content
-            bucket_key = file_path.replace(source_dir + os.path.sep, "")
-            bucket_key = bucket_key.replace("/index.html", "")
 
-            print("Uploading: " + bucket_key)
+def _wait_for_notifications(connection, timeout_seconds):
+    connection.poll()
+    if not connection.notifies:
+        select.select([connection], [], [], max(timeout_seconds, 0))
+        connection.poll()
 
-            if _is_versioned_asset(file_):
-                s3.write(file_path, bucket_key, max_age_seconds=YEAR_IN_SECONDS, strict=False)
-            elif _measure_related(file_):
-                s3.write(file_path, bucket_key, max_age_seconds=FIFTEEN_MINUTES_IN_SECONDS, strict=False)
-            else:
-                s3.write(file_path, bucket_key, max_age_seconds=HOUR_IN_SECONDS, strict=False)
+    received_notification = bool(connection.notifies)
+    del connection.notifies[:]
+
+    return received_notification
+
+
+def s3_deployer(app, build_dir, delete_removed=True):
+    _delete_files_not_needed_for_deploy(build_dir)
+
+    deployer = S3Deployer(
+        app.config["S3_STATIC_SITE_BUCKET"],
+        region=app.config["S3_REGION"],
+        max_workers=app.config["DEPLOY_THREADS"],
+        manifest_bucket_name=app.config["S3_UPLOAD_BUCKET_NAME"],
+    )
+
+    # Ensure static assets (css, JavaScripts, etc) are uploaded before the rest of the site
+    report = deployer.deploy(build_dir, delete_removed=delete_removed, uploads_first_subdirectory=get_static_dir())
+    print(f"Deployed site to S3: {report}")
+
+    return report
 
 
 def _delete_files_not_needed_for_deploy(build_dir):
@@ -136,16 +303,14 @@ def _delete_files_not_needed_for_deploy(build_dir):
             os.remove(path)
 
 
-def _start_build(app, build, session):
+def _start_build(app, build, session, lease_seconds=DEFAULT_BUILD_LEASE_SECONDS):
     build_exception = None
+    report = BuildReport()
     try:
-        print("DEBUG _start_build(): Refreshing materialized views...")
-        from manage import refresh_materialized_views
-
-        refresh_materialized_views()
-        print("DEBUG _start_build(): Doing it...")
-        do_it(app, build)
-        print("DEBUG _start_build(): Done it!")
+        with BuildLeaseHeartbeat(build, lease_seconds):
+            print("DEBUG _start_build(): Doing it...")
+            do_it(app, build, report)
+            print("DEBUG _start_build(): Done it!")
 
         build.status = BuildStatus.DONE
         build.succeeded_at = datetime.utcnow()
@@ -162,24 +327,13 @@ def _start_build(app, build, session):
     finally:
         print("DEBUG _start_build(): Adding build to session...")
 
+        build.stages = report.stages
+        build.lease_expires_at = None
         session.add(build)
         if build_exception:
             raise BuildException(build_exception)
 
 
-def _is_versioned_asset(file):
-    import re
-
-    match = re.search(r"(application|all|charts)-(\w+).(css|js)$", file)
-    if match:
-        return match.group(1) in ["application", "all", "charts"]
-    return False
-
-
-def _measure_related(file):
-    return file.split(".")[-1] in ["html", "json", "csv"]
-
-
 @contextmanager
 def make_session_scope(Session):
     session = Session()
@@ -0,0 +1,226 @@
+import hashlib
+import json
+import mimetypes
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import boto3
+from botocore.exceptions import ClientError
+
+YEAR_IN_SECONDS = 60 * 60 * 24 * 365
+HOUR_IN_SECONDS = 60 * 60
+FIFTEEN_MINUTES_IN_SECONDS = 60 * 15
+
+# Records a fingerprint of every object uploaded by the last deploy, so that the next one can skip unchanged files and
+# remove files which are no longer part of the site. It's kept in a private bucket when one is given, as anything in the
+# site bucket is served as part of the site.
+DEPLOY_MANIFEST_KEY = "deploy-manifest.json"
+DEPLOY_MANIFESTS_PREFIX = "deploy-manifests"
+
+# S3 accepts at most this many keys in a single DeleteObjects request.
+MAX_KEYS_PER_DELETE = 1000
+
+
+@dataclass
+class DeployFile:
+    path: str
+    key: str
+    content_type: str
+    max_age_seconds: int
+    size: int
+    fingerprint: str
+
+
+@dataclass
+class DeployReport:
+    keys_uploaded: int = 0
+    bytes_uploaded: int = 0
+    keys_unchanged: int = 0
+    keys_deleted: int = 0
+
+    def __str__(self):
+        return (
+            f"{self.keys_uploaded} files uploaded ({self.bytes_uploaded} bytes), "
+            f"{self.keys_unchanged} unchanged, {self.keys_deleted} deleted"
+        )
+
+
+class S3Deployer:
+    """
+    Deploys a built site to an S3 bucket, uploading only the files whose content or headers have changed since the last
+    deploy and, optionally, deleting the objects for files which have disappeared from the site.
+
+    Uploads go through a bounded thread pool sharing a single boto3 client (clients are thread-safe, unlike resources).
+
+    The deploy manifest is written to `manifest_bucket_name` (which should be private), under a key named after the site
+    bucket, or to the site bucket itself if that isn't given. Either way it's written with a private ACL.
+    """
+
+    def __init__(self, bucket_name, region, max_workers=16, client=None, manifest_bucket_name=None):
+        self.bucket_name = bucket_name
+        self.max_workers = max_workers
+        self.client = client or boto3.client("s3", region_name=region)
+
+        if manifest_bucket_name:
+            self.manifest_bucket_name = manifest_bucket_name
+            self.manifest_key = f"{DEPLOY_MANIFESTS_PREFIX}/{bucket_name}.json"
+        else:
+            self.manifest_bucket_name = bucket_name
+            self.manifest_key = DEPLOY_MANIFEST_KEY
+
+    def deploy(self, source_dir, delete_removed=True, uploads_first_subdirectory=None):
+        """
+        `delete_removed` should only be set when `source_dir` holds the whole site, rather than just the pages
+        changed by an incremental build. Files under `uploads_first_subdirectory` (e.g. versioned css/js) are
+        uploaded before any others, so that pages never reference assets which aren't there yet.
+        """
+        report = DeployReport()
+        previous_manifest = self._read_manifest()
+        files = _collect_files(source_dir)
+
+        changed_files = []
+        for deploy_file in files.values():
+            if previous_manifest.get(deploy_file.key) == deploy_file.fingerprint:
+                report.keys_unchanged += 1
+            else:
+                changed_files.append(deploy_file)
+
+        if uploads_first_subdirectory:
+            prefix = uploads_first_subdirectory.rstrip("/") + "/"
+            self._upload([deploy_file for deploy_file in changed_files if deploy_file.key.startswith(prefix)], report)
+            self._upload(
+                [deploy_file for deploy_file in changed_files if not deploy_file.key.startswith(prefix)], report
+            )
+        else:
+            self._upload(changed_files, report)
+
+        if delete_removed:
+            removed_keys = sorted(set(previous_manifest) - set(files))
+            self._delete(removed_keys, report)
+            manifest = {}
+        else:
+            manifest = dict(previous_manifest)
+
+        manifest.update({key: deploy_file.fingerprint for key, deploy_file in files.items()})
+        self._write_manifest(manifest)
+
+        return report
+
+    def _upload(self, deploy_files, report):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for deploy_file in pool.map(self._upload_file, deploy_files):
+                report.keys_uploaded += 1
+                report.bytes_uploaded += deploy_file.size
+
+    def _upload_file(self, deploy_file):
+        print("Uploading: " + deploy_file.key)
+
+        with open(deploy_file.path, "rb") as file:
+            self.client.put_object(
+                Bucket=self.bucket_name,
+                Key=deploy_file.key,
+                Body=file,
+                ContentType=deploy_file.content_type,
+                CacheControl="max-age=%s" % deploy_file.max_age_seconds,
+            )
+
+        return deploy_file
+
+    def _delete(self, keys, report):
+        for i in range(0, len(keys), MAX_KEYS_PER_DELETE):
+            batch = keys[i : i + MAX_KEYS_PER_DELETE]
+            print(f"Deleting {len(batch)} files no longer in the site")
+            self.client.delete_objects(
+                Bucket=self.bucket_name, Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True}
+            )
+            report.keys_deleted += len(batch)
+
+    def _read_manifest(self):
+        try:
+            response = self.client.get_object(Bucket=self.manifest_bucket_name, Key=self.manifest_key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return {}
+            raise
+
+        return json.loads(response["Body"].read().decode("utf-8"))
+
+    def _write_manifest(self, manifest):
+        self.client.put_object(
+            Bucket=self.manifest_bucket_name,
+            Key=self.manifest_key,
+            Body=json.dumps(manifest, sort_keys=True).encode("utf-8"),
+            ContentType="application/json",
+            CacheControl="no-cache",
+            ACL="private",
+        )
+
+        if self.manifest_bucket_name != self.bucket_name:
+            # Remove any manifest left in the public site bucket from before the manifest was moved out of it.
+            self.client.delete_object(Bucket=self.bucket_name, Key=DEPLOY_MANIFEST_KEY)
+
+
+def _collect_files(source_dir):
+    files = {}
+
+    for root, dirs, file_names in os.walk(source_dir):
+        for file_name in file_names:
+            file_path = os.path.join(root, file_name)
+            deploy_file = _deploy_file(source_dir, file_path)
+            if deploy_file:
+                files[deploy_file.key] = deploy_file
+
+    return files
+
+
+def _deploy_file(source_dir, file_path):
+    # The static site bucket isn't set up to serve index files from subdirectories, so each page is uploaded using its
+    # directory name as the key and the index file's contents as the content.
+    bucket_key = file_path.replace(source_dir + os.path.sep, "")
+    bucket_key = bucket_key.replace("/index.html", "")
+
+    content_type = mimetypes.guess_type(file_path, strict=False)[0]
+    if content_type is None and file_path.endswith(".map"):
+        # .map files are sourcemaps which tell browsers how minified CSS and JS relates back to source files
+        # setting mimetype to "application/json" is recommended and makes the files viewable in browsers
+        content_type = "application/json"
+    if content_type is None:
+        print(f"Not uploading file {bucket_key} due to unknown mimetype.")
+        return None
+
+    file_name = os.path.basename(file_path)
+    if _is_versioned_asset(file_name):
+        max_age_seconds = YEAR_IN_SECONDS
+    elif _measure_related(file_name):
+        max_age_seconds = FIFTEEN_MINUTES_IN_SECONDS
+    else:
+        max_age_seconds = HOUR_IN_SECONDS
+
+    content_hash = hashlib.md5()
+    size = 0
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(64 * 1024), b""):
+            content_hash.update(chunk)
+            size += len(chunk)
+
+    return DeployFile(
+        path=file_path,
+        key=bucket_key,
+        content_type=content_type,
+        max_age_seconds=max_age_seconds,
+        size=size,
+        fingerprint=f"{content_hash.hexdigest()}:{content_type}:{max_age_seconds}",
+    )
+
+
+def _is_versioned_asset(file):
+    match = re.search(r"(application|all|charts)-(\w+).(css|js)$", file)
+    if match:
+        return match.group(1) in ["application", "all", "charts"]
+    return False
+
+
+def _measure_related(file):
+    return file.split(".")[-1] in ["html", "json", "csv"]
@@ -0,0 +1,118 @@
+import os
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from application import db
+
+
+class QueryCount:
+    def __init__(self):
+        self.total = 0
+        self.seconds = 0.0
+
+
+@contextmanager
+def count_queries():
+    """
+    Counts the SQL statements this process sends to the database inside the `with` block, and the time spent waiting
+    for them. Queries made by the worker processes of a parallel build aren't included.
+    """
+    query_count = QueryCount()
+    # Keyed by execution context, as a statement which fails never reaches `after_cursor_execute`
+    start_times = {}
+
+    def _before_query(conn, cursor, statement, parameters, context, executemany):
+        start_times[context] = time.perf_counter()
+
+    def _query_finished(context):
+        start_time = start_times.pop(context, None)
+        if start_time is not None:
+            query_count.total += 1
+            query_count.seconds += time.perf_counter() - start_time
+
+    def _after_query(conn, cursor, statement, parameters, context, executemany):
+        _query_finished(context)
+
+    def _query_failed(exception_context):
+        _query_finished(exception_context.execution_context)
+
+    event.listen(db.engine, "before_cursor_execute", _before_query)
+    event.listen(db.engine, "after_cursor_execute", _after_query)
+    event.listen(db.engine, "handle_error", _query_failed)
+    try:
+        yield query_count
+    finally:
+        event.remove(db.engine, "before_cursor_execute", _before_query)
+        event.remove(db.engine, "after_cursor_execute", _after_query)
+        event.remove(db.engine, "handle_error", _query_failed)
+
+
+class BuildReport:
+    """
+    Records how long each stage of a static site build took and what it did, so that slow builds can be tracked down
+    to the stage responsible. The stages are stored on the `Build` and shown on the admin site build page.
+    """
+
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, build_dir=None):
+        """
+        Times the `with` block as a stage of the build. CPU time includes any child processes (e.g. gulp, or the
+        workers of a parallel build) which finish during the stage. If `build_dir` is given, the files in it created or
+        changed during the stage are counted too.
+        """
+        started_at = time.time()
+        start_wall_time = time.perf_counter()
+        start_cpu_time = _cpu_time()
+
+        try:
+            with count_queries() as query_count:
+                yield
+        finally:
+            stage = {
+                "name": name,
+                "wall_time_seconds": round(time.perf_counter() - start_wall_time, 3),
+                "cpu_time_seconds": round(_cpu_time() - start_cpu_time, 3),
+                "query_count": query_count.total,
+                "query_time_seconds": round(query_count.seconds, 3),
+                "files_written": None,
+                "bytes_written": None,
+            }
+            if build_dir:
+                stage["files_written"], stage["bytes_written"] = _files_changed_since(build_dir, started_at)
+
+            self.stages.append(stage)
+            print(f"DEBUG build stage: {stage}")
+
+
+def _cpu_time():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def _files_changed_since(directory, since):
+    """Returns the number and total size of the files under `directory` which have been written since `since`. This
+    uses the inode change time, rather than the modification time, as copied files (e.g. static assets) keep the
+    modification time of their source."""
+    files, total_bytes = 0, 0
+
+    for root, dirs, file_names in os.walk(directory):
+        if ".git" in dirs:
+            dirs.remove(".git")
+
+        for file_name in file_names:
+            try:
+                stat = os.stat(os.path.join(root, file_name))
+            except FileNotFoundError:
+                continue
+
+            # File timestamps come from a coarser clock than `time.time()`, so can lag it by a few milliseconds.
+            if stat.st_ctime >= since - 0.05:
+                files += 1
+                total_bytes += stat.st_size
+
+    return files, total_bytes
@@ -2,7 +2,7 @@ from datetime import datetime
 import enum
 
 from sqlalchemy import PrimaryKeyConstraint
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import JSON, UUID
 from application import db
 
 
@@ -25,3 +25,16 @@ class Build(db.Model):
     succeeded_at = db.Column(db.DateTime, nullable=True)
     failure_reason = db.Column(db.String, nullable=True)
     failed_at = db.Column(db.DateTime, nullable=True)
+
+    # Set when a change can't be detected from measure version/dimension timestamps (e.g. a data source edit), so an
+    # incremental build isn't enough and every page needs to be re-rendered.
+    full_rebuild = db.Column(db.Boolean, default=False, nullable=False)
+
+    # The timings, query counts and files written for each stage of the build, as recorded by `BuildReport`.
+    stages = db.Column(JSON, nullable=True)
+
+    # A build worker holds a lease on the build it's running, and keeps extending it for as long as the build is still
+    # going. If the worker dies the lease runs out and another worker can claim the build again, a limited number of
+    # times. Builds started before leases were introduced have no expiry, so block later builds until acknowledged.
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    attempts = db.Column(db.Integer, default=0, server_default="0", nullable=False)
@@ -1,5 +1,3 @@
-import bleach
-
 import json
 import jinja2
 
@@ -7,12 +5,12 @@ from flask import Markup
 from hurry.filesize import size, alternative
 from slugify import slugify
 
-from application.cms.markdown import markdown
+from application.cms.markdown import markdown_renderer
 from wtforms.widgets import html_params as wtforms_html_params
 
 
 def render_markdown(string):
-    return Markup(markdown(bleach.clean(string) if string else ""))
+    return Markup(markdown_renderer.render(string))
 
 
 def filesize(string):
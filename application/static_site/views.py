@@ -1,22 +1,18 @@
-import os
-
-from tempfile import NamedTemporaryFile
+from itertools import chain
 
 from botocore.exceptions import ClientError
-from flask import render_template, abort, make_response, send_file, request
+from flask import render_template, abort, make_response, request, Response
 
 from flask_security import current_user
 from flask_security import login_required
 
-from application.data.dimensions import DimensionObjectBuilder
+from application.data.dimensions import dimension_csv_cache
 from application.cms.exceptions import PageNotFoundException, DimensionNotFoundException, UploadNotFoundException
 from application.cms.page_service import page_service
 from application.cms.upload_service import upload_service
 from application.static_site import static_site_blueprint
 from application.utils import (
-    get_csv_data_for_download,
-    write_dimension_csv,
-    write_dimension_tabular_csv,
+    iter_csv_data_for_download,
     user_has_access,
 )
 from application.utils import cleanup_filename
@@ -168,18 +164,30 @@ def measure_version_file_download(topic_slug, subtopic_slug, measure_slug, versi
             topic_slug, subtopic_slug, measure_slug, version
         )
         upload_obj = upload_service.get_upload(measure_version, filename)
-        downloaded_file = upload_service.get_measure_download(upload_obj, filename, "source")
-        content = get_csv_data_for_download(downloaded_file)
-        if os.path.exists(downloaded_file):
-            os.remove(downloaded_file)
-        if content.strip() == "":
+        download = upload_service.open_measure_download(upload_obj, filename, "source")
+        lines = iter_csv_data_for_download(download)
+
+        # Read up to the first non-blank line, so that we can still 404 for an empty file before starting the response.
+        leading_lines = []
+        for line in lines:
+            leading_lines.append(line)
+            if line.strip():
+                break
+        else:
+            download.close()
             abort(404)
 
-        outfile = NamedTemporaryFile("w", encoding="windows-1252", delete=False)
-        outfile.write(content)
-        outfile.flush()
+        def generate():
+            try:
+                for line in chain(leading_lines, lines):
+                    # A character which can't be encoded can no longer turn into an error once the response has started.
+                    yield line.encode("windows-1252", errors="replace")
+            finally:
+                download.close()
 
-        return send_file(outfile.name, as_attachment=True, mimetype="text/csv", attachment_filename=filename)
+        return Response(
+            generate(), mimetype="text/csv", headers={"Content-Disposition": 'attachment; filename="%s"' % filename}
+        )
 
     except (UploadNotFoundException, FileNotFoundError, ClientError):
         abort(404)
@@ -193,15 +201,13 @@ def dimension_file_download(topic_slug, subtopic_slug, measure_slug, version, di
         *_, dimension = page_service.get_measure_version_hierarchy(
             topic_slug, subtopic_slug, measure_slug, version, dimension_guid=dimension_guid
         )
-        dimension_obj = DimensionObjectBuilder.build(dimension)
-
-        data = write_dimension_csv(dimension=dimension_obj)
+        data = dimension_csv_cache().get_csv(dimension)
         response = make_response(data)
 
-        if dimension_obj["context"]["dimension"] and dimension_obj["context"]["dimension"] != "":
-            filename = "%s.csv" % cleanup_filename(dimension_obj["context"]["dimension"])
+        if dimension.title:
+            filename = "%s.csv" % cleanup_filename(dimension.title)
         else:
-            filename = "%s.csv" % cleanup_filename(dimension_obj["context"]["guid"])
+            filename = "%s.csv" % cleanup_filename(dimension.guid)
 
         response.headers["Content-Type"] = "text/csv"
         response.headers["Content-Disposition"] = 'attachment; filename="%s"' % filename
@@ -219,15 +225,13 @@ def dimension_file_table_download(topic_slug, subtopic_slug, measure_slug, versi
         *_, dimension = page_service.get_measure_version_hierarchy(
             topic_slug, subtopic_slug, measure_slug, version, dimension_guid=dimension_guid
         )
-        dimension_obj = DimensionObjectBuilder.build(dimension)
-
-        data = write_dimension_tabular_csv(dimension=dimension_obj)
+        data = dimension_csv_cache().get_tabular_csv(dimension)
         response = make_response(data)
 
-        if dimension_obj["context"]["dimension"] and dimension_obj["context"]["dimension"] != "":
-            filename = "%s-table.csv" % cleanup_filename(dimension_obj["context"]["dimension"].lower())
+        if dimension.title:
+            filename = "%s-table.csv" % cleanup_filename(dimension.title.lower())
         else:
-            filename = "%s-table.csv" % cleanup_filename(dimension_obj["context"]["guid"])
+            filename = "%s-table.csv" % cleanup_filename(dimension.guid)
 
         response.headers["Content-Type"] = "text/csv"
         response.headers["Content-Disposition"] = 'attachment; filename="%s"' % filename
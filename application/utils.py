@@ -1,8 +1,11 @@
+import codecs
 import csv
 import hashlib
+import io
 import json
 import logging
 import os
+import stat
 import sys
 import time
 from datetime import date
@@ -41,6 +44,16 @@ def get_bool(param):
 
 
 # This should be placed after login_required decorator as it needs authenticated user
+def is_private_to_current_user(path):
+    """
+    Whether `path` is owned by the current user and not writable by anyone else, so nobody else could have written
+    what's in it. Files cached in a shared place like /tmp should only be trusted if this is True of them and of their
+    directory.
+    """
+    path_stat = os.stat(path)
+    return path_stat.st_uid == os.getuid() and not path_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
 def user_has_access(f):
     from application.cms.page_service import page_service
 
@@ -82,34 +95,58 @@ class DateEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, o)
 
 
-def get_csv_data_for_download(filename):
+# How much of a source data file is checked to decide whether it is UTF-8 or ISO-8859-1 encoded.
+CSV_ENCODING_DETECTION_BYTES = 64 * 1024
 
-    rows = []
-    try:
-        with open(filename, "r", encoding="utf-8-sig") as f:
-            reader = csv.reader(f, delimiter=",")
-            for row in reader:
-                rows.append(row)
 
-    except UnicodeDecodeError:
-        rows = []  # Reset rows to be empty before attempting to read the file again, to avoid duplication
-        with open(filename, "r", encoding="iso-8859-1") as f:
-            reader = csv.reader(f, delimiter=",")
-            for row in reader:
-                rows.append(row)
+def _decode_invalid_utf8_as_iso_8859_1(error):
+    return error.object[error.start : error.end].decode("iso-8859-1"), error.end
 
-    except Exception as e:
-        message = "error with file %s" % filename
-        print(message, e)
-        raise e
 
-    with StringIO() as output:
-        writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC, lineterminator="\n")
+codecs.register_error("iso-8859-1-fallback", _decode_invalid_utf8_as_iso_8859_1)
 
-        for row in rows:
-            writer.writerow(row)
 
-        return output.getvalue()
+class _ByteStreamReader(io.RawIOBase):
+    """Adapts anything with a `read(size)` method returning bytes (e.g. an S3 response body) for use with `io`."""
+
+    def __init__(self, byte_stream):
+        self.byte_stream = byte_stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.byte_stream.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+class _LineWriter:
+    def write(self, line):
+        return line
+
+
+def iter_csv_data_for_download(byte_stream):
+    """
+    Reads a CSV from a stream of bytes and yields it back a line at a time, with every value quoted, so that large
+    source data files never need to be held in memory or copied to disk.
+
+    Files are UTF-8 unless their first `CSV_ENCODING_DETECTION_BYTES` bytes aren't valid UTF-8, in which case they are
+    read as ISO-8859-1. Any invalid bytes found after that point in a UTF-8 file are also read as ISO-8859-1.
+    """
+    buffered_stream = io.BufferedReader(_ByteStreamReader(byte_stream), buffer_size=CSV_ENCODING_DETECTION_BYTES)
+
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(buffered_stream.peek(CSV_ENCODING_DETECTION_BYTES))
+        encoding, errors = "utf-8-sig", "iso-8859-1-fallback"
+    except UnicodeDecodeError:
+        encoding, errors = "iso-8859-1", "strict"
+
+    text_stream = io.TextIOWrapper(buffered_stream, encoding=encoding, errors=errors)
+    writer = csv.writer(_LineWriter(), quoting=csv.QUOTE_NONNUMERIC, lineterminator="\n")
+
+    for row in csv.reader(text_stream, delimiter=","):
+        yield writer.writerow(row)
 
 
 def generate_token(email, app):
@@ -261,3 +298,55 @@ class TimedExecution:
 
 def cleanup_filename(filename):
     return slugify(filename)
+
+
+class SlugIndex:
+    """
+    Finds the instance of `model` whose `slug_column`, slugified, is a given slug, without slugifying every row for
+    every lookup.
+
+    The slugs of every row are indexed by primary key the first time they're needed, and kept for the life of the
+    process. A slug which isn't in the index, or whose row no longer has that slug (because it's been changed or
+    deleted, perhaps by another process), makes the index be built again before giving up, so it's never out of date
+    in a way that changes the answer. Where more than one row has the same slug, the one with the lowest primary key is
+    found.
+    """
+
+    def __init__(self, model, slug_column):
+        self.model = model
+        self.slug_column = slug_column
+        self.__primary_keys_by_slug = None
+
+    def get(self, slug):
+        if self.__primary_keys_by_slug is not None:
+            instance = self.__get_indexed(slug)
+            if instance is not None:
+                return instance
+
+        self.rebuild()
+        return self.__get_indexed(slug)
+
+    def rebuild(self):
+        (primary_key_column,) = self.model.__mapper__.primary_key
+        primary_keys_by_slug = {}
+        for primary_key, value in self.model.query.with_entities(primary_key_column, self.slug_column).order_by(
+            primary_key_column
+        ):
+            if value is not None:
+                primary_keys_by_slug.setdefault(slugify(value), primary_key)
+
+        self.__primary_keys_by_slug = primary_keys_by_slug
+
+    def clear(self):
+        self.__primary_keys_by_slug = None
+
+    def __get_indexed(self, slug):
+        primary_key = self.__primary_keys_by_slug.get(slug)
+        if primary_key is None:
+            return None
+
+        instance = self.model.query.get(primary_key)
+        if instance is None or slugify(getattr(instance, self.slug_column.key)) != slug:
+            return None
+
+        return instance
@@ -107,13 +107,24 @@ def force_build_static_site():
         from application.sitebuilder.build_service import request_build
         from application.sitebuilder.build_service import build_site
 
-        request_build()
+        request_build(full_rebuild=True)
         print("An immediate build has been requested")
         build_site(app)
     else:
         print("Build is disabled at the moment. Set BUILD_SITE to true to enable")
 
 
+@manager.command
+def run_build_worker():
+    if app.config["BUILD_SITE"]:
+        from application.sitebuilder.build_service import run_build_worker
+
+        print("Build worker waiting for build requests")
+        run_build_worker(app)
+    else:
+        print("Build is disabled at the moment. Set BUILD_SITE to true to enable")
+
+
 # Run this command with the parameter default_user_password to set up additional default user accounts
 # e.g. ./manage.py pull_prod_data --default_user_password=P@55w0rd
 @manager.command
@@ -330,30 +341,35 @@ def report_stalled_build():
 
 @manager.command
 def refresh_materialized_views():
-    from application.dashboard.view_sql import refresh_all_dashboard_helper_views
+    # The dashboards' summary tables are kept up to date as measures change, so this is only needed to repair them
+    from application.dashboard.summary_tables import refresh_dashboard_summaries
 
-    db.session.execute(refresh_all_dashboard_helper_views)
+    refresh_dashboard_summaries(db.session)
     db.session.commit()
-    print("Refreshed data for MATERIALIZED VIEWS")
+    print("Rebuilt the dashboard summary tables")
+
+
+@manager.command
+def verify_dashboard_summaries():
+    from application.dashboard.summary_tables import count_dashboard_summary_differences
+
+    differences = count_dashboard_summary_differences(db.session)
+    for table_name, number_of_differences in differences.items():
+        print(f"{table_name}: {number_of_differences} rows missing or out of date")
+
+    if any(differences.values()):
+        print("Run refresh_materialized_views to repair them")
+        sys.exit(1)
 
 
 @manager.command
 def drop_and_create_materialized_views():
-    from application.dashboard.view_sql import (
-        drop_all_dashboard_helper_views,
-        latest_published_measure_versions_view,
-        latest_published_measure_versions_by_geography_view,
-        ethnic_groups_by_dimension_view,
-        classifications_by_dimension,
-    )
+    from application.dashboard.view_sql import drop_dashboard_summary_tables, create_dashboard_summary_tables
 
-    db.session.execute(drop_all_dashboard_helper_views)
-    db.session.execute(latest_published_measure_versions_view)
-    db.session.execute(latest_published_measure_versions_by_geography_view)
-    db.session.execute(ethnic_groups_by_dimension_view)
-    db.session.execute(classifications_by_dimension)
+    db.session.execute(drop_dashboard_summary_tables)
+    db.session.execute(create_dashboard_summary_tables)
     db.session.commit()
-    print("Drop and create MATERIALIZED VIEWS done")
+    print("Drop and create dashboard summary tables done")
 
 
 # Build stalled or failed emails continue until status is updated using
@@ -431,7 +447,8 @@ def refresh_error_pages():
 @manager.command
 def synchronise_classifications():
     synchroniser = EthnicityClassificationSynchroniser(classification_service=classification_service)
-    synchroniser.synchronise_classifications(app.classification_finder.get_classification_collection())
+    report = synchroniser.synchronise_classifications(app.classification_finder.get_classification_collection())
+    print(f"Synchronised classifications: {report}")
 
 
 # TODO: START Delete me after migrating uploads
@@ -0,0 +1,25 @@
+"""
+Add full_rebuild flag to build
+
+Revision ID: 2026_10_18_build_full_rebuild
+Revises: 2020_12_18_level_of_geography
+Create Date: 2026-10-18 09:12:41.503117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "2026_10_18_build_full_rebuild"
+down_revision = "2020_12_18_level_of_geography"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("build", sa.Column("full_rebuild", sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade():
+    op.drop_column("build", "full_rebuild")
@@ -0,0 +1,27 @@
+"""
+Add a lease to builds, so that a build worker which dies mid-build doesn't block every later build
+
+Revision ID: 2026_10_18_build_lease
+Revises: 2026_10_18_build_stages
+Create Date: 2026-10-18 15:12:04.551207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "2026_10_18_build_lease"
+down_revision = "2026_10_18_build_stages"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("build", sa.Column("lease_expires_at", sa.DateTime(), nullable=True))
+    op.add_column("build", sa.Column("attempts", sa.Integer(), server_default="0", nullable=False))
+
+
+def downgrade():
+    op.drop_column("build", "attempts")
+    op.drop_column("build", "lease_expires_at")
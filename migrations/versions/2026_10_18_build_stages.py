@@ -0,0 +1,26 @@
+"""
+Add per-stage timings to build
+
+Revision ID: 2026_10_18_build_stages
+Revises: 2026_10_18_build_full_rebuild
+Create Date: 2026-10-18 14:03:27.318842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "2026_10_18_build_stages"
+down_revision = "2026_10_18_build_full_rebuild"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("build", sa.Column("stages", postgresql.JSON(astext_type=sa.Text()), nullable=True))
+
+
+def downgrade():
+    op.drop_column("build", "stages")
@@ -0,0 +1,38 @@
+"""
+Replace the dashboard materialized views with summary tables which are kept up to date a measure at a time
+
+Revision ID: 2026_10_18_dashboard_tables
+Revises: 2026_10_18_upload_classes
+Create Date: 2026-10-18 17:25:48.902114
+
+"""
+from alembic import op
+
+from application.dashboard.view_sql import (
+    classifications_by_dimension,
+    create_dashboard_summary_tables,
+    drop_all_dashboard_helper_views,
+    drop_dashboard_summary_tables,
+    ethnic_groups_by_dimension_view,
+    latest_published_measure_versions_by_geography_view,
+    latest_published_measure_versions_view,
+)
+
+# revision identifiers, used by Alembic.
+revision = "2026_10_18_dashboard_tables"
+down_revision = "2026_10_18_upload_classes"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(drop_all_dashboard_helper_views)
+    op.execute(create_dashboard_summary_tables)
+
+
+def downgrade():
+    op.execute(drop_dashboard_summary_tables)
+    op.execute(latest_published_measure_versions_view)
+    op.execute(latest_published_measure_versions_by_geography_view)
+    op.execute(ethnic_groups_by_dimension_view)
+    op.execute(classifications_by_dimension)
@@ -0,0 +1,26 @@
+"""
+Store the ethnicity classifications found for an uploaded file with its upload
+
+Revision ID: 2026_10_18_upload_classes
+Revises: 2026_10_18_build_lease
+Create Date: 2026-10-18 16:40:21.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "2026_10_18_upload_classes"
+down_revision = "2026_10_18_build_lease"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("upload", sa.Column("ethnicity_classifications", postgresql.JSON(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("upload", "ethnicity_classifications")
@@ -1,5 +1,7 @@
+from application import db
 from application.auth.models import User, TypeOfUser
 from application.cms.models import publish_status
+from application.sitebuilder.build_service import request_build
 from application.utils import generate_token
 from bs4 import BeautifulSoup
 from flaky import flaky
@@ -69,6 +71,30 @@ def test_standard_user_cannot_view_admin_urls(test_app_client, logged_in_rdu_use
     assert resp.status_code == 403
 
 
+@flaky(max_runs=10, min_passes=1)
+def test_dev_user_can_view_stages_of_recent_builds(test_app_client, logged_in_dev_user):
+    build = request_build()
+    build.stages = [
+        {
+            "name": "Build dashboards",
+            "wall_time_seconds": 12.5,
+            "cpu_time_seconds": 10.25,
+            "query_count": 321,
+            "query_time_seconds": 1.75,
+            "files_written": 42,
+            "bytes_written": 123456,
+        }
+    ]
+    db.session.commit()
+
+    resp = test_app_client.get(url_for("admin.site_build"))
+
+    assert resp.status_code == 200
+    page = BeautifulSoup(resp.data.decode("utf-8"), "html.parser")
+    cells = [cell.text.strip() for cell in page.find("table", class_="build-stages").find("tbody").find_all("td")]
+    assert cells == ["Build dashboards", "12.5", "10.25", "321", "1.75", "42", "123456"]
+
+
 @flaky(max_runs=10, min_passes=1)
 def test_admin_user_can_view_admin_page(test_app_client, logged_in_admin_user):
     resp = test_app_client.get(url_for("admin.index"))
@@ -3,6 +3,7 @@ import pytest
 from application.cms.classification_service import ClassificationService
 from application.cms.exceptions import ClassificationNotFoundException
 from application.cms.models import Classification, Ethnicity
+from application.sitebuilder.instrumentation import count_queries
 
 from tests.models import ClassificationFactory, EthnicityFactory
 
@@ -172,3 +173,39 @@ def test_remove_parent_value_from_classification_removes_value():
 
     # then we have one fewer parent values for the classification
     assert len(g2.parent_values) == 2
+
+
+class TestClassificationIdCache:
+    @pytest.fixture
+    def caching_classification_service(self):
+        caching_classification_service = ClassificationService()
+        caching_classification_service.classification_id_cache_enabled = True
+        return caching_classification_service
+
+    def test_classification_exists_only_queries_once_for_known_ids(self, caching_classification_service):
+        ClassificationFactory(id="C1")
+        ClassificationFactory(id="C2")
+        assert caching_classification_service.classification_exists("C1") is True
+
+        with count_queries() as query_count:
+            assert caching_classification_service.classification_exists("C1") is True
+            assert caching_classification_service.classification_exists("C2") is True
+
+        assert query_count.total == 0
+
+    def test_classification_exists_finds_classifications_added_after_the_cache_was_loaded(
+        self, caching_classification_service
+    ):
+        assert caching_classification_service.classification_exists("C1") is False
+
+        ClassificationFactory(id="C1")
+
+        assert caching_classification_service.classification_exists("C1") is True
+
+    def test_deleting_a_classification_clears_the_cache(self, caching_classification_service):
+        classification = ClassificationFactory(id="C1")
+        assert caching_classification_service.classification_exists("C1") is True
+
+        caching_classification_service.delete_classification(classification)
+
+        assert caching_classification_service.classification_exists("C1") is False
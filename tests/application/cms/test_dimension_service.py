@@ -1,6 +1,10 @@
 from datetime import datetime
+from unittest.mock import patch
+
+import pytest
 
 from application import db
+from application.cms.exceptions import ClassificationFinderClassificationNotFoundException
 from application.cms.dimension_service import DimensionService
 from application.cms.models import Chart, Dimension
 from tests.models import MeasureVersionFactory, MeasureVersionWithDimensionFactory
@@ -10,13 +14,13 @@ dimension_service = DimensionService()
 
 def test_create_dimension_on_measure_page():
     measure_version = MeasureVersionFactory()
-    assert measure_version.dimensions.count() == 0
+    assert len(measure_version.dimensions) == 0
 
     dimension_service.create_dimension(
         measure_version, title="test-dimension", time_period="time_period", summary="summary"
     )
 
-    assert measure_version.dimensions.count() == 1
+    assert len(measure_version.dimensions) == 1
     assert measure_version.dimensions[0].title == "test-dimension"
     assert measure_version.dimensions[0].time_period == "time_period"
     assert measure_version.dimensions[0].summary == "summary"
@@ -34,12 +38,12 @@ def test_create_dimension_on_measure_page():
 def test_delete_dimension_from_draft_measure_page():
     measure_version = MeasureVersionWithDimensionFactory(status="DRAFT", dimensions__guid="abc123")
 
-    assert measure_version.dimensions.count() == 1
+    assert len(measure_version.dimensions) == 1
     assert measure_version.dimensions[0].guid == "abc123"
 
     dimension_service.delete_dimension(measure_version, "abc123")
 
-    assert measure_version.dimensions.count() == 0
+    assert len(measure_version.dimensions) == 0
 
 
 def test_update_dimension():
@@ -78,7 +82,7 @@ def test_update_dimension_does_not_call_update_dimension_classification_by_defau
     )
 
     dimension = measure_version.dimensions[0]
-    assert measure_version.dimensions.count() == 1
+    assert len(measure_version.dimensions) == 1
     assert dimension.title == "test-dimension"
     assert dimension.time_period == "time_period"
     assert dimension.summary == "summary"
@@ -111,7 +115,7 @@ def test_update_dimension_does_call_update_dimension_classification_if_told_to()
     )
 
     dimension = measure_version.dimensions[0]
-    assert measure_version.dimensions.count() == 1
+    assert len(measure_version.dimensions) == 1
     assert dimension.dimension_classification is not None
 
     # When update_dimension() is called without explicitly telling it to reclassify the dimension
@@ -422,7 +426,7 @@ def test_adding_table_with_custom_data_and_existing_less_detailed_chart(two_clas
 def test_add_or_update_dimensions_to_measure_page_preserves_order():
     measure_version = MeasureVersionFactory()
 
-    assert measure_version.dimensions.count() == 0
+    assert len(measure_version.dimensions) == 0
 
     d1 = dimension_service.create_dimension(
         measure_version, title="test-dimension-1", time_period="time_period", summary="summary"
@@ -445,3 +449,58 @@ def test_add_or_update_dimensions_to_measure_page_preserves_order():
     assert d1.summary == "updated summary"
     assert d1.position == 0
     assert d2.position == 1
+
+
+def test_adding_chart_with_a_classification_deleted_by_another_process():
+    # Given an existing dimension, and a classification id which this process still thinks is in the database
+    dimension = dimension_service.create_dimension(
+        MeasureVersionFactory(), title="test-dimension", time_period="time_period", summary="summary"
+    )
+
+    with patch("application.data.ethnicity_classification_matcher.classification_service") as classification_service:
+        classification_service.classification_exists.return_value = True
+
+        # When update_dimension is called with a custom chart classification using that id
+        # Then it fails as though the classification hadn't been found, rather than with a database error
+        with pytest.raises(ClassificationFinderClassificationNotFoundException):
+            dimension_service.update_dimension(
+                dimension,
+                {
+                    "use_custom": True,
+                    "chart": {"title": "My chart title"},
+                    "chart_settings_and_source_data": {"chartOptions": {}},
+                    "classification_code": "5A",
+                    "has_parents": False,
+                    "has_all": True,
+                    "has_unknown": True,
+                },
+                update_classification=True,
+            )
+
+
+def test_adding_chart_from_the_builder_with_a_classification_deleted_by_another_process():
+    # Given an existing dimension, and a classification id which this process still thinks is in the database
+    dimension = dimension_service.create_dimension(
+        MeasureVersionFactory(), title="test-dimension", time_period="time_period", summary="summary"
+    )
+
+    with patch("application.data.ethnicity_classification_matcher.classification_service") as classification_service:
+        classification_service.classification_exists.return_value = True
+
+        # When update_dimension is called with chart builder data for that classification
+        dimension_service.update_dimension(
+            dimension,
+            {
+                "use_custom": False,
+                "chart": {"title": "My chart title"},
+                "chart_settings_and_source_data": {"chartOptions": {}},
+                "classification_code": "5A",
+                "ethnicity_values": ["All", "Asian", "Black", "Mixed", "White", "Other", "Unknown"],
+            },
+            update_classification=True,
+        )
+
+    # Then the chart is saved without a classification
+    dimension = Dimension.query.get(dimension.guid)
+    assert dimension.dimension_chart.chart_object == {"title": "My chart title"}
+    assert dimension.dimension_chart.classification_id is None
@@ -7,6 +7,7 @@ from application.cms.exceptions import PageNotFoundException, InvalidPageHierarc
 from application.cms.forms import MeasureVersionForm
 from application.cms.models import Measure, NewVersionType, DataSource
 from application.cms.page_service import PageService
+from application.sitebuilder.models import Build
 from tests.models import (
     TopicFactory,
     SubtopicFactory,
@@ -383,13 +384,13 @@ class TestPageService:
         measure_version = MeasureVersionWithDimensionFactory(latest=True)
 
         assert measure_version.latest
-        assert measure_version.dimensions.count() > 0
+        assert len(measure_version.dimensions) > 0
         old_dimension = measure_version.dimensions[0]
         old_dimension_guid = old_dimension.guid
 
         new_version = page_service.create_measure_version(measure_version, NewVersionType.MINOR_UPDATE, user=user)
 
-        assert new_version.dimensions.count() > 0
+        assert len(new_version.dimensions) > 0
         new_dimension = new_version.dimensions[0]
 
         assert old_dimension.title == new_dimension.title
@@ -412,7 +413,7 @@ class TestPageService:
         new_version = page_service.create_measure_version(measure_version, NewVersionType.MINOR_UPDATE, user=user)
 
         # then
-        assert new_version.dimensions.count() > 0
+        assert len(new_version.dimensions) > 0
         assert new_version.dimensions[0].classification_links.count() > 0
 
         new_link = new_version.dimensions[0].classification_links[0]
@@ -532,6 +533,35 @@ class TestPageService:
         assert measure_version_from_db.title == "I care too much!"
         assert measure_version_from_db.last_updated_by == user.email
 
+    def test_moving_a_measure_to_another_subtopic_requests_a_full_rebuild(self):
+        user = UserFactory(user_type=TypeOfUser.RDU_USER)
+        measure_version = MeasureVersionFactory(version="1.0", status="DRAFT")
+        new_subtopic = SubtopicFactory()
+
+        page_service.update_measure_version(
+            measure_version,
+            measure_version_form=MeasureVersionForm(
+                template_version="1",
+                is_minor_update=True,
+                title=measure_version.title,
+                db_version_id=measure_version.db_version_id,
+            ),
+            data_source_forms=[],
+            last_updated_by_email=user.email,
+            subtopic_id=new_subtopic.id,
+        )
+
+        assert measure_version.measure.subtopic == new_subtopic
+        assert [build.full_rebuild for build in Build.query.all()] == [True]
+
+    @pytest.mark.parametrize("status, full_rebuilds", (("APPROVED", [True]), ("DRAFT", [])))
+    def test_deleting_a_published_measure_version_requests_a_full_rebuild(self, status, full_rebuilds):
+        measure_version = MeasureVersionFactory(version="1.0", status=status)
+
+        page_service.delete_measure_version(measure_version)
+
+        assert [build.full_rebuild for build in Build.query.all()] == full_rebuilds
+
     def test_update_measure_version_raises_if_page_not_editable(self):
         user = UserFactory(user_type=TypeOfUser.RDU_USER)
         measure_version = MeasureVersionFactory(version="1.0", status="DRAFT")
@@ -1,9 +1,13 @@
 import os
+from io import BytesIO
 from tempfile import NamedTemporaryFile
+from unittest.mock import Mock, patch
 
 import pytest
+from werkzeug.datastructures import FileStorage
 
-from application.cms.exceptions import UploadCheckError
+from application.cms.exceptions import UploadCheckError, UploadCheckPending, UploadCheckVirusFound
+from tests.models import MeasureVersionFactory
 
 
 class TestUploadService:
@@ -55,3 +59,57 @@ class TestUploadService:
             tempfile.seek(0)
             upload_service.sanitise_file(self.temp_file.name)
             assert tempfile.read() == sanitised_output
+
+    def test_classify_file_finds_classifications_for_distinct_ethnicities(self, app, upload_service):
+        with self.temp_file as tempfile:
+            tempfile.write(
+                b"Measure,Ethnicity,Value\n"
+                b"Employment,Asian,70\nEmployment,Black,68\nEmployment,Mixed,71\n"
+                b"Employment,White,74\nEmployment,Other,66\nEmployment,Asian,69\n"
+            )
+
+        classifications = upload_service.classify_file(tempfile.name)
+
+        assert classifications["ethnicity_column"] == "Ethnicity"
+        assert classifications["ethnicities"] == ["Asian", "Black", "Mixed", "White", "Other"]
+        assert "5A" in classifications["definitions"]
+        assert "5A" in [output.get("classification_id") for output in classifications["classifications"]]
+
+    def test_classify_file_without_an_ethnicity_column(self, app, upload_service):
+        with self.temp_file as tempfile:
+            tempfile.write(b"Measure,Region,Value\nEmployment,London,70\n")
+
+        assert upload_service.classify_file(tempfile.name) is None
+
+    @pytest.mark.parametrize(
+        "scan_error, expected_classifications", ((None, {"ethnicity_column": "Ethnicity"}), (UploadCheckPending, None))
+    )
+    def test_upload_data_only_classifies_files_which_pass_the_scan(
+        self, db_session, upload_service, scan_error, expected_classifications
+    ):
+        measure_version = MeasureVersionFactory()
+        upload = Mock(ethnicity_classifications="stale")
+        file = FileStorage(stream=BytesIO(b"Ethnicity,Value\nWhite,1\n"), filename="data.csv")
+
+        with patch("application.cms.upload_service.scanner_service.scan_file", side_effect=scan_error), patch.object(
+            upload_service, "classify_file", return_value={"ethnicity_column": "Ethnicity"}
+        ) as classify_file, patch.object(upload_service.app, "file_service"):
+            upload_service.upload_data(measure_version, file, filename="data.csv", upload=upload)
+
+        assert classify_file.call_count == (1 if scan_error is None else 0)
+        assert upload.ethnicity_classifications == expected_classifications
+
+    def test_upload_data_does_not_classify_files_which_fail_the_scan(self, db_session, upload_service):
+        measure_version = MeasureVersionFactory()
+        file = FileStorage(stream=BytesIO(b"Ethnicity,Value\nWhite,1\n"), filename="data.csv")
+
+        with patch(
+            "application.cms.upload_service.scanner_service.scan_file",
+            side_effect=UploadCheckVirusFound("Virus scan has found something suspicious"),
+        ), patch.object(upload_service, "classify_file") as classify_file, patch.object(
+            upload_service.app, "file_service"
+        ):
+            with pytest.raises(UploadCheckVirusFound):
+                upload_service.upload_data(measure_version, file, filename="data.csv", upload=Mock())
+
+        classify_file.assert_not_called()
@@ -20,6 +20,7 @@ from tests.models import (
     DataSourceFactory,
     MeasureVersionWithDimensionFactory,
     UserFactory,
+    UploadFactory,
 )
 from tests.utils import multidict_from_measure_version_and_kwargs, page_displays_error_matching_message
 from flaky import flaky
@@ -338,6 +339,67 @@ def test_reorder_measures_triggers_build(test_app_client, logged_in_rdu_user):
     assert len(builds) == 1
 
 
+@flaky(max_runs=10, min_passes=1)
+def test_get_valid_classifications_for_datasets_returns_results_for_each_dataset(test_app_client, logged_in_rdu_user):
+    datasets = [
+        ["White", "Other than White"],
+        ["White", "Black", "Asian", "Mixed", "Other"],
+        ["White", "Other than White"],
+    ]
+
+    response = test_app_client.post(
+        url_for("cms.get_valid_classifications_for_datasets"),
+        data=json.dumps({"datasets": datasets}),
+        content_type="application/json",
+    )
+
+    assert response.status_code == 200
+    results = json.loads(response.data)["results"]
+    assert len(results) == 3
+    for dataset, result in zip(datasets, results):
+        single_response = test_app_client.post(
+            url_for("cms.get_valid_classifications"),
+            data=json.dumps({"data": dataset}),
+            content_type="application/json",
+        )
+        assert result == json.loads(single_response.data)
+
+
+@flaky(max_runs=10, min_passes=1)
+def test_get_valid_classifications_can_return_classification_definitions_once_each(test_app_client, logged_in_rdu_user):
+    data = ["White", "Other than White"]
+
+    full_response = test_app_client.post(
+        url_for("cms.get_valid_classifications"), data=json.dumps({"data": data}), content_type="application/json"
+    )
+    compact_response = test_app_client.post(
+        url_for("cms.get_valid_classifications"),
+        data=json.dumps({"data": data, "compact": True}),
+        content_type="application/json",
+    )
+
+    assert full_response.status_code == compact_response.status_code == 200
+    full_classifications = json.loads(full_response.data)["classifications"]
+    compact_output = json.loads(compact_response.data)
+    assert [output.get("classification_id", "custom") for output in compact_output["classifications"]] == [
+        output["classification"]["id"] for output in full_classifications
+    ]
+    assert compact_output["definitions"] == {
+        output["classification"]["id"]: output["classification"] for output in full_classifications[:-1]
+    }
+
+
+@flaky(max_runs=10, min_passes=1)
+def test_get_valid_classifications_for_datasets_rejects_malformed_requests(test_app_client, logged_in_rdu_user):
+    response = test_app_client.post(
+        url_for("cms.get_valid_classifications_for_datasets"),
+        data=json.dumps({"datasets": ["White", "Other than White"]}),
+        content_type="application/json",
+    )
+
+    assert response.status_code == 400
+
+
 @flaky(max_runs=10, min_passes=1)
 def test_view_edit_measure_page_subtopic_dropdown_includes_testing_space_topic(test_app_client, logged_in_rdu_user):
     measure_version = MeasureVersionFactory(
@@ -631,6 +693,33 @@ def test_dept_user_should_be_able_to_edit_upload_on_shared_page(test_app_client,
     assert page.find("h1").string == "Edit source data"
 
 
+@flaky(max_runs=10, min_passes=1)
+def test_get_upload_classifications(test_app_client, logged_in_rdu_user):
+    ethnicity_classifications = {"ethnicity_column": "Ethnicity", "ethnicities": ["White"], "classifications": []}
+    measure_version = MeasureVersionFactory(
+        status="DRAFT", uploads__guid="classified", uploads__ethnicity_classifications=ethnicity_classifications
+    )
+    UploadFactory(guid="not-classified", measure_version=measure_version, ethnicity_classifications=None)
+
+    def get_classifications(upload_guid):
+        return test_app_client.get(
+            url_for(
+                "cms.get_upload_classifications",
+                topic_slug=measure_version.measure.subtopic.topic.slug,
+                subtopic_slug=measure_version.measure.subtopic.slug,
+                measure_slug=measure_version.measure.slug,
+                version=measure_version.version,
+                upload_guid=upload_guid,
+            )
+        )
+
+    response = get_classifications("classified")
+    assert response.status_code == 200
+    assert json.loads(response.data) == ethnicity_classifications
+
+    assert get_classifications("not-classified").status_code == 404
+
+
 @flaky(max_runs=10, min_passes=1)
 def test_dept_user_should_be_able_to_edit_shared_page(test_app_client, logged_in_dept_user):
     user_id = None
@@ -0,0 +1,155 @@
+from datetime import date, timedelta
+from unittest.mock import patch
+
+from slugify import slugify
+
+from application.dashboard import data_helpers
+from application.dashboard.data_helpers import (
+    get_all_ethnic_group_dashboard_data,
+    get_all_ethnicity_classification_dashboard_data,
+    get_all_geographic_breakdown_dashboard_data,
+    get_ethnic_group_by_slug_dashboard_data,
+    get_ethnic_groups_dashboard_data,
+    get_ethnicity_classification_by_id_dashboard_data,
+    get_ethnicity_classifications_dashboard_data,
+    get_geographic_breakdown_by_slug_dashboard_data,
+    get_geographic_breakdown_dashboard_data,
+    get_published_dashboard_data,
+)
+from tests.models import (
+    ClassificationFactory,
+    DataSourceFactory,
+    MeasureVersionFactory,
+    MeasureVersionWithDimensionFactory,
+)
+
+
+class TestGetPublishedDashboardData:
+    def test_publications_are_counted_by_week_since_the_first_publication(self, db_session):
+        this_week = date.today() - timedelta(days=date.today().weekday())
+        MeasureVersionFactory(status="APPROVED", version="1.1", published_at=this_week - timedelta(days=19))
+        publication = MeasureVersionFactory(
+            status="APPROVED", version="1.0", published_at=this_week - timedelta(days=14)
+        )
+        update = MeasureVersionFactory(status="APPROVED", version="2.0", published_at=this_week - timedelta(days=12))
+        later_publication = MeasureVersionFactory(
+            status="APPROVED", version="1.0", published_at=this_week - timedelta(days=1)
+        )
+        MeasureVersionFactory(status="DRAFT", version="1.0", published_at=None)
+
+        data = get_published_dashboard_data()
+
+        assert data["number_of_publications"] == 2
+        assert data["number_of_major_updates"] == 1
+        assert data["first_publication"] == this_week - timedelta(days=19)
+        assert [week["week"] for week in data["weeks"]] == [this_week - timedelta(weeks=i) for i in range(4)]
+        assert [[page.id for page in week["publications"]] for week in data["weeks"]] == [
+            [],
+            [later_publication.id],
+            [publication.id],
+            [],
+        ]
+        assert [[page.id for page in week["major_updates"]] for week in data["weeks"]] == [[], [], [update.id], []]
+        assert data["total_page_count_each_week"] == [0, 1, 2, 2]
+        assert data["total_major_updates_count_each_week"] == [0, 1, 1, 1]
+
+    def test_publications_are_listed_once_with_the_publisher_of_their_primary_data_source(self, db_session):
+        first_data_source, second_data_source = DataSourceFactory(), DataSourceFactory()
+        measure_version = MeasureVersionFactory(
+            status="APPROVED",
+            version="1.0",
+            measure__slug="measure",
+            measure__subtopics__slug="subtopic",
+            measure__subtopics__topic__slug="topic",
+            data_sources=[first_data_source, second_data_source],
+        )
+
+        (week,) = [week for week in get_published_dashboard_data()["weeks"] if week["publications"]]
+        (publication,) = week["publications"]
+
+        assert publication.title == measure_version.title
+        assert publication.published_at == measure_version.published_at
+        assert (publication.topic_slug, publication.subtopic_slug, publication.measure_slug) == (
+            "topic",
+            "subtopic",
+            "measure",
+        )
+        assert publication.publisher_name == first_data_source.publisher.name
+
+    def test_there_are_no_weeks_before_anything_is_published(self, db_session):
+        MeasureVersionFactory(status="DRAFT", published_at=None)
+
+        data = get_published_dashboard_data()
+
+        assert data["number_of_publications"] == 0
+        assert data["weeks"] == []
+        assert data["total_page_count_each_week"] == []
+
+
+class TestAllDashboardData:
+    @staticmethod
+    def _publish_measure_versions(number_of_measure_versions):
+        classifications = [ClassificationFactory(id="C0"), ClassificationFactory(id="C1")]
+        for i in range(number_of_measure_versions):
+            MeasureVersionWithDimensionFactory(
+                status="APPROVED",
+                version="1.0",
+                dimensions__classification_links__classification=classifications[i % 2],
+            )
+
+    def test_all_ethnic_group_dashboards_match_the_individual_dashboards(self, db_session, app):
+        self._publish_measure_versions(3)
+
+        with app.test_request_context():
+            ethnic_groups = get_ethnic_groups_dashboard_data()
+            all_dashboard_data = get_all_ethnic_group_dashboard_data()
+
+            assert set(all_dashboard_data) == {ethnic_group["value"] for ethnic_group in ethnic_groups} != set()
+            for ethnic_group in ethnic_groups:
+                _, page_count, nested_measures_and_dimensions = get_ethnic_group_by_slug_dashboard_data(
+                    slugify(ethnic_group["value"])
+                )
+                assert all_dashboard_data[ethnic_group["value"]] == (page_count, nested_measures_and_dimensions)
+
+    def test_all_classification_dashboards_match_the_individual_dashboards(self, db_session, app):
+        self._publish_measure_versions(3)
+
+        with app.test_request_context():
+            classifications = get_ethnicity_classifications_dashboard_data()
+            all_dashboard_data = get_all_ethnicity_classification_dashboard_data()
+
+            assert set(all_dashboard_data) == {classification["id"] for classification in classifications}
+            assert set(all_dashboard_data) == {"C0", "C1"}
+            for classification in classifications:
+                _, page_count, nested_measures_and_dimensions = get_ethnicity_classification_by_id_dashboard_data(
+                    classification["id"]
+                )
+                assert all_dashboard_data[classification["id"]] == (page_count, nested_measures_and_dimensions)
+
+    def test_all_geographic_breakdown_dashboards_match_the_individual_dashboards(self, db_session, app):
+        self._publish_measure_versions(3)
+
+        with app.test_request_context():
+            location_levels = get_geographic_breakdown_dashboard_data()
+            all_dashboard_data = get_all_geographic_breakdown_dashboard_data()
+
+            assert set(all_dashboard_data) == {location_level["name"] for location_level in location_levels} != set()
+            for location_level in location_levels:
+                (
+                    _,
+                    page_count,
+                    measure_titles_and_urls_by_topic_and_subtopic,
+                ) = get_geographic_breakdown_by_slug_dashboard_data(slugify(location_level["name"]))
+                assert all_dashboard_data[location_level["name"]] == (
+                    page_count,
+                    measure_titles_and_urls_by_topic_and_subtopic,
+                )
+
+    def test_each_measure_url_is_only_built_once(self, db_session, app):
+        self._publish_measure_versions(3)
+
+        with app.test_request_context(), patch.object(data_helpers, "url_for", wraps=data_helpers.url_for) as url_for:
+            all_dashboard_data = get_all_ethnic_group_dashboard_data()
+
+        assert sum(page_count for page_count, _ in all_dashboard_data.values()) >= 3
+        assert url_for.call_count == 3
@@ -0,0 +1,158 @@
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from application import db
+from application.dashboard.models import (
+    ClassificationByDimension,
+    EthnicGroupByDimension,
+    LatestPublishedMeasureVersionByGeography,
+)
+from application.dashboard.summary_tables import (
+    background_full_refresh,
+    count_dashboard_summary_differences,
+    refresh_dashboard_summaries,
+)
+from tests.models import MeasureVersionWithDimensionFactory, SubtopicFactory
+
+
+def _published_measure_version(**kwargs):
+    return MeasureVersionWithDimensionFactory(status="APPROVED", version="1.0", **kwargs)
+
+
+def _assert_summaries_are_up_to_date():
+    assert set(count_dashboard_summary_differences(db.session).values()) == {0}
+
+
+def test_publishing_a_measure_version_adds_it_to_the_summaries():
+    measure_version = _published_measure_version()
+    MeasureVersionWithDimensionFactory(status="DRAFT")
+
+    assert [row.measure_version_id for row in ClassificationByDimension.query.all()] == [measure_version.id]
+    assert [row.measure_version_id for row in LatestPublishedMeasureVersionByGeography.query.all()] == [
+        measure_version.id
+    ]
+    _assert_summaries_are_up_to_date()
+
+
+def test_unpublishing_a_measure_version_removes_it_from_the_summaries():
+    measure_version = _published_measure_version()
+
+    measure_version.status = "DRAFT"
+    db.session.commit()
+
+    assert ClassificationByDimension.query.all() == []
+    _assert_summaries_are_up_to_date()
+
+
+def test_changing_a_dimension_or_moving_a_measure_updates_only_that_measure():
+    measure_version = _published_measure_version()
+    other_measure_version = _published_measure_version()
+    new_subtopic = SubtopicFactory(title="New subtopic")
+
+    with patch(
+        "application.dashboard.summary_tables.refresh_dashboard_summaries", wraps=refresh_dashboard_summaries
+    ) as refresh_patch:
+        measure_version.dimensions[0].title = "New dimension title"
+        measure_version.dimensions[0].dimension_classification.includes_all = True
+        measure_version.measure.subtopics = [new_subtopic]
+        db.session.commit()
+
+    assert refresh_patch.call_args[0][1] == {measure_version.measure_id}
+    row = ClassificationByDimension.query.filter_by(measure_version_id=measure_version.id).one()
+    assert (row.dimension_title, row.includes_all, row.subtopic_title) == ("New dimension title", True, "New subtopic",)
+    assert ClassificationByDimension.query.filter_by(measure_version_id=other_measure_version.id).count() == 1
+    _assert_summaries_are_up_to_date()
+
+
+def test_renaming_a_classification_updates_the_measures_which_use_it():
+    measure_version = _published_measure_version()
+
+    measure_version.dimensions[0].dimension_classification.classification.title = "Renamed classification"
+    db.session.commit()
+
+    assert ClassificationByDimension.query.one().classification_title == "Renamed classification"
+    _assert_summaries_are_up_to_date()
+
+
+def test_rolled_back_changes_are_forgotten():
+    measure_version = _published_measure_version()
+
+    measure_version.dimensions[0].title = "Rolled back title"
+    db.session.flush()
+    db.session.rollback()
+
+    with patch("application.dashboard.summary_tables.refresh_dashboard_summaries") as refresh_patch:
+        db.session.commit()
+
+    refresh_patch.assert_not_called()
+    _assert_summaries_are_up_to_date()
+
+
+def test_differences_are_counted_and_repaired_by_a_full_refresh():
+    _published_measure_version()
+    db.session.execute(text("DELETE FROM classifications_by_dimension"))
+
+    assert count_dashboard_summary_differences(db.session)["classifications_by_dimension"] == 1
+
+    refresh_dashboard_summaries(db.session)
+    db.session.commit()
+
+    _assert_summaries_are_up_to_date()
+
+
+def test_renaming_an_ethnicity_refreshes_every_measure_after_the_commit():
+    measure_version = _published_measure_version()
+    ethnicity = measure_version.dimensions[0].dimension_classification.classification.ethnicities[0]
+    db.session.commit()
+
+    with patch.object(background_full_refresh, "request") as request_patch, patch(
+        "application.dashboard.summary_tables.refresh_dashboard_summaries", wraps=refresh_dashboard_summaries
+    ) as refresh_patch:
+        ethnicity.value = "Renamed ethnicity"
+        db.session.commit()
+
+    assert all(call[0][1] is not None for call in refresh_patch.call_args_list)
+    assert request_patch.call_count == 1
+    assert count_dashboard_summary_differences(db.session)["ethnic_groups_by_dimension"] > 0
+
+    db.session.commit()
+    background_full_refresh.request(db.engine).join(timeout=10)
+
+    assert "Renamed ethnicity" in {row.ethnicity_value for row in EthnicGroupByDimension.query.all()}
+    _assert_summaries_are_up_to_date()
+
+
+def test_concurrent_commits_only_wait_for_each_other_if_they_change_the_same_measure():
+    first_measure_version = _published_measure_version()
+    second_measure_version = _published_measure_version()
+    db.session.commit()
+
+    # A transaction which has refreshed the first measure, and hasn't committed yet
+    refresh_dashboard_summaries(db.session, {first_measure_version.measure_id})
+
+    other_session = Session(bind=db.engine)
+    try:
+        other_session.execute("SET lock_timeout = '100ms'")
+
+        refresh_dashboard_summaries(other_session, {second_measure_version.measure_id})
+        other_session.commit()
+
+        with pytest.raises(OperationalError):
+            refresh_dashboard_summaries(other_session, {first_measure_version.measure_id})
+        other_session.rollback()
+
+        with pytest.raises(OperationalError):
+            refresh_dashboard_summaries(other_session)
+        other_session.rollback()
+
+        db.session.commit()
+        refresh_dashboard_summaries(other_session, {first_measure_version.measure_id})
+        other_session.commit()
+    finally:
+        other_session.close()
+
+    _assert_summaries_are_up_to_date()
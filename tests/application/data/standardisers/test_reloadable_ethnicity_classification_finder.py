@@ -0,0 +1,75 @@
+import shutil
+from unittest.mock import Mock
+
+import pytest
+
+from application.data.standardisers.reloadable_ethnicity_classification_finder import (
+    ReloadableEthnicityClassificationFinder,
+)
+
+TEST_DATA_DIR = "tests/test_data/test_classification_finder"
+
+
+@pytest.fixture
+def finder_files(tmp_path):
+    standardiser_file = tmp_path / "lookup.csv"
+    classifications_file = tmp_path / "definitions.csv"
+    shutil.copy(f"{TEST_DATA_DIR}/classification_finder_lookup.csv", standardiser_file)
+    shutil.copy(f"{TEST_DATA_DIR}/classification_finder_definitions.csv", classifications_file)
+    return str(standardiser_file), str(classifications_file)
+
+
+def test_attributes_are_passed_through_to_the_current_finder(finder_files):
+    reloadable_finder = ReloadableEthnicityClassificationFinder(*finder_files)
+
+    assert reloadable_finder.standardiser is reloadable_finder.current().standardiser
+    assert reloadable_finder.find_classifications(["feline", "canine", "fish"])[0]["classification"]["name"] == (
+        "Fish and Mammals"
+    )
+
+
+def test_finder_is_not_reloaded_if_the_files_are_unchanged(finder_files):
+    reloadable_finder = ReloadableEthnicityClassificationFinder(*finder_files)
+
+    assert reloadable_finder.check_for_update() is None
+    assert reloadable_finder.version == 1
+
+
+def test_new_finder_is_swapped_in_when_the_files_change(finder_files):
+    on_reload = Mock()
+    reloadable_finder = ReloadableEthnicityClassificationFinder(*finder_files, on_reload=on_reload)
+    original_finder = reloadable_finder.current()
+
+    with open(finder_files[0], "a") as f:
+        f.write("moggy,Cat\n")
+    reloadable_finder.check_for_update().join()
+
+    assert reloadable_finder.version == 2
+    assert reloadable_finder.standardiser.standardise("moggy") == "Cat"
+    assert original_finder.standardiser.standardise("moggy") == "moggy"
+    on_reload.assert_called_once_with(reloadable_finder.current())
+    assert reloadable_finder.check_for_update() is None
+
+
+def test_current_finder_is_kept_if_the_new_files_cannot_be_loaded(finder_files):
+    reloadable_finder = ReloadableEthnicityClassificationFinder(*finder_files)
+    original_finder = reloadable_finder.current()
+
+    with open(finder_files[1], "a") as f:
+        f.write("broken row\n")
+    reloadable_finder.check_for_update().join()
+
+    assert reloadable_finder.current() is original_finder
+    assert reloadable_finder.version == 1
+
+
+def test_files_are_only_checked_for_changes_when_a_check_is_due(finder_files):
+    never_checks = ReloadableEthnicityClassificationFinder(*finder_files, check_interval_seconds=0)
+    checks_hourly = ReloadableEthnicityClassificationFinder(*finder_files, check_interval_seconds=3600)
+
+    with open(finder_files[0], "a") as f:
+        f.write("moggy,Cat\n")
+
+    assert never_checks.check_for_update_if_due() is None
+    assert checks_hourly.check_for_update_if_due() is None
+    assert checks_hourly.version == 1
@@ -4,13 +4,23 @@
     It is called from the /get-valid-classifications-for-data endpoint to do backend data calculations
 
 """
+import json
+import stat
+from unittest.mock import patch
+
+from application.data.standardisers import ethnicity_classification_finder_builder as finder_builder
 from application.data.standardisers.ethnicity_classification_finder_builder import (
+    ethnicity_classification_collection_from_data,
     ethnicity_classification_from_data,
     ethnicity_standardiser_from_data,
     ethnicity_classification_collection_from_classification_list,
     ethnicity_classification_finder_from_file,
 )
-from application.data.standardisers.ethnicity_classification_finder import EthnicityClassificationFinder
+from application.data.standardisers.ethnicity_classification_finder import (
+    EthnicityClassification,
+    EthnicityClassificationFinder,
+)
+from application.data.standardisers.ethnicity_lookup_index import StandardisationRule
 
 
 def test_standardiser_does_initialise_with_simple_values():
@@ -546,3 +556,322 @@ def test_classification_search_initialises_from_file():
         "parent": "Mammal",
         "order": "2",
     }
+
+
+def test_classification_index_finds_the_same_classifications_as_checking_each_classification():
+    # GIVEN
+    # the full classification library and a variety of data, some of which fits no classification
+    classification_finder = ethnicity_classification_finder_from_file(
+        "application/data/static/standardisers/classification_lookup.csv",
+        "application/data/static/standardisers/classification_definitions.csv",
+    )
+    standardiser = classification_finder.standardiser
+    classification_collection = classification_finder.get_classification_collection()
+    raw_value_lists = [
+        ["All", "Asian", "Black", "Mixed", "White", "Other"],
+        ["Asian", "Black", "Mixed", "White", "Other", "white", "Unknown"],
+        ["White British", "White other", "Indian", "Pakistani", "Bangladeshi", "Chinese", "Asian other", "Black"],
+        ["BAME", "White"],
+        ["White", "Not a real ethnicity"],
+        [],
+    ]
+
+    for raw_values in raw_value_lists:
+        # WHEN
+        # we find valid classifications with the index
+        valid_classifications = classification_collection.get_valid_classifications_with_fit_levels(
+            raw_values, standardiser
+        )
+
+        # THEN
+        # we get the same classifications, in the same order and with the same fit, as checking one at a time
+        standard_values = standardiser.standardise_all(raw_values)
+        expected = [
+            (classification, classification.get_data_fit_level(raw_values, standardiser))
+            for classification in classification_collection.get_classifications()
+            if classification.is_valid_for_standard_ethnicities(standard_values)
+        ]
+        expected.sort(key=lambda classification_and_fit_level: -classification_and_fit_level[1])
+        assert expected == valid_classifications
+
+
+def test_classification_index_is_rebuilt_when_a_classification_is_added():
+    # GIVEN
+    # a collection which has already been searched
+    classification_collection = ethnicity_classification_collection_from_classification_list(
+        [ethnicity_classification_with_required_fish_cat_and_dog_data()]
+    )
+    standardiser = pet_standardiser()
+    raw_values = ["Cat", "Dog", "Fish", "Mammal"]
+    assert 1 == len(classification_collection.get_valid_classifications(raw_values, standardiser))
+
+    # WHEN
+    # we add another classification which fits the data
+    classification_collection.add_classification(ethnicity_classification_with_required_fish_and_mammal_data())
+
+    # THEN
+    # it is found too
+    assert 2 == len(classification_collection.get_valid_classifications(raw_values, standardiser))
+
+
+def test_classification_finder_finds_classifications_for_many_datasets_at_once():
+    # GIVEN
+    # a classification finder and several datasets, two of them identical
+    standardiser = pet_standardiser()
+    classification_collection = ethnicity_classification_collection_from_classification_list(
+        [
+            ethnicity_classification_with_required_fish_and_mammal_data(),
+            ethnicity_classification_with_required_fish_cat_and_dog_data(),
+        ]
+    )
+    classification_finder = EthnicityClassificationFinder(standardiser, classification_collection)
+    datasets = [["Cat", "Dog", "Fish"], ["feline", "canine", "fish", "mammal"], ["Cat", "Dog", "Fish"], []]
+
+    # WHEN
+    # we search with all of them in one go
+    with patch.object(standardiser, "standardise", wraps=standardiser.standardise) as standardise_patch:
+        search_outputs = classification_finder.find_classifications_for_datasets(datasets)
+
+    # THEN
+    # we get the same output as searching one at a time, having standardised each distinct value once
+    assert search_outputs == [classification_finder.find_classifications(dataset) for dataset in datasets]
+    assert standardise_patch.call_count == 7
+
+
+def test_classification_finder_json_output_matches_find_classifications():
+    # GIVEN
+    # a classification finder
+    standardiser = pet_standardiser()
+    classification_collection = ethnicity_classification_collection_from_classification_list(
+        [
+            ethnicity_classification_with_required_fish_and_mammal_data(),
+            ethnicity_classification_with_required_fish_cat_and_dog_data(),
+        ]
+    )
+    classification_finder = EthnicityClassificationFinder(standardiser, classification_collection)
+    raw_values = ["feline", "Dog", "fish", "Mammal", "mammal "]
+
+    # WHEN
+    # we ask for the output as JSON, in full and in compact form
+    full_output = json.loads(classification_finder.find_classifications_as_json(raw_values))
+    compact_output = json.loads(classification_finder.find_classifications_as_json(raw_values, compact=True))
+
+    # THEN
+    # the full output is the same as find_classifications
+    expected = classification_finder.find_classifications(raw_values)
+    assert full_output == {"classifications": expected}
+
+    # and the compact output refers to each classification definition by id, apart from the custom classification
+    assert compact_output["classifications"][-1] == expected[-1]
+    assert compact_output["definitions"] == {
+        output["classification"]["id"]: output["classification"] for output in expected[:-1]
+    }
+    assert [output["classification_id"] for output in compact_output["classifications"][:-1]] == ["Code3", "Code2"]
+    assert [output["data"] for output in compact_output["classifications"]] == [output["data"] for output in expected]
+
+
+def test_custom_classification_output_treats_values_differing_by_case_as_the_same_standard_value():
+    # WHEN
+    # we get the custom classification output for values which only differ by case and white space
+    custom_output = EthnicityClassification.get_custom_data_outputs(["Cat", "cat ", "Dog"])
+
+    # THEN
+    # each value gets its own item, but they map to the last of the values
+    assert list(custom_output["classification"]["map"]) == ["Cat", "cat ", "Dog"]
+    assert [(row["raw_value"], row["standard_value"], row["order"]) for row in custom_output["data"]] == [
+        ("Cat", "cat ", 1),
+        ("cat ", "cat ", 1),
+        ("Dog", "Dog", 2),
+    ]
+
+
+def test_custom_classification_output_has_a_row_for_every_repeated_value():
+    # WHEN
+    # we get the custom classification output for values which are repeated
+    custom_output = EthnicityClassification.get_custom_data_outputs(["cat ", "Dog", "Cat", "Dog", "cat "])
+
+    # THEN
+    # each distinct value gets one item, every row is output, and values map to the last to appear of their variants
+    assert list(custom_output["classification"]["map"]) == ["cat ", "Dog", "Cat"]
+    assert [(row["raw_value"], row["standard_value"], row["order"]) for row in custom_output["data"]] == [
+        ("cat ", "cat ", 0),
+        ("Dog", "Dog", 1),
+        ("Cat", "cat ", 0),
+        ("Dog", "Dog", 1),
+        ("cat ", "cat ", 0),
+    ]
+
+    # and rows for the same value can be changed independently
+    assert custom_output["data"][1] is not custom_output["data"][3]
+
+
+def test_standardiser_resolves_variants_of_values_in_the_lookup():
+    # GIVEN
+    # a standardiser with some multi-word values
+    standardiser = ethnicity_standardiser_from_data(
+        [
+            ["white british", "White British"],
+            ["mixed: white & asian", "Mixed White/Asian"],
+            ["pakistani/bangladeshi", "Pakistani and Bangladeshi"],
+        ]
+    )
+
+    # WHEN
+    # we resolve variants in punctuation, word order and spelling
+    # THEN
+    # we get the standard value, and the rule which matched it
+    assert standardiser.resolve("White British") == ("White British", StandardisationRule.EXACT)
+    assert standardiser.resolve("Mixed:  White and Asian") == ("Mixed White/Asian", StandardisationRule.NORMALISED)
+    assert standardiser.resolve("Mixed – White & Asian") == (
+        "Mixed White/Asian",
+        StandardisationRule.PUNCTUATION_FOLDED,
+    )
+    assert standardiser.resolve("Pakistani / Bangladeshi") == (
+        "Pakistani and Bangladeshi",
+        StandardisationRule.NORMALISED,
+    )
+    assert standardiser.resolve("Pakistani-Bangladeshi") == (
+        "Pakistani and Bangladeshi",
+        StandardisationRule.PUNCTUATION_FOLDED,
+    )
+    assert standardiser.resolve("British, White") == ("White British", StandardisationRule.TOKEN_SORTED)
+    assert standardiser.resolve("White Britsh") == ("White British", StandardisationRule.EDIT_DISTANCE)
+    assert standardiser.standardise("White Brazilian") == "White Brazilian"
+
+
+def test_standardiser_does_not_resolve_variants_which_could_be_more_than_one_value():
+    # GIVEN
+    # a standardiser where values which differ only in punctuation map to different standard values
+    standardiser = ethnicity_standardiser_from_data(
+        [["mixed / multiple ethnic groups", "Mixed"], ["mixed/ multiple ethnic groups", "Mixed other"]]
+    )
+
+    # WHEN
+    # we standardise a variant of them both
+    resolved = standardiser.resolve("Mixed/multiple ethnic groups")
+
+    # THEN
+    # the value is left as it is
+    assert resolved == ("Mixed/multiple ethnic groups", None)
+
+
+def test_standardiser_forgets_resolved_values_when_the_lookup_changes():
+    # GIVEN
+    # a standardiser which has already resolved a value by edit distance
+    standardiser = ethnicity_standardiser_from_data([["bangladeshi", "Bangladeshi"]])
+    assert standardiser.standardise("Bangladeshis") == "Bangladeshi"
+
+    # WHEN
+    # the value is added to the lookup
+    standardiser.add_conversion("Bangladeshis", "Other")
+
+    # THEN
+    # the new lookup is used
+    assert standardiser.resolve("Bangladeshis") == ("Other", StandardisationRule.EXACT)
+
+
+def test_classification_collection_from_data_groups_rows_by_classification_id():
+    # GIVEN
+    # classification file rows for two classifications, mixed together
+    rows = [
+        ["A", "A short", "A long", "Cat", "Cat", "Cat", "1", "TRUE"],
+        ["B", "B short", "B long", "Fish", "Fish", "Fish", "1", "TRUE"],
+        ["A", "A short", "A long", "Dog", "Dog", "Dog", "2", "FALSE"],
+    ]
+
+    # WHEN
+    # we build a classification collection from them
+    classification_collection = ethnicity_classification_collection_from_data(rows)
+
+    # THEN
+    # each classification has all of its own rows, in the order they first appear
+    assert [classification.get_id() for classification in classification_collection.get_classifications()] == [
+        "A",
+        "B",
+    ]
+    assert sorted(classification_collection.get_classification_by_id("A").get_display_values()) == ["Cat", "Dog"]
+    assert classification_collection.get_classification_by_id("B").get_display_values() == ["Fish"]
+
+
+def test_classification_finder_snapshot_is_reused_until_the_source_files_change(tmp_path):
+    # GIVEN
+    # copies of the pets data in .csv form, and somewhere to save snapshots
+    standardiser_file = tmp_path / "lookup.csv"
+    classifications_file = tmp_path / "definitions.csv"
+    snapshot_dir = tmp_path / "snapshots"
+    standardiser_file.write_text(
+        open("tests/test_data/test_classification_finder/classification_finder_lookup.csv").read()
+    )
+    classifications_file.write_text(
+        open("tests/test_data/test_classification_finder/classification_finder_definitions.csv").read()
+    )
+
+    with patch.dict(finder_builder._loaded_finders, clear=True):
+        # WHEN
+        # a finder is loaded by one process, then another
+        first_finder = ethnicity_classification_finder_from_file(standardiser_file, classifications_file, snapshot_dir)
+        finder_builder._loaded_finders.clear()
+        with patch.object(finder_builder, "ethnicity_standardiser_from_file") as load_patch:
+            second_finder = ethnicity_classification_finder_from_file(
+                standardiser_file, classifications_file, snapshot_dir
+            )
+
+        # THEN
+        # the second is loaded from the first one's snapshot, and finds the same classifications
+        assert load_patch.call_count == 0
+        assert second_finder is not first_finder
+        assert second_finder.find_classifications(["feline", "canine", "fish"]) == first_finder.find_classifications(
+            ["feline", "canine", "fish"]
+        )
+
+        # WHEN
+        # the lookup file changes
+        with open(standardiser_file, "a") as f:
+            f.write("moggy,Cat\n")
+        third_finder = ethnicity_classification_finder_from_file(standardiser_file, classifications_file, snapshot_dir)
+
+        # THEN
+        # the finder is loaded from the files again
+        assert third_finder.standardiser.standardise("moggy") == "Cat"
+        assert len(list(snapshot_dir.iterdir())) == 2
+
+
+def test_classification_finder_snapshot_is_ignored_if_other_users_could_have_written_it(tmp_path):
+    # GIVEN
+    # a snapshot saved to a directory which anyone can write to
+    standardiser_file = "tests/test_data/test_classification_finder/classification_finder_lookup.csv"
+    classifications_file = "tests/test_data/test_classification_finder/classification_finder_definitions.csv"
+    snapshot_dir = tmp_path / "snapshots"
+
+    with patch.dict(finder_builder._loaded_finders, clear=True):
+        ethnicity_classification_finder_from_file(standardiser_file, classifications_file, snapshot_dir)
+        assert stat.S_IMODE(snapshot_dir.stat().st_mode) == 0o700
+        snapshot_dir.chmod(0o777)
+        finder_builder._loaded_finders.clear()
+
+        # WHEN
+        # another process loads the finder
+        with patch.object(
+            finder_builder, "ethnicity_standardiser_from_file", wraps=finder_builder.ethnicity_standardiser_from_file
+        ) as load_patch:
+            ethnicity_classification_finder_from_file(standardiser_file, classifications_file, snapshot_dir)
+
+        # THEN
+        # it's loaded from the files, rather than unpickled from the snapshot
+        assert load_patch.call_count == 1
+
+
+def test_only_the_latest_classification_finder_is_kept_in_memory(tmp_path):
+    standardiser_file = tmp_path / "lookup.csv"
+    classifications_file = "tests/test_data/test_classification_finder/classification_finder_definitions.csv"
+    standardiser_file.write_text(
+        open("tests/test_data/test_classification_finder/classification_finder_lookup.csv").read()
+    )
+
+    with patch.dict(finder_builder._loaded_finders, clear=True):
+        ethnicity_classification_finder_from_file(standardiser_file, classifications_file)
+        with open(standardiser_file, "a") as f:
+            f.write("moggy,Cat\n")
+        latest_finder = ethnicity_classification_finder_from_file(standardiser_file, classifications_file)
+
+        assert list(finder_builder._loaded_finders.values()) == [latest_finder]
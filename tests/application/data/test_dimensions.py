@@ -1,7 +1,10 @@
+import os
+from unittest.mock import patch
+
 from flask import url_for
 
-from application.data.dimensions import DimensionObjectBuilder
-from application.utils import write_dimension_csv
+from application.data.dimensions import DimensionCsvCache, DimensionObjectBuilder
+from application.utils import write_dimension_csv, write_dimension_tabular_csv
 from application.cms.models import UKCountry
 from tests.models import MeasureVersionWithDimensionFactory, ClassificationFactory, DataSourceFactory
 from tests.test_data.chart_and_table import simple_table, grouped_table
@@ -233,3 +236,98 @@ def test_if_dimension_has_chart_and_table_download_table_source_data(logged_in_r
     # from the data in the table (not chart)
     actual_data = resp.data.decode("utf-8")
     assert actual_data == expected_csv
+
+
+def test_dimension_csv_cache_generates_the_same_csvs_as_the_dimension_object_builder(tmp_path):
+    measure_version = MeasureVersionWithDimensionFactory(dimensions__dimension_table__table_object=simple_table())
+    dimension = measure_version.dimensions[0]
+    dimension_object = DimensionObjectBuilder.build(dimension)
+
+    csv_cache = DimensionCsvCache(str(tmp_path))
+
+    assert csv_cache.get_csv(dimension) == write_dimension_csv(dimension=dimension_object)
+    assert csv_cache.get_tabular_csv(dimension) == write_dimension_tabular_csv(dimension=dimension_object)
+    assert len(os.listdir(str(tmp_path))) == 2
+
+
+def test_dimension_csv_cache_reuses_csvs_for_dimensions_with_the_same_chart_and_table(tmp_path):
+    first_dimension = MeasureVersionWithDimensionFactory(
+        dimensions__dimension_table__table_object=simple_table()
+    ).dimensions[0]
+    second_dimension = MeasureVersionWithDimensionFactory(
+        dimensions__dimension_table__table_object=simple_table()
+    ).dimensions[0]
+
+    csv_cache = DimensionCsvCache(str(tmp_path))
+    expected_csv = csv_cache.get_csv(first_dimension)
+
+    with patch("application.data.dimensions.DimensionObjectBuilder.build") as build_patch:
+        assert csv_cache.get_csv(second_dimension) == expected_csv
+
+    build_patch.assert_not_called()
+
+
+def test_dimension_csv_cache_regenerates_csvs_when_the_table_changes(tmp_path):
+    measure_version = MeasureVersionWithDimensionFactory(dimensions__dimension_table__table_object=simple_table())
+    dimension = measure_version.dimensions[0]
+    csv_cache = DimensionCsvCache(str(tmp_path))
+    original_csv = csv_cache.get_csv(dimension)
+
+    dimension.dimension_table.table_object = grouped_table()
+
+    assert csv_cache.get_csv(dimension) != original_csv
+    assert csv_cache.get_csv(dimension) == write_dimension_csv(dimension=DimensionObjectBuilder.build(dimension))
+
+
+def test_dimension_csv_cache_removes_the_least_recently_used_csvs_when_it_is_full(tmp_path):
+    dimensions = [
+        MeasureVersionWithDimensionFactory(dimensions__dimension_table__table_object=table).dimensions[0]
+        for table in (simple_table(), grouped_table())
+    ]
+    csv_cache = DimensionCsvCache(str(tmp_path))
+    first_csv, second_csv = [csv_cache.get_csv(dimension) for dimension in dimensions]
+    first_path, second_path = [
+        tmp_path / f"{DimensionCsvCache.cache_key('data', dimension)}.csv" for dimension in dimensions
+    ]
+    os.utime(str(first_path), (1, 1))
+    os.utime(str(second_path), (2, 2))
+    csv_cache.get_csv(dimensions[0])
+
+    csv_cache.max_bytes = len(first_csv.encode("utf-8"))
+    csv_cache.prune()
+
+    assert first_path.exists()
+    assert not second_path.exists()
+
+
+def test_dimension_csv_cache_is_not_used_if_other_users_could_write_to_it(tmp_path):
+    dimension = MeasureVersionWithDimensionFactory(dimensions__dimension_table__table_object=simple_table()).dimensions[
+        0
+    ]
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir(mode=0o777)
+    cache_dir.chmod(0o777)
+    planted_path = cache_dir / f"{DimensionCsvCache.cache_key('data', dimension)}.csv"
+    planted_path.write_text("planted")
+
+    assert DimensionCsvCache(str(cache_dir)).get_csv(dimension) == write_dimension_csv(
+        dimension=DimensionObjectBuilder.build(dimension)
+    )
+    assert planted_path.read_text() == "planted"
+
+
+def test_dimension_csv_cache_replaces_entries_other_users_could_have_written(tmp_path):
+    dimension = MeasureVersionWithDimensionFactory(dimensions__dimension_table__table_object=simple_table()).dimensions[
+        0
+    ]
+    cache_dir = tmp_path / "cache"
+    csv_cache = DimensionCsvCache(str(cache_dir))
+    expected_csv = csv_cache.get_csv(dimension)
+    assert oct(cache_dir.stat().st_mode & 0o777) == oct(0o700)
+
+    cached_path = cache_dir / f"{DimensionCsvCache.cache_key('data', dimension)}.csv"
+    cached_path.write_text("planted")
+    cached_path.chmod(0o666)
+
+    assert csv_cache.get_csv(dimension) == expected_csv
+    assert cached_path.read_bytes().decode("utf-8") == expected_csv
@@ -1,10 +1,18 @@
+import pytest
+
 from application.cms.classification_service import ClassificationWithIncludesParentsAllUnknown
+from application.cms.exceptions import ClassificationFinderClassificationNotFoundException
+from application.data.standardisers.ethnicity_classification_finder import EthnicityClassificationFinder
 from application.data.standardisers.ethnicity_classification_finder_builder import (
     ethnicity_standardiser_from_data,
     ethnicity_classification_from_data,
     ethnicity_classification_collection_from_classification_list,
 )
-from application.data.ethnicity_classification_matcher import EthnicityClassificationMatcher
+from application.data.ethnicity_classification_matcher import (
+    BuilderClassification,
+    EthnicityClassificationMatcher,
+    get_classification_matcher,
+)
 
 """
 EthnicityClassificationMatcher utilises several of the most complicated systems in rd-cms
@@ -213,3 +221,37 @@ def test_build_classification_does_not_have_parents_if_the_classification_does_n
     assert database_link.includes_all is False
     assert database_link.includes_parents is False
     assert database_link.includes_unknown is False
+
+
+def test_get_classification_matcher_reuses_the_matcher_for_the_same_finder():
+    finder = EthnicityClassificationFinder(build_external_standardiser(), build_external_classification_collection())
+    other_finder = EthnicityClassificationFinder(
+        build_external_standardiser(), build_external_classification_collection()
+    )
+
+    matcher = get_classification_matcher(finder)
+
+    assert get_classification_matcher(finder) is matcher
+    assert get_classification_matcher(other_finder) is not matcher
+    assert get_classification_matcher(other_finder).ethnicity_classification_collection is (
+        other_finder.classification_collection
+    )
+
+
+def test_build_classification_has_parents_gives_the_same_answer_when_reused(two_classifications_2A_5A):
+    builder = get_test_builder()
+
+    for _ in range(2):
+        assert builder.get_classification_from_builder_values(
+            "5A+", ["BAME", "Asian", "Black", "Mixed", "White", "Other"]
+        ).includes_parents
+        assert not builder.get_classification_from_builder_values(
+            "5A+", ["Asian", "Black", "Mixed", "Other"]
+        ).includes_parents
+
+
+def test_build_classification_raises_if_classification_is_not_in_the_database(two_classifications_2A_5A):
+    builder = get_test_builder()
+
+    with pytest.raises(ClassificationFinderClassificationNotFoundException):
+        builder.convert_builder_classification_to_classification(BuilderClassification("3A", False, False, False))
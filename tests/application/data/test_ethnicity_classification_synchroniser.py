@@ -1,5 +1,15 @@
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from application import db
 from application.cms.classification_service import ClassificationService
-from application.data.ethnicity_classification_synchroniser import EthnicityClassificationSynchroniser
+from application.data.ethnicity_classification_synchroniser import (
+    CLASSIFICATION_SYNCHRONISATION_LOCK_ID,
+    EthnicityClassificationSynchroniser,
+)
+from application.sitebuilder.instrumentation import count_queries
 from application.data.standardisers.ethnicity_classification_finder_builder import (
     ethnicity_classification_from_data,
     ethnicity_classification_collection_from_classification_list,
@@ -60,6 +70,18 @@ def get_5A_plus():
     return ethnicity_classification_from_data(id=id, name=name, data_rows=classification_rows)
 
 
+def get_3A():
+    id = "3A"
+    name = "White, BAME and its parts"
+    classification_rows = [
+        ["BAME", "BAME", "BAME", 1, False],
+        ["Asian", "Asian", "BAME", 1, True],
+        ["Other", "Other", "BAME", 1, True],
+        ["White", "White", "White", 2, True],
+    ]
+    return ethnicity_classification_from_data(id=id, name=name, data_rows=classification_rows)
+
+
 def reset_test_synchroniser():
     for classification in internal_classification_service.get_all_classifications():
         internal_classification_service.delete_classification(classification)
@@ -110,3 +132,105 @@ def test_synchronise_saves_overwrites_internal_classification_name():
     # then the internal classification now has the new expected name
     classification_2a = internal_classification_service.get_classification_by_id("2A")
     assert classification_2a.title == "test example"
+
+
+def test_synchronise_links_values_and_parent_values_to_shared_ethnicities():
+    synchroniser = reset_test_synchroniser()
+
+    classification_collection = ethnicity_classification_collection_from_classification_list([get_2A(), get_3A()])
+    report = synchroniser.synchronise_classifications(classification_collection)
+
+    classification_2a = internal_classification_service.get_classification_by_id("2A")
+    classification_3a = internal_classification_service.get_classification_by_id("3A")
+    assert sorted(ethnicity.value for ethnicity in classification_2a.ethnicities) == ["Other", "White"]
+    assert classification_2a.parent_values == []
+    assert sorted(ethnicity.value for ethnicity in classification_3a.ethnicities) == ["Asian", "BAME", "Other", "White"]
+    assert sorted(ethnicity.value for ethnicity in classification_3a.parent_values) == ["BAME", "White"]
+
+    # "White" and "Other" are in both classifications but only created once
+    assert sorted(report.classifications_created) == ["2A", "3A"]
+    assert report.ethnicities_created == ["Asian", "BAME", "Other", "White"]
+    assert report.ethnicity_links_created == 6
+    assert report.parent_links_created == 2
+
+
+def test_synchronise_reports_only_what_has_changed():
+    synchroniser = reset_test_synchroniser()
+    synchroniser.synchronise_classifications(ethnicity_classification_collection_from_classification_list([get_2A()]))
+
+    report = synchroniser.synchronise_classifications(
+        ethnicity_classification_collection_from_classification_list([get_2A()])
+    )
+    assert str(report) == (
+        "0 classifications created, 0 updated, 0 ethnicities created, 0 ethnicity links and 0 parent links created"
+    )
+
+    report = synchroniser.synchronise_classifications(
+        ethnicity_classification_collection_from_classification_list([get_2A_named_test_example()])
+    )
+    assert report.classifications_updated == ["2A"]
+    assert report.ethnicities_created == []
+
+
+def test_synchronise_query_count_does_not_grow_with_the_number_of_classifications():
+    synchroniser = reset_test_synchroniser()
+    with count_queries() as query_count_for_one:
+        synchroniser.synchronise_classifications(
+            ethnicity_classification_collection_from_classification_list([get_3A()])
+        )
+
+    synchroniser = reset_test_synchroniser()
+    with count_queries() as query_count_for_two:
+        synchroniser.synchronise_classifications(
+            ethnicity_classification_collection_from_classification_list([get_2A(), get_3A(), get_5A_plus()])
+        )
+
+    assert query_count_for_one.total == query_count_for_two.total
+
+
+def test_synchronise_writes_nothing_if_any_part_fails():
+    synchroniser = reset_test_synchroniser()
+    classification_collection = ethnicity_classification_collection_from_classification_list([get_2A()])
+
+    with patch(
+        "application.data.ethnicity_classification_synchroniser.parent_association_table.insert",
+        side_effect=RuntimeError("Failed to link parent values"),
+    ), pytest.raises(RuntimeError):
+        synchroniser.synchronise_classifications(
+            ethnicity_classification_collection_from_classification_list([get_3A()])
+        )
+
+    assert internal_classification_service.get_all_classifications() == []
+
+    synchroniser.synchronise_classifications(classification_collection)
+    assert len(internal_classification_service.get_all_classifications()) == 1
+
+
+def test_synchronise_waits_for_a_synchronisation_already_running():
+    synchroniser = reset_test_synchroniser()
+    classification_collection = ethnicity_classification_collection_from_classification_list([get_2A()])
+
+    with db.engine.connect() as other_connection:
+        with other_connection.begin():
+            other_connection.execute("SELECT pg_advisory_xact_lock(%s)", CLASSIFICATION_SYNCHRONISATION_LOCK_ID)
+
+            db.session.execute("SET LOCAL lock_timeout = '100ms'")
+            with pytest.raises(OperationalError):
+                synchroniser.synchronise_classifications(classification_collection)
+
+    assert internal_classification_service.get_all_classifications() == []
+
+
+def test_synchronise_can_leave_it_to_a_synchronisation_already_running():
+    synchroniser = reset_test_synchroniser()
+    classification_collection = ethnicity_classification_collection_from_classification_list([get_2A()])
+
+    with db.engine.connect() as other_connection:
+        with other_connection.begin():
+            other_connection.execute("SELECT pg_advisory_xact_lock(%s)", CLASSIFICATION_SYNCHRONISATION_LOCK_ID)
+
+            assert synchroniser.synchronise_classifications(classification_collection, wait_for_lock=False) is None
+
+    assert internal_classification_service.get_all_classifications() == []
+    assert synchroniser.synchronise_classifications(classification_collection, wait_for_lock=False) is not None
+    assert len(internal_classification_service.get_all_classifications()) == 1
@@ -0,0 +1,94 @@
+from unittest.mock import Mock
+
+import pytest
+
+from application.data.ethnicity_data_set import ColumnarEthnicityDataset, EthnicityDataset, read_unique_ethnicities
+from application.data.standardisers.ethnicity_classification_finder import EthnicityStandardiser
+
+DATA = [
+    ["Measure", "Ethnicity", "Ethnicity type", "Value"],
+    ["Employment", "White British", "ONS 2011 18+1", "74"],
+    ["Employment", "Indian", "ONS 2011 18+1", "70"],
+    ["Employment", "white british", "ONS 2011 18+1", "71"],
+    ["Employment", "Indian", "ONS 2011 18+1", "69"],
+]
+
+
+def get_standardiser():
+    return EthnicityStandardiser({"white british": "White British", "indian": "Indian"})
+
+
+def test_read_unique_ethnicities_lists_each_ethnicity_once_in_the_order_they_appear():
+    assert read_unique_ethnicities(iter(DATA)) == ("Ethnicity", ["White British", "Indian", "white british"])
+
+
+def test_read_unique_ethnicities_matches_the_row_dataset():
+    row_dataset = EthnicityDataset([list(row) for row in DATA])
+
+    _, unique_ethnicities = read_unique_ethnicities(iter(DATA))
+
+    assert set(unique_ethnicities) == row_dataset.get_unique_ethnicities() - {"Ethnicity"}
+
+
+def test_read_unique_ethnicities_skips_rows_without_an_ethnicity():
+    rows = [["Value", "Ethnicity"], ["70", "Indian"], ["71"], []]
+
+    assert read_unique_ethnicities(rows) == ("Ethnicity", ["Indian"])
+
+
+def test_read_unique_ethnicities_without_an_ethnicity_column():
+    assert read_unique_ethnicities([["Measure", "Value"], ["Employment", "74"]]) == (None, [])
+    assert read_unique_ethnicities([]) == (None, [])
+
+
+def test_columnar_dataset_matches_row_dataset():
+    row_dataset = EthnicityDataset([list(row) for row in DATA])
+    columnar_dataset = ColumnarEthnicityDataset.from_rows(iter(DATA))
+
+    assert len(columnar_dataset) == len(row_dataset) == 4
+    assert columnar_dataset.get_headers() == row_dataset.get_headers()
+    assert columnar_dataset.get_data() == row_dataset.get_data()
+    for row in range(len(row_dataset)):
+        assert columnar_dataset.get_ethnicity(row) == row_dataset.get_ethnicity(row)
+        assert columnar_dataset.get_ethnicity_type(row) == row_dataset.get_ethnicity_type(row)
+
+
+def test_columnar_dataset_stores_each_distinct_ethnicity_once():
+    dataset = ColumnarEthnicityDataset.from_rows(DATA)
+
+    assert dataset.ethnicity_categories == ["White British", "Indian", "white british"]
+    assert list(dataset.ethnicity_codes) == [0, 1, 2, 1]
+    assert dataset.get_unique_ethnicities() == {"White British", "Indian", "white british"}
+    assert dataset.get_ethnicity_categories_by_last_appearance() == ["White British", "white british", "Indian"]
+
+
+def test_columnar_dataset_standardises_each_distinct_ethnicity_once():
+    dataset = ColumnarEthnicityDataset.from_rows(DATA)
+    standardiser = Mock(wraps=get_standardiser())
+
+    dataset.append_standardised_ethnicity_column(standardiser)
+
+    standardiser.standardise_all.assert_called_once_with(["White British", "Indian", "white british"])
+    assert dataset.get_headers()[-1] == "Standardised ethnicity"
+    assert [row[-1] for row in dataset.get_data()[1:]] == ["White British", "Indian", "White British", "Indian"]
+
+
+def test_columnar_dataset_pads_short_rows_and_drops_values_without_a_header():
+    dataset = ColumnarEthnicityDataset.from_rows([["Ethnicity", "Value"], ["Indian"], ["White", "70", "extra"]])
+
+    assert dataset.get_data() == [["Ethnicity", "Value"], ["Indian", ""], ["White", "70"]]
+
+
+def test_columnar_dataset_with_no_rows():
+    dataset = ColumnarEthnicityDataset.from_rows([["Ethnicity", "Value"]])
+
+    assert len(dataset) == 0
+    assert dataset.get_unique_ethnicities() == set()
+    assert dataset.get_data() == [["Ethnicity", "Value"]]
+
+
+def test_columnar_dataset_rejects_a_column_of_the_wrong_length():
+    dataset = ColumnarEthnicityDataset.from_rows(DATA)
+
+    with pytest.raises(ValueError):
+        dataset.append_column("Rank", [1, 2])
@@ -125,7 +125,7 @@ def test_dept_users_can_only_generate_new_review_tokens_for_shared_measures(test
 
 
 def test_page_main_download_available_without_login(
-    test_app_client, mock_get_measure_download, mock_get_csv_data_for_download
+    test_app_client, mock_open_measure_download, mock_iter_csv_data_for_download
 ):
     measure_version = MeasureVersionFactory(
         status="DEPARTMENT_REVIEW", uploads__title="test file", uploads__file_name="test-file.csv"
@@ -142,12 +142,12 @@ def test_page_main_download_available_without_login(
         )
     )
 
-    mock_get_measure_download.assert_called_with(measure_version.uploads[0], "test-file.csv", "source")
-    mock_get_csv_data_for_download.assert_called_with("test-file.csv")
+    mock_open_measure_download.assert_called_with(measure_version.uploads[0], "test-file.csv", "source")
+    mock_iter_csv_data_for_download.assert_called_with(mock_open_measure_download.return_value)
 
     assert resp.status_code == 200
     assert resp.content_type == "text/csv; charset=utf-8"
-    assert resp.headers["Content-Disposition"] == "attachment; filename=test-file.csv"
+    assert resp.headers["Content-Disposition"] == 'attachment; filename="test-file.csv"'
 
 
 def test_page_dimension_download_available_without_login(test_app_client):
@@ -0,0 +1,242 @@
+import os
+from datetime import datetime, timedelta
+
+from unittest.mock import patch
+
+import pytest
+
+from application import db
+from application.cms.page_service import page_service
+from application.sitebuilder.build import (
+    _write_measure_versions_in_worker,
+    build_homepage_and_topic_hierarchy,
+    create_versioned_assets,
+    get_incremental_build_cutoff,
+    sync_directory,
+    write_measure_pages,
+)
+from application.sitebuilder.instrumentation import count_queries
+from application.sitebuilder.build_service import request_build
+from application.sitebuilder.models import BuildStatus
+from tests.test_data.chart_and_table import chart, simple_table
+from tests.models import MeasureVersionFactory, MeasureVersionWithDimensionFactory
+
+
+def _successful_build(db_session, created_at):
+    build = request_build()
+    build.created_at = created_at
+    build.status = BuildStatus.DONE
+    build.succeeded_at = created_at + timedelta(minutes=5)
+    db_session.session.commit()
+    return build
+
+
+class TestIncrementalBuild:
+    def test_cutoff_is_none_if_incremental_builds_are_disabled(self, db_session, app):
+        _successful_build(db_session, datetime.utcnow() - timedelta(days=1))
+
+        with patch.dict(app.config, {"INCREMENTAL_BUILD": False}):
+            assert get_incremental_build_cutoff(app, request_build()) is None
+
+    def test_cutoff_is_none_if_there_has_never_been_a_successful_build(self, db_session, app):
+        with patch.dict(app.config, {"INCREMENTAL_BUILD": True}):
+            assert get_incremental_build_cutoff(app, request_build()) is None
+
+    def test_cutoff_is_none_if_a_full_rebuild_was_requested(self, db_session, app):
+        _successful_build(db_session, datetime.utcnow() - timedelta(days=1))
+
+        with patch.dict(app.config, {"INCREMENTAL_BUILD": True}):
+            assert get_incremental_build_cutoff(app, request_build(full_rebuild=True)) is None
+
+    def test_cutoff_is_creation_time_of_last_successful_build(self, db_session, app):
+        two_days_ago = datetime.utcnow() - timedelta(days=2)
+        one_day_ago = datetime.utcnow() - timedelta(days=1)
+        _successful_build(db_session, two_days_ago)
+        _successful_build(db_session, one_day_ago)
+
+        with patch.dict(app.config, {"INCREMENTAL_BUILD": True}):
+            assert get_incremental_build_cutoff(app, request_build()) == one_day_ago
+
+    def test_get_measure_ids_changed_since(self, db_session):
+        long_ago = datetime.utcnow() - timedelta(days=30)
+        since = datetime.utcnow() - timedelta(days=7)
+
+        unchanged = MeasureVersionWithDimensionFactory(
+            status="APPROVED", published_at=long_ago.date(), updated_at=long_ago, dimensions__updated_at=long_ago
+        )
+        newly_published = MeasureVersionWithDimensionFactory(
+            status="APPROVED",
+            published_at=datetime.utcnow().date(),
+            updated_at=long_ago,
+            dimensions__updated_at=long_ago,
+        )
+        dimension_updated = MeasureVersionWithDimensionFactory(
+            status="APPROVED",
+            published_at=long_ago.date(),
+            updated_at=long_ago,
+            dimensions__updated_at=datetime.utcnow(),
+        )
+        MeasureVersionFactory(status="DRAFT", published_at=None, updated_at=datetime.utcnow())
+
+        assert page_service.get_measure_ids_changed_since(since) == {
+            newly_published.measure_id,
+            dimension_updated.measure_id,
+        }
+        assert unchanged.measure_id not in page_service.get_measure_ids_changed_since(since)
+
+    def test_only_measures_in_measure_ids_are_written(self, db_session, app, tmp_path):
+        first_version = MeasureVersionFactory(status="APPROVED", measure__subtopics__topic__slug="topic")
+        second_version = MeasureVersionFactory(status="APPROVED", measure__subtopics=first_version.measure.subtopics)
+
+        with app.test_request_context(), patch("application.sitebuilder.build.write_measure_versions") as write_patch:
+            build_homepage_and_topic_hierarchy(
+                str(tmp_path), config=app.config, measure_ids={second_version.measure_id}
+            )
+
+        assert [call[0][0] for call in write_patch.call_args_list] == [second_version.measure]
+        assert (tmp_path / "index.html").exists()
+        assert (tmp_path / "topic" / "index.html").exists()
+
+
+class TestParallelBuild:
+    def test_measure_pages_are_written_by_worker_processes(self, db_session, app, tmp_path):
+        measure_versions = [
+            MeasureVersionFactory(
+                status="APPROVED",
+                version="1.0",
+                measure__slug=f"measure-{i}",
+                measure__subtopics__slug="subtopic",
+                measure__subtopics__topic__slug="topic",
+            )
+            for i in range(3)
+        ]
+        measures = [measure_version.measure for measure_version in measure_versions]
+        # Worker processes use their own database connections, so can only see committed data.
+        db_session.session.commit()
+        parent_backend_pid = db.session.execute("SELECT pg_backend_pid()").scalar()
+        db.session.commit()
+
+        with patch.dict(app.config, {"BUILD_PROCESSES": 2, "LOCAL_BUILD": True, "STATIC_MODE": True}):
+            with app.app_context():
+                write_measure_pages(measures, str(tmp_path), app.config)
+
+        for i in range(3):
+            assert (tmp_path / "topic" / "subtopic" / f"measure-{i}" / "1.0" / "index.html").exists()
+            assert (tmp_path / "topic" / "subtopic" / f"measure-{i}" / "latest" / "index.html").exists()
+
+        # The workers left the parent's pooled connection alone, so the parent can carry on using it
+        assert db.session.execute("SELECT pg_backend_pid()").scalar() == parent_backend_pid
+
+    def test_workers_load_each_chunk_of_measures_in_a_fixed_number_of_queries(self, db_session, app, tmp_path):
+        measure_ids = [
+            MeasureVersionWithDimensionFactory(
+                status="APPROVED",
+                version="1.0",
+                dimensions__dimension_chart__chart_object=chart,
+                dimensions__dimension_table__table_object=simple_table(),
+            ).measure_id
+            for i in range(3)
+        ]
+        db.session.commit()
+
+        query_counts = []
+        for chunk in (measure_ids[:1], measure_ids):
+            db.session.expire_all()
+            with patch.dict(app.config, {"LOCAL_BUILD": True, "STATIC_MODE": True}), app.test_request_context():
+                with patch("application.sitebuilder.build._build_worker_application", app):
+                    with count_queries() as query_count:
+                        _write_measure_versions_in_worker(chunk, str(tmp_path), local_build=True)
+            query_counts.append(query_count.total)
+
+        assert query_counts[0] == query_counts[1]
+
+
+class TestPublishableSiteGraph:
+    @staticmethod
+    def _build_site_with_measures(app, build_dir, number_of_measures):
+        for i in range(number_of_measures):
+            MeasureVersionWithDimensionFactory(
+                status="APPROVED",
+                version="1.0",
+                dimensions__dimension_chart__chart_object=chart,
+                dimensions__dimension_table__table_object=simple_table(),
+            )
+        db.session.commit()
+        db.session.expire_all()
+
+        with patch.dict(app.config, {"LOCAL_BUILD": True, "STATIC_MODE": True}), app.test_request_context():
+            with count_queries() as query_count:
+                build_homepage_and_topic_hierarchy(build_dir, config=app.config)
+
+        return query_count.total
+
+    def test_query_count_does_not_grow_with_the_number_of_measures(self, db_session, app, tmp_path):
+        queries_for_one_measure = self._build_site_with_measures(app, str(tmp_path / "one"), 1)
+        queries_for_five_measures = self._build_site_with_measures(app, str(tmp_path / "five"), 4)
+
+        assert queries_for_one_measure == queries_for_five_measures
+
+
+class TestVersionedAssets:
+    @pytest.fixture
+    def asset_app(self, app, tmp_path):
+        base_dir = tmp_path / "base"
+        (base_dir / "application" / "src" / "js").mkdir(parents=True)
+        (base_dir / "application" / "src" / "js" / "all.js").write_text("console.log('hello');")
+        (base_dir / "gulpfile.js").write_text("'use strict';")
+
+        static_folder = base_dir / "application" / "static"
+        for asset_dir in ["javascripts", "stylesheets"]:
+            (static_folder / asset_dir).mkdir(parents=True)
+            (static_folder / asset_dir / "rev-manifest.json").write_text("{}")
+        (static_folder / "javascripts" / "all-abc123.js").write_text("console.log('hello');")
+
+        original_static_folder = app.static_folder
+        app.static_folder = str(static_folder)
+        try:
+            with patch.dict(app.config, {"BASE_DIRECTORY": str(base_dir)}), app.app_context():
+                yield app
+        finally:
+            app.static_folder = original_static_folder
+
+    def test_gulp_only_runs_when_asset_sources_have_changed(self, asset_app, tmp_path):
+        with patch("application.sitebuilder.build.subprocess.run") as run_patch:
+            run_patch.return_value.returncode = 0
+
+            create_versioned_assets(str(tmp_path / "first_build"))
+            create_versioned_assets(str(tmp_path / "second_build"))
+            assert run_patch.call_count == 1
+
+            (tmp_path / "base" / "application" / "src" / "js" / "all.js").write_text("console.log('changed');")
+            create_versioned_assets(str(tmp_path / "third_build"))
+            assert run_patch.call_count == 2
+
+        for build in ["first_build", "second_build", "third_build"]:
+            assert (tmp_path / build / "static" / "javascripts" / "all-abc123.js").exists()
+            assert not (tmp_path / build / "static" / ".asset-sources-fingerprint").exists()
+
+    def test_gulp_runs_again_if_the_last_run_failed(self, asset_app, tmp_path):
+        with patch("application.sitebuilder.build.subprocess.run") as run_patch:
+            run_patch.return_value.returncode = 1
+
+            create_versioned_assets(str(tmp_path / "first_build"))
+            create_versioned_assets(str(tmp_path / "second_build"))
+
+        assert run_patch.call_count == 2
+
+    def test_sync_directory_only_replaces_changed_files_and_removes_deleted_ones(self, tmp_path):
+        source_dir, destination_dir = tmp_path / "source", tmp_path / "destination"
+        (source_dir / "javascripts").mkdir(parents=True)
+        (source_dir / "javascripts" / "all.js").write_text("unchanged")
+        (source_dir / "application.css").write_text("body {}")
+        (source_dir / "removed.js").write_text("removed")
+        sync_directory(str(source_dir), str(destination_dir))
+
+        unchanged_inode = os.stat(destination_dir / "javascripts" / "all.js").st_ino
+        (source_dir / "application.css").write_text("body { margin: 0; }")
+        (source_dir / "removed.js").unlink()
+        sync_directory(str(source_dir), str(destination_dir))
+
+        assert os.stat(destination_dir / "javascripts" / "all.js").st_ino == unchanged_inode
+        assert (destination_dir / "application.css").read_text() == "body { margin: 0; }"
+        assert not (destination_dir / "removed.js").exists()
@@ -6,7 +6,18 @@ import pytest
 import stopit
 
 from application.sitebuilder.build import do_it
-from application.sitebuilder.build_service import build_site, request_build
+from application import db
+from application.sitebuilder import build_service
+from application.sitebuilder.build_service import (
+    BUILD_REQUESTED_CHANNEL,
+    MAX_BUILD_ATTEMPTS,
+    BuildLeaseHeartbeat,
+    build_site,
+    request_build,
+    run_build_worker,
+    _retrieve_and_start_latest_pending_build,
+)
+from application.sitebuilder.models import BuildStatus
 from manage import refresh_materialized_views
 from tests.models import MeasureFactory, MeasureVersionWithDimensionFactory
 from tests.utils import GeneralTestException, UnexpectedMockInvocationException
@@ -24,6 +35,108 @@ def test_build_exceptions_not_suppressed(app):
         assert str(e.value) == "build error"
 
 
+def test_superseding_a_full_rebuild_makes_the_target_build_a_full_rebuild(db_session):
+    superseded_build = request_build(full_rebuild=True)
+    latest_build = request_build()
+
+    target_build = _retrieve_and_start_latest_pending_build(db_session.session)
+
+    assert target_build.id == latest_build.id
+    assert target_build.status == BuildStatus.STARTED
+    assert target_build.full_rebuild is True
+    assert superseded_build.status == BuildStatus.SUPERSEDED
+
+
+def test_request_build_notifies_build_workers(db_session):
+    listener = db.engine.raw_connection()
+    try:
+        listener.connection.autocommit = True
+        with listener.connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {BUILD_REQUESTED_CHANNEL}")
+
+        request_build()
+
+        listener.connection.poll()
+        assert [notify.channel for notify in listener.connection.notifies] == [BUILD_REQUESTED_CHANNEL]
+    finally:
+        listener.invalidate()
+
+
+def test_no_build_is_claimed_while_another_build_holds_a_lease(db_session):
+    running_build = request_build()
+    _retrieve_and_start_latest_pending_build(db_session.session)
+    request_build()
+
+    assert _retrieve_and_start_latest_pending_build(db_session.session) is None
+    assert running_build.lease_expires_at > datetime.utcnow()
+
+
+def test_builds_with_expired_leases_are_reclaimed(db_session):
+    abandoned_build = request_build(full_rebuild=True)
+    _retrieve_and_start_latest_pending_build(db_session.session, lease_seconds=-1)
+    latest_build = request_build()
+
+    target_build = _retrieve_and_start_latest_pending_build(db_session.session)
+
+    assert target_build.id == latest_build.id
+    assert target_build.full_rebuild is True
+    assert abandoned_build.status == BuildStatus.SUPERSEDED
+
+
+def test_builds_whose_lease_keeps_expiring_are_failed(db_session):
+    build = request_build()
+    for _ in range(MAX_BUILD_ATTEMPTS):
+        assert _retrieve_and_start_latest_pending_build(db_session.session, lease_seconds=-1).id == build.id
+
+    assert _retrieve_and_start_latest_pending_build(db_session.session) is None
+    assert build.status == BuildStatus.FAILED
+    assert build.attempts == MAX_BUILD_ATTEMPTS
+
+
+def test_lease_heartbeat_extends_the_lease(db_session):
+    build = request_build()
+    _retrieve_and_start_latest_pending_build(db_session.session, lease_seconds=1)
+
+    BuildLeaseHeartbeat(build, lease_seconds=600).renew()
+
+    db_session.session.refresh(build)
+    assert build.lease_expires_at > datetime.utcnow() + timedelta(seconds=500)
+
+
+def test_build_worker_runs_requested_builds_and_carries_on_after_a_failure(db_session, app):
+    first_build = request_build()
+
+    with patch("application.sitebuilder.build_service.do_it") as do_it_patch, patch.dict(
+        app.config, {"BUILD_POLL_SECONDS": 0, "BUILD_COALESCE_SECONDS": 0}
+    ), stopit.SignalTimeout(10):
+        do_it_patch.side_effect = [GeneralTestException("build error"), None]
+        run_build_worker(app, max_builds=1)
+        second_build = request_build()
+        run_build_worker(app, max_builds=1)
+
+    db_session.session.refresh(first_build)
+    db_session.session.refresh(second_build)
+    assert first_build.status == BuildStatus.FAILED
+    assert first_build.lease_expires_at is None
+    assert second_build.status == BuildStatus.DONE
+
+
+def test_build_records_its_stages(db_session, app):
+    build = request_build()
+
+    def write_pages(app, build, report):
+        with report.stage("Write pages"):
+            pass
+
+    with patch("application.sitebuilder.build_service.do_it", side_effect=write_pages) as do_it_patch:
+        build_site(app)
+
+    db_session.session.refresh(build)
+    assert build.status == BuildStatus.DONE
+    assert [stage["name"] for stage in build.stages] == ["Write pages"]
+    assert do_it_patch.call_args[0][1].id == build.id
+
+
 def test_static_site_build(db_session, single_use_app):
     """
     A basic test for the core flow of the static site builder. This patches/mocks a few of the key integrations to
@@ -32,7 +145,7 @@ def test_static_site_build(db_session, single_use_app):
     2) We mock out the push_site, so that even if the config setting fails, this test will raise an error.
 
     Unfortunately, due to circular dependencies between build/build_service, it's not easy to mock out `deploy_site`.
-    So we mock out the S3FileSystem, which is initialized within `deploy_site`. This will throw an error if invoked.
+    So we mock out the S3Deployer, which is initialized within `deploy_site`. This will throw an error if invoked.
 
     `create_versioned_assets` is mocked out because that function is only needed to generate css/js, which is tested
     in a separate step outside of pytest.
@@ -45,7 +158,7 @@ def test_static_site_build(db_session, single_use_app):
     with patch.dict(single_use_app.config):
         with patch("application.sitebuilder.build.push_site") as push_site_patch:
             with patch("application.sitebuilder.build.pull_current_site") as pull_current_site_patch:
-                with patch("application.sitebuilder.build_service.S3FileSystem") as s3_fs_patch:
+                with patch("application.sitebuilder.build_service.S3Deployer") as s3_fs_patch:
                     with patch("application.dashboard.data_helpers.trello_service") as trello_service_patch:
                         with patch("application.sitebuilder.build.create_versioned_assets"):
                             with patch("application.sitebuilder.build.write_html"):
@@ -114,3 +227,19 @@ def test_static_site_build(db_session, single_use_app):
                                 refresh_materialized_views()
 
                                 do_it(single_use_app, request_build())
+
+
+def test_build_worker_registers_the_exit_handler_once(db_session, app):
+    request_build()
+
+    with patch("application.sitebuilder.build_service.do_it"), patch.dict(
+        app.config, {"BUILD_POLL_SECONDS": 0, "BUILD_COALESCE_SECONDS": 0}
+    ), stopit.SignalTimeout(10):
+        with patch.object(build_service, "_stacktrace_printed_at_exit", False), patch(
+            "application.sitebuilder.build_service.atexit.register"
+        ) as atexit_register:
+            run_build_worker(app, max_builds=1)
+            request_build()
+            run_build_worker(app, max_builds=1)
+
+    assert atexit_register.call_count == 1
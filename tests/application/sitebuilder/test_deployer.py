@@ -0,0 +1,125 @@
+import json
+
+import boto3
+import pytest
+from moto import mock_s3
+
+from application.sitebuilder.deployer import (
+    DEPLOY_MANIFEST_KEY,
+    FIFTEEN_MINUTES_IN_SECONDS,
+    HOUR_IN_SECONDS,
+    YEAR_IN_SECONDS,
+    S3Deployer,
+)
+
+BUCKET_NAME = "test-static-site-bucket"
+REGION = "eu-west-2"
+
+
+@pytest.fixture(scope="function")
+def s3_client(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+
+    with mock_s3():
+        client = boto3.client("s3", region_name=REGION)
+        client.create_bucket(Bucket=BUCKET_NAME, CreateBucketConfiguration={"LocationConstraint": REGION})
+        yield client
+
+
+@pytest.fixture(scope="function")
+def site_dir(tmp_path):
+    (tmp_path / "static" / "javascripts").mkdir(parents=True)
+    (tmp_path / "static" / "javascripts" / "all-abc123.js").write_text("console.log('hello');")
+    (tmp_path / "topic" / "measure").mkdir(parents=True)
+    (tmp_path / "topic" / "measure" / "index.html").write_text("<h1>Measure</h1>")
+    (tmp_path / "topic" / "measure" / "data.csv").write_text('"Ethnicity","Value"\n')
+    (tmp_path / "index.html").write_text("<h1>Home</h1>")
+    (tmp_path / "robots.txt").write_text("User-agent: *")
+
+    return tmp_path
+
+
+def _keys(s3_client):
+    return sorted(obj["Key"] for obj in s3_client.list_objects_v2(Bucket=BUCKET_NAME).get("Contents", []))
+
+
+class TestS3Deployer:
+    def test_first_deploy_uploads_every_file_with_expected_keys_and_headers(self, s3_client, site_dir):
+        report = S3Deployer(BUCKET_NAME, REGION, client=s3_client).deploy(str(site_dir))
+
+        assert report.keys_uploaded == 5
+        assert report.keys_unchanged == 0
+        assert report.bytes_uploaded == sum(f.stat().st_size for f in site_dir.rglob("*") if f.is_file())
+        assert _keys(s3_client) == [
+            DEPLOY_MANIFEST_KEY,
+            "index.html",
+            "robots.txt",
+            "static/javascripts/all-abc123.js",
+            "topic/measure",
+            "topic/measure/data.csv",
+        ]
+
+        measure_page = s3_client.get_object(Bucket=BUCKET_NAME, Key="topic/measure")
+        assert measure_page["ContentType"] == "text/html"
+        assert measure_page["CacheControl"] == f"max-age={FIFTEEN_MINUTES_IN_SECONDS}"
+        versioned_asset = s3_client.get_object(Bucket=BUCKET_NAME, Key="static/javascripts/all-abc123.js")
+        assert versioned_asset["CacheControl"] == f"max-age={YEAR_IN_SECONDS}"
+        robots = s3_client.get_object(Bucket=BUCKET_NAME, Key="robots.txt")
+        assert robots["CacheControl"] == f"max-age={HOUR_IN_SECONDS}"
+
+    def test_unchanged_files_are_not_uploaded_again(self, s3_client, site_dir):
+        S3Deployer(BUCKET_NAME, REGION, client=s3_client).deploy(str(site_dir))
+        (site_dir / "topic" / "measure" / "index.html").write_text("<h1>Updated measure</h1>")
+
+        report = S3Deployer(BUCKET_NAME, REGION, client=s3_client).deploy(str(site_dir))
+
+        assert report.keys_uploaded == 1
+        assert report.keys_unchanged == 4
+        updated_page = s3_client.get_object(Bucket=BUCKET_NAME, Key="topic/measure")
+        assert updated_page["Body"].read() == b"<h1>Updated measure</h1>"
+
+    def test_removed_files_are_deleted(self, s3_client, site_dir):
+        S3Deployer(BUCKET_NAME, REGION, client=s3_client).deploy(str(site_dir))
+        (site_dir / "topic" / "measure" / "data.csv").unlink()
+
+        report = S3Deployer(BUCKET_NAME, REGION, client=s3_client).deploy(str(site_dir))
+
+        assert report.keys_deleted == 1
+        assert "topic/measure/data.csv" not in _keys(s3_client)
+        manifest = json.loads(s3_client.get_object(Bucket=BUCKET_NAME, Key=DEPLOY_MANIFEST_KEY)["Body"].read())
+        assert "topic/measure/data.csv" not in manifest
+
+    def test_removed_files_are_kept_if_delete_removed_is_false(self, s3_client, site_dir):
+        S3Deployer(BUCKET_NAME, REGION, client=s3_client).deploy(str(site_dir))
+        (site_dir / "topic" / "measure" / "data.csv").unlink()
+
+        report = S3Deployer(BUCKET_NAME, REGION, client=s3_client).deploy(str(site_dir), delete_removed=False)
+
+        assert report.keys_deleted == 0
+        assert "topic/measure/data.csv" in _keys(s3_client)
+        manifest = json.loads(s3_client.get_object(Bucket=BUCKET_NAME, Key=DEPLOY_MANIFEST_KEY)["Body"].read())
+        assert "topic/measure/data.csv" in manifest
+
+    def test_objects_not_uploaded_by_a_deploy_are_never_deleted(self, s3_client, site_dir):
+        s3_client.put_object(Bucket=BUCKET_NAME, Key="some/redirect", Body=b"")
+
+        S3Deployer(BUCKET_NAME, REGION, client=s3_client).deploy(str(site_dir))
+
+        assert "some/redirect" in _keys(s3_client)
+
+    def test_manifest_is_kept_privately_out_of_the_site_bucket_if_a_manifest_bucket_is_given(self, s3_client, site_dir):
+        s3_client.create_bucket(Bucket="private-bucket", CreateBucketConfiguration={"LocationConstraint": REGION})
+        s3_client.put_object(Bucket=BUCKET_NAME, Key=DEPLOY_MANIFEST_KEY, Body=b"{}")
+        deployer = S3Deployer(BUCKET_NAME, REGION, client=s3_client, manifest_bucket_name="private-bucket")
+
+        deployer.deploy(str(site_dir))
+        report = deployer.deploy(str(site_dir))
+
+        assert report.keys_uploaded == 0
+        assert DEPLOY_MANIFEST_KEY not in _keys(s3_client)
+        manifest_key = f"deploy-manifests/{BUCKET_NAME}.json"
+        manifest = json.loads(s3_client.get_object(Bucket="private-bucket", Key=manifest_key)["Body"].read())
+        assert "topic/measure/data.csv" in manifest
+        grants = s3_client.get_object_acl(Bucket="private-bucket", Key=manifest_key)["Grants"]
+        assert [grant["Permission"] for grant in grants] == ["FULL_CONTROL"]
@@ -0,0 +1,69 @@
+import time
+
+import pytest
+from sqlalchemy.exc import ProgrammingError
+
+from application import db
+from application.sitebuilder.instrumentation import BuildReport, count_queries
+
+
+class TestCountQueries:
+    def test_counts_queries_made_inside_the_block_only(self, db_session):
+        db.session.execute("SELECT 1")
+
+        with count_queries() as query_count:
+            db.session.execute("SELECT 1")
+            db.session.execute("SELECT 2")
+
+        db.session.execute("SELECT 3")
+
+        assert query_count.total == 2
+        assert query_count.seconds > 0
+
+    def test_failed_queries_are_counted_and_do_not_leave_a_start_time_behind(self, db_session):
+        with count_queries() as query_count:
+            with pytest.raises(ProgrammingError):
+                db.session.execute("SELECT * FROM no_such_table")
+            db.session.rollback()
+            db.session.execute("SELECT 1")
+
+        assert query_count.total == 2
+
+
+class TestBuildReport:
+    def test_records_each_stage_in_order(self, db_session):
+        report = BuildReport()
+
+        with report.stage("First"):
+            db.session.execute("SELECT 1")
+        with report.stage("Second"):
+            pass
+
+        assert [stage["name"] for stage in report.stages] == ["First", "Second"]
+        assert report.stages[0]["query_count"] == 1
+        assert report.stages[1]["query_count"] == 0
+        assert report.stages[0]["wall_time_seconds"] >= 0
+        assert report.stages[0]["files_written"] is None
+
+    def test_counts_files_written_to_the_build_dir_during_the_stage(self, db_session, tmp_path):
+        (tmp_path / "existing.html").write_text("Written before the stage")
+        # Leave a gap bigger than the allowance for coarse file timestamps.
+        time.sleep(0.1)
+        report = BuildReport()
+
+        with report.stage("Write files", str(tmp_path)):
+            (tmp_path / "topic").mkdir()
+            (tmp_path / "topic" / "index.html").write_text("12345")
+            (tmp_path / "data.csv").write_text("1234567890")
+
+        assert report.stages[0]["files_written"] == 2
+        assert report.stages[0]["bytes_written"] == 15
+
+    def test_records_stage_which_raises_an_exception(self, db_session):
+        report = BuildReport()
+
+        with pytest.raises(ValueError):
+            with report.stage("Failing"):
+                raise ValueError("Stage failed")
+
+        assert [stage["name"] for stage in report.stages] == ["Failing"]
@@ -1,6 +1,9 @@
+from unittest.mock import patch
+
 import pytest
 
 from application.cms.filters import html_line_breaks
+from application.cms.markdown import CachedMarkdownRenderer
 from application.static_site.filters import render_markdown
 from application.static_site.filters import html_params
 
@@ -44,6 +47,38 @@ class TestRenderMarkdown:
         assert render_markdown(input_text) == expected_output
 
 
+class TestCachedMarkdownRenderer:
+    def test_repeated_text_is_only_rendered_once(self):
+        renderer = CachedMarkdownRenderer()
+
+        with patch.object(renderer, "convert", wraps=renderer.convert) as convert_patch:
+            first_html = renderer.render("* blah")
+            second_html = renderer.render("* blah")
+
+        assert first_html == second_html == render_markdown("* blah")
+        assert convert_patch.call_count == 1
+        assert (renderer.hits, renderer.misses) == (1, 1)
+
+    def test_least_recently_used_text_is_evicted(self):
+        renderer = CachedMarkdownRenderer(max_size=2)
+        renderer.render("first")
+        renderer.render("second")
+        renderer.render("first")
+        renderer.render("third")
+
+        renderer.render("first")
+        renderer.render("second")
+
+        assert (renderer.hits, renderer.misses) == (2, 4)
+
+    def test_link_references_do_not_leak_between_texts(self):
+        renderer = CachedMarkdownRenderer()
+        renderer.render("[gov.uk][ref]\n\n[ref]: https://gov.uk")
+
+        assert renderer.render("[gov.uk][ref]") == '<p class="govuk-body">[gov.uk][ref]</p>'
+        assert renderer.render("") == ""
+
+
 class TestHtmlParams:
     """
     html_params is a helper filter which converts a Python dictionary into
@@ -1,5 +1,6 @@
 import datetime
 import re
+from unittest.mock import patch
 
 import pytest
 from bs4 import BeautifulSoup
@@ -7,6 +8,7 @@ from flask import url_for
 
 from application.auth.models import User, TypeOfUser
 from application.cms.models import UKCountry, TypeOfData, TESTING_SPACE_SLUG
+from application.cms.upload_service import upload_service
 from application.config import Config
 from tests.models import (
     MeasureVersionFactory,
@@ -233,6 +235,30 @@ def test_get_file_download_returns_404(test_app_client, logged_in_rdu_user):
     assert resp.status_code == 404
 
 
+def test_get_file_download_streams_quoted_csv_in_windows_1252(test_app_client, logged_in_rdu_user, tmp_path):
+    measure_version = MeasureVersionFactory(uploads__title="test file", uploads__file_name="test-file.csv")
+    source_dir = tmp_path / str(measure_version.measure.id) / measure_version.version / "source"
+    source_dir.mkdir(parents=True)
+    (source_dir / "test-file.csv").write_bytes("Ethnicity,Value\nCafé,5\n".encode("utf-8"))
+
+    # The upload service uses the file service of whichever app it was last initialised with
+    with patch.object(upload_service.app.file_service.system, "root", str(tmp_path)):
+        resp = test_app_client.get(
+            url_for(
+                "static_site.measure_version_file_download",
+                topic_slug=measure_version.measure.subtopic.topic.slug,
+                subtopic_slug=measure_version.measure.subtopic.slug,
+                measure_slug=measure_version.measure.slug,
+                version=measure_version.version,
+                filename="test-file.csv",
+            )
+        )
+
+    assert resp.status_code == 200
+    assert resp.headers["Content-Disposition"] == 'attachment; filename="test-file.csv"'
+    assert resp.data == '"Ethnicity","Value"\n"Café","5"\n'.encode("windows-1252")
+
+
 @flaky(max_runs=10, min_passes=1)
 def test_version_history(test_app_client, logged_in_rdu_user):
 
@@ -1,4 +1,10 @@
-from application.utils import get_csv_data_for_download
+import io
+
+from application import db
+from application.cms.models import Ethnicity
+from application.sitebuilder.instrumentation import count_queries
+from application.utils import SlugIndex, iter_csv_data_for_download
+from tests.models import EthnicityFactory
 
 
 def test_adds_quotes():
@@ -6,7 +12,10 @@ def test_adds_quotes():
 
     csv_with_quotes = '"Ethnicity","Value"\n"Black","10"\n"White","12.2"\n'
 
-    assert get_csv_data_for_download(csv_with_no_quotes) == csv_with_quotes
+    with open(csv_with_no_quotes, "rb") as csv_file:
+        csv_bytes = io.BytesIO(csv_file.read())
+
+    assert "".join(iter_csv_data_for_download(csv_bytes)) == csv_with_quotes
 
 
 def test_only_adds_quotes_to_non_quoted_values():
@@ -14,9 +23,66 @@ def test_only_adds_quotes_to_non_quoted_values():
 
     csv_with_quotes = '"Ethnicity","Value","Description"\n"Black","10","Test"\n"White","12.2","This is a ""test"""\n'
 
-    assert get_csv_data_for_download(csv_with_embedded_quotes) == csv_with_quotes
+    with open(csv_with_embedded_quotes, "rb") as csv_file:
+        csv_bytes = io.BytesIO(csv_file.read())
+
+    assert "".join(iter_csv_data_for_download(csv_bytes)) == csv_with_quotes
+
+
+def test_iter_csv_data_for_download_yields_quoted_lines_with_normalised_line_endings():
+    csv_bytes = b'Ethnicity,Value,Notes\r\nBlack,10,"Two\r\nlines"\r\nWhite,12.2,\r\n'
+
+    assert list(iter_csv_data_for_download(io.BytesIO(csv_bytes))) == [
+        '"Ethnicity","Value","Notes"\n',
+        '"Black","10","Two\nlines"\n',
+        '"White","12.2",""\n',
+    ]
+
+
+def test_iter_csv_data_for_download_strips_utf8_byte_order_mark():
+    csv_bytes = "\ufeffEthnicity,Value\nMixed – other,5\n".encode("utf-8")
+
+    assert list(iter_csv_data_for_download(io.BytesIO(csv_bytes))) == ['"Ethnicity","Value"\n', '"Mixed – other","5"\n']
+
+
+def test_iter_csv_data_for_download_reads_non_utf8_files_as_iso_8859_1():
+    csv_bytes = "Ethnicity,Value\nCafé,5\n".encode("iso-8859-1")
+
+    assert list(iter_csv_data_for_download(io.BytesIO(csv_bytes))) == ['"Ethnicity","Value"\n', '"Café","5"\n']
 
 
 def test_base_template_renders_page_built_at_comment(test_app_client, logged_in_rdu_user):
     response = test_app_client.get("/", follow_redirects=True)
     assert "<!-- Page built at" in response.get_data(as_text=True)
+
+
+class TestSlugIndex:
+    def test_finds_the_row_with_a_slug_with_one_query_once_indexed(self, db_session):
+        EthnicityFactory(id=1, value="White British")
+        mixed = EthnicityFactory(id=2, value="Mixed: White & Asian")
+        slug_index = SlugIndex(Ethnicity, Ethnicity.value)
+        slug_index.rebuild()
+
+        with count_queries() as query_count:
+            assert slug_index.get("mixed-white-asian") == mixed
+
+        assert query_count.total == 1
+
+    def test_finds_the_row_with_the_lowest_primary_key_when_slugs_clash(self, db_session):
+        EthnicityFactory(id=2, value="Any other ethnic group")
+        first = EthnicityFactory(id=1, value="Any other ethnic-group")
+
+        assert SlugIndex(Ethnicity, Ethnicity.value).get("any-other-ethnic-group") == first
+
+    def test_finds_rows_added_or_renamed_since_it_was_indexed(self, db_session):
+        renamed = EthnicityFactory(id=1, value="Black")
+        slug_index = SlugIndex(Ethnicity, Ethnicity.value)
+        assert slug_index.get("black") == renamed
+
+        renamed.value = "Black British"
+        added = EthnicityFactory(id=2, value="Black")
+        db.session.commit()
+
+        assert slug_index.get("black") == added
+        assert slug_index.get("black-british") == renamed
+        assert slug_index.get("white") is None
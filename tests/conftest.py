@@ -236,16 +236,15 @@ def mock_create_and_send_activation_email(mocker):
 
 
 @pytest.fixture(scope="function")
-def mock_get_measure_download(mocker):
-    def get(upload, filename, source):
-        return upload.file_name
-
-    return mocker.patch("application.static_site.views.upload_service.get_measure_download", side_effect=get)
+def mock_open_measure_download(mocker):
+    return mocker.patch("application.static_site.views.upload_service.open_measure_download")
 
 
 @pytest.fixture(scope="function")
-def mock_get_csv_data_for_download(mocker):
-    return mocker.patch("application.static_site.views.get_csv_data_for_download", return_value="i do not care")
+def mock_iter_csv_data_for_download(mocker):
+    return mocker.patch(
+        "application.static_site.views.iter_csv_data_for_download", return_value=iter(["i do not care"])
+    )
 
 
 @pytest.fixture(scope="function")